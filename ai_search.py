@@ -1,7 +1,9 @@
 import csv
 import json
 import os
+import time
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
@@ -27,44 +29,94 @@ from azure.search.documents.indexes.models import (
     VectorSearchAlgorithmMetric,
     VectorSearchProfile,
 )
+from azure.search.documents.models import VectorizedQuery
 from tqdm import tqdm
 
 from tools.azure_env import AzureEnv
+from tools.bulk_delete import bulk_delete, print_delete_report
+from tools.chunking import CHUNK_OVERSAMPLE, collapse_to_parents
+from tools.hnsw_sweep import DEFAULT_HNSW_PROFILE, load_hnsw_profile
+from tools.index_diff import DIFF_FIELDS, execute_plan, plan_diff, print_plan, write_plan
+from tools.index_export import export_jsonl
+from tools.local_hybrid import LocalHybridIndex
+from tools.local_text_index import LocalTextIndex
+from tools.local_vector_index import LocalVectorIndex
 
 backend_dir = Path(__file__).parent
+SEARCH_MANY_CONCURRENCY = 8
+VECTOR_FIELDS = "TitleVector,ContentVector"
+
+
+def vector_query(vector: list[float], k: int) -> VectorizedQuery:
+    """Nearest neighbour query over both vector fields of the index"""
+    return VectorizedQuery(vector=vector, k_nearest_neighbors=k, fields=VECTOR_FIELDS)
 
 
 class AISearch:
-    def __init__(self, azure_env: AzureEnv):
+    def __init__(self, azure_env: AzureEnv, local_index: LocalVectorIndex = None, local_text_index: LocalTextIndex = None):
         self.azure_env = azure_env
+        # When set, vector and text searches run against these exported snapshots instead of the search service
+        self.local_index = local_index
+        self.local_text_index = local_text_index
+        # Fuses the two local indexes for hybrid_search, replace it to tune the RRF weights
+        self.local_hybrid_index = None
         self.search_client = azure_env.search_client
         self.search_index_client = azure_env.search_index_client
         self.openai_helper = azure_env.openai_helper
+        self.query_embedding_cache = azure_env.query_embedding_cache
+        self.search_result_cache = azure_env.search_result_cache
 
-    def text_search(self, text):
-        results = self.search_client.search(search_text=text)
+    def text_search(self, text, k=None, print_results=True):
+        if self.local_text_index is not None:
+            # The service returns 50 results when no top is given
+            results = self.local_text_index.search(text, k=(k or 50) * CHUNK_OVERSAMPLE)
+        else:
+            results = self.search_client.search(search_text=text, top=k * CHUNK_OVERSAMPLE if k else None)
 
-        results_list = list(results)
+        results_list = collapse_to_parents(list(results), k)
 
-        for i, result in enumerate(results_list):
-            print(f"\nTitle:\n{result['Title']}")
-            print(f"Source:\n{result['Source']}\n")
-
-    def vector_search(self, query, k=1, print_results=False):
-        results = self.search_client.search(
-            search_text=None,
-            vector=self.openai_helper.generate_embeddings(query),
-            vector_fields="TitleVector,ContentVector",
-            select=["Title", "Content", "Source"],
-            top=k,
-        )
+        if print_results:
+            for i, result in enumerate(results_list):
+                print(f"\nTitle:\n{result['Title']}")
+                print(f"Source:\n{result['Source']}\n")
 
-        results_list = list(results)
+        return results_list
 
-        for i, result in enumerate(results_list):
-            results_list[i]["@search.score"] = result["@search.score"] * 100
+    def cached_search(self, mode: str, query: str, k: int, select: list[str], search) -> list[dict]:
+        """Run `search` through the search result cache, local snapshots are searched directly"""
+        if self.search_result_cache is None or self.local_index is not None or self.local_text_index is not None:
+            return search()
 
-            if print_results:
+        return self.search_result_cache.get_or_search(self.search_client.index_id, mode, query, k, select, search)
+
+    def vector_search(self, query, k=1, print_results=False, vector=None):
+        select = ["ArticleId", "ParentId", "Title", "Content", "Source"]
+
+        def search():
+            query_vector = vector if vector is not None else self.query_embedding_cache.get(query)
+
+            if self.local_index is not None:
+                results = self.local_index.search(query_vector, k=k * CHUNK_OVERSAMPLE, select=select)
+            else:
+                results = self.search_client.search(
+                    search_text=None,
+                    vector_queries=[vector_query(query_vector, k * CHUNK_OVERSAMPLE)],
+                    select=select,
+                    top=k * CHUNK_OVERSAMPLE,
+                )
+
+            # Chunks of the same document compete for the top k, keep only the best one per parent
+            results_list = collapse_to_parents(list(results), k)
+
+            for i, result in enumerate(results_list):
+                results_list[i]["@search.score"] = result["@search.score"] * 100
+
+            return results_list
+
+        results_list = self.cached_search("vector", query, k, select, search)
+
+        if print_results:
+            for i, result in enumerate(results_list):
                 print(f"\nTitle:\n{result['Title']}")
                 print(f"Score:\n{result['@search.score']}")
                 print(f"Source:\n{result['Source']}\n")
@@ -73,53 +125,67 @@ class AISearch:
 
         return results_list
 
-    def hybrid_search(self, query, k=3, print_results=False):
-        results = self.search_client.search(
-            search_text=query,
-            vector=self.openai_helper.generate_embeddings(query),
-            vector_fields="TitleVector,ContentVector",
-            top=k,
-        )
+    def hybrid_search(self, query, k=3, print_results=False, vector=None):
+        def search():
+            query_vector = vector if vector is not None else self.query_embedding_cache.get(query)
 
-        results_list = list(results)
+            if self.local_index is not None and self.local_text_index is not None:
+                if self.local_hybrid_index is None:
+                    self.local_hybrid_index = LocalHybridIndex(self.local_text_index, self.local_index)
 
-        for i, result in enumerate(results_list):
-            print(f"\nTitle: {result['Title']}")
-            print(f"Source:\n{result['Source']}")
-            print(f"Labels:\n{result['Labels']}")
+                results = self.local_hybrid_index.search(query, query_vector, k=k * CHUNK_OVERSAMPLE)
+            else:
+                results = self.search_client.search(
+                    search_text=query,
+                    vector_queries=[vector_query(query_vector, k * CHUNK_OVERSAMPLE)],
+                    top=k * CHUNK_OVERSAMPLE,
+                )
+
+            return collapse_to_parents(list(results), k)
+
+        results_list = self.cached_search("hybrid", query, k, None, search)
+
+        if print_results:
+            for i, result in enumerate(results_list):
+                print(f"\nTitle: {result['Title']}")
+                print(f"Source:\n{result['Source']}")
+                print(f"Labels:\n{result['Labels']}")
 
         return results_list
 
-    def semantic_vector_search(self, query, k=1, print_results=False):
-        results = self.search_client.search(
-            search_text=query,
-            vector=VectorizedQuery(
-                value=self.openai_helper.generate_embeddings(query),
-                k=k,
-                fields="titleVector,contentVector",
-            ),
-            select=["Title", "Content", "Source"],
-            query_type="semantic",
-            query_language="en-us",
-            semantic_configuration_name="vector-semantic-config",
-            query_caption="extractive",
-            query_answer="extractive",
-            top=k,
-        )
+    def semantic_vector_search(self, query, k=1, print_results=False, vector=None):
+        select = ["ArticleId", "ParentId", "Title", "Content", "Source"]
+
+        def search():
+            results = self.search_client.search(
+                search_text=query,
+                vector_queries=[vector_query(vector if vector is not None else self.query_embedding_cache.get(query), k * CHUNK_OVERSAMPLE)],
+                select=select,
+                query_type="semantic",
+                semantic_configuration_name="semantic-config",
+                query_caption="extractive",
+                query_answer="extractive",
+                top=k * CHUNK_OVERSAMPLE,
+            )
+
+            results_list = collapse_to_parents(list(results), k)
+
+            # semantic_answers = results.get_answers()
+            # for answer in semantic_answers:
+            #     if answer.highlights:
+            #         print(f"Semantic Answer: {answer.highlights}")
+            #     else:
+            #         print(f"Semantic Answer: {answer.text}")
+            #     print(f"Semantic Answer Score: {answer.score}\n")
 
-        results_list = list(results)
+            for i, result in enumerate(results_list):
+                results_list[i]["@search.score"] = result["@search.score"] * 1000
 
-        # semantic_answers = results.get_answers()
-        # for answer in semantic_answers:
-        #     if answer.highlights:
-        #         print(f"Semantic Answer: {answer.highlights}")
-        #     else:
-        #         print(f"Semantic Answer: {answer.text}")
-        #     print(f"Semantic Answer Score: {answer.score}\n")
+            return results_list
 
-        for i, result in enumerate(results_list):
-            results_list[i]["@search.score"] = result["@search.score"] * 1000
+        results_list = self.cached_search("semantic", query, k, select, search)
 
+        for i, result in enumerate(results_list):
             if print_results:
                 print(f"\nTitle:\n{result['Title']}")
                 print(f"Score:\n{result['@search.score']}")
@@ -137,10 +203,63 @@ class AISearch:
 
         return results_list
 
-    def create_search_index(self, index_name=None):
+    def search_many(self, queries: list[str], mode: str = "hybrid", k: int = 3, concurrency: int = SEARCH_MANY_CONCURRENCY) -> list[dict]:
+        """
+        Run many searches concurrently without printing anything.
+
+        All query embeddings are requested in one batch up front, then the searches are issued through a
+        bounded thread pool. A failed search is reported in its result instead of failing the batch.
+
+        Args:
+            queries (list[str]): The search queries.
+            mode (str, optional): One of "text", "vector", "hybrid" or "semantic". Defaults to "hybrid".
+            k (int, optional): The number of documents per query. Defaults to 3.
+            concurrency (int, optional): The number of searches in flight. Defaults to SEARCH_MANY_CONCURRENCY.
+
+        Returns:
+            list[dict]: One {"query", "results", "latency", "error"} per query in the order of `queries`, latency in seconds.
+        """
+        searches = {
+            "text": lambda query, vector: self.text_search(query, k=k, print_results=False),
+            "vector": lambda query, vector: self.vector_search(query, k=k, vector=vector),
+            "hybrid": lambda query, vector: self.hybrid_search(query, k=k, vector=vector),
+            "semantic": lambda query, vector: self.semantic_vector_search(query, k=k, vector=vector),
+        }
+        if mode not in searches:
+            raise ValueError(f"Unknown search mode {mode}, expected one of {', '.join(searches)}")
+
+        vectors = self.query_embedding_cache.get_many(queries) if mode != "text" else [None] * len(queries)
+
+        def search(query, vector):
+            start = time.perf_counter()
+            try:
+                results, error = searches[mode](query, vector), None
+            except Exception as e:
+                results, error = [], str(e)
+
+            return {"query": query, "results": results, "latency": time.perf_counter() - start, "error": error}
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(search, queries, vectors))
+
+    def create_search_index(self, index_name=None, hnsw_profile: dict = None):
+        """
+        Create or update a search index.
+
+        Args:
+            index_name (str, optional): The index name.
+            hnsw_profile (dict, optional): The vector search settings, e.g. from tools/hnsw_sweep.py. Defaults to DEFAULT_HNSW_PROFILE.
+        """
+        hnsw_profile = {**DEFAULT_HNSW_PROFILE, **(hnsw_profile or {})}
+        # A sweep can find that exhaustive KNN beats HNSW, e.g. for a small index
+        vector_search_profile_name = "ExhaustiveKnnProfile" if hnsw_profile["algorithm"] == "exhaustiveKnn" else "HnswProfile"
+
         # Create a search index
         fields = [
-            SimpleField(name="ArticleId", type=SearchFieldDataType.String, key=True),
+            # Sortable and filterable so exports and backups can page through the index by key
+            SimpleField(name="ArticleId", type=SearchFieldDataType.String, key=True, filterable=True, sortable=True),
+            # ArticleId of the document a chunk was split from, equal to ArticleId for the document itself
+            SimpleField(name="ParentId", type=SearchFieldDataType.String, filterable=True),
             SearchableField(
                 name="Title",
                 type=SearchFieldDataType.String,
@@ -167,14 +286,14 @@ class AISearch:
                 type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
                 searchable=True,
                 vector_search_dimensions=1536,
-                vector_search_profile_name="HnswProfile",
+                vector_search_profile_name=vector_search_profile_name,
             ),
             SearchField(
                 name="ContentVector",
                 type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
                 searchable=True,
                 vector_search_dimensions=1536,
-                vector_search_profile_name="HnswProfile",
+                vector_search_profile_name=vector_search_profile_name,
             ),
         ]
 
@@ -184,9 +303,9 @@ class AISearch:
                     name="Hnsw",
                     kind=VectorSearchAlgorithmKind.HNSW,
                     parameters=HnswParameters(
-                        m=4,
-                        ef_construction=400,
-                        ef_search=500,
+                        m=hnsw_profile["m"],
+                        ef_construction=hnsw_profile["ef_construction"],
+                        ef_search=hnsw_profile["ef_search"],
                         metric=VectorSearchAlgorithmMetric.COSINE,
                     ),
                 ),
@@ -261,11 +380,7 @@ class AISearch:
 
         results = self.find_documents(search_fields=search_fields, search_text=search_text, select=select)
 
-        print("Documents Deleted: ", len(results))
-
-        for i, result in enumerate(results):
-            print(f"Deleting {result['ArticleId']}")
-            self.search_client.upload_documents({"@search.action": "delete", "ArticleId": str(result["ArticleId"])})
+        print_delete_report(bulk_delete(self.search_client, [result["ArticleId"] for result in results]))
 
     def get_documents(self, search_fields: list = [], search_text: str = "*", select: list = [], file_type: str = "json"):
         results = self.find_documents(search_fields=search_fields, search_text=search_text, select=select, log_results=log_results)
@@ -300,6 +415,72 @@ class AISearch:
             with open(os.path.join(backend_dir, "indexes", self.azure_env.stage, f"{brand}-index-english.json"), "w+", encoding="utf-8") as f:
                 json.dump(results, f, ensure_ascii=False, indent=4)
 
+    def export_documents(self, path: str = None, vectors: bool = False) -> str:
+        """
+        Stream the whole index to indexes/{stage}/{index}.jsonl, with vectors in {index}.vectors.jsonl if requested.
+
+        Args:
+            path (str, optional): The JSONL file. Defaults to indexes/{stage}/{index}.jsonl.
+            vectors (bool, optional): Also export the vector fields to the side file. Defaults to False.
+
+        Returns:
+            str: The path of the export.
+        """
+        if path is None:
+            path = os.path.join(backend_dir, "indexes", self.azure_env.stage, f"{self.azure_env.INDEX_NAME}.jsonl")
+        vectors_path = path.removesuffix(".jsonl") + ".vectors.jsonl" if vectors else None
+
+        index = self.search_index_client.get_index(self.azure_env.INDEX_NAME)
+        count = export_jsonl(self.search_client, index, path, vectors_path=vectors_path)
+
+        print(f"Exported {count} documents to {path}")
+        if vectors_path:
+            print(f"Exported their vectors to {vectors_path}")
+
+        return path
+
+    def plan_promotion(self, source_path: str, fields: list[str] = DIFF_FIELDS) -> dict:
+        """
+        Plan the changes that make this index match an export of another one, e.g. promoting dev to prod.
+
+        This index is exported first to indexes/{stage}/{index}.target.jsonl, apart from the exports that
+        are promoted, and diffed against `source_path` by content hash. The plan is written next to the
+        export, see apply_plan to execute it.
+
+        Args:
+            source_path (str): The JSONL export with the wanted documents.
+            fields (list[str], optional): The fields compared. Defaults to DIFF_FIELDS.
+
+        Returns:
+            dict: The plan from plan_diff.
+        """
+        target_path = os.path.join(backend_dir, "indexes", self.azure_env.stage, f"{self.azure_env.INDEX_NAME}.target.jsonl")
+        if os.path.abspath(source_path) == os.path.abspath(target_path):
+            raise ValueError(f"{source_path} would be overwritten by the export of the target index")
+        self.export_documents(target_path)
+
+        plan = plan_diff(source_path, target_path, fields=fields)
+        print_plan(plan)
+
+        plan_path = target_path.removesuffix(".jsonl") + ".plan.json"
+        write_plan(plan, plan_path)
+        print(f"Plan written to {plan_path}")
+
+        return plan
+
+    def apply_plan(self, plan: dict) -> dict:
+        """Upload and delete only the planned documents, with vectors from the source export's side file if it has one"""
+        vectors_path = plan["source"].removesuffix(".jsonl") + ".vectors.jsonl"
+        report = execute_plan(self.search_client, plan, vectors_path=vectors_path if os.path.exists(vectors_path) else None)
+
+        print(f"Documents uploaded: {report['uploaded']}, deleted: {report['deleted']}")
+        if report["failed"]:
+            print(f"Failed for {len(report['failed'])} documents:")
+            for key, message in report["failed"].items():
+                print(f"{key}: {message}")
+
+        return report
+
     def document_source_breakdown(self):
         with open(os.path.join(backend_dir, "indexes", self.azure_env.stage, "clo3d-index-english.json"), "r", encoding="utf-8") as f:
             documents = json.load(f)
@@ -318,7 +499,7 @@ class AISearch:
         with open(os.path.join(backend_dir, "indexes", "dev", "clo3d-index-english.json"), "r", encoding="utf-8") as f:
             dev_documents = json.load(f)
 
-            prod_sources = [prod_document["Source"] for prod_document in prod_documents]
+            prod_sources = set(prod_document["Source"] for prod_document in prod_documents)
             dev_sources_not_in_prod = set([dev_document["Source"] for dev_document in dev_documents if dev_document["Source"] not in prod_sources])
 
             for source in sorted(dev_sources_not_in_prod):
@@ -334,7 +515,11 @@ if __name__ == "__main__":
             "Create Search Index",
             "Delete Search Index",
             "Get Documents",
+            "Export Documents (JSONL)",
+            "Promote Documents From Export",
             "Search Documents (Hybrid, Text, or Vector)",
+            "Search Local Vector Index",
+            "Search Local Text Index",
             "Find Documents",
             "Delete Documents",
             "Delete Posts By Age",
@@ -347,7 +532,11 @@ if __name__ == "__main__":
 
     if task == "Create Search Index":
         index_name = questionary.text("Index Name?").ask()
-        cognitive_search.create_search_index(index_name)
+        profile_path = os.path.join(backend_dir, "indexes", env, f"{index_name}.hnsw.json")
+        hnsw_profile = None
+        if os.path.exists(profile_path) and questionary.confirm(f"Use the HNSW profile {profile_path}?").ask():
+            hnsw_profile = load_hnsw_profile(profile_path)
+        cognitive_search.create_search_index(index_name, hnsw_profile=hnsw_profile)
 
     elif task == "Delete Search Index":
         cognitive_search.drop_search_index()
@@ -369,12 +558,50 @@ if __name__ == "__main__":
         search_text = questionary.text("Search Text?", default="*").ask()
 
         if search_type == "Hybrid":
-            cognitive_search.hybrid_search(search_text)
+            cognitive_search.hybrid_search(search_text, print_results=True)
         elif search_type == "Text":
             cognitive_search.text_search(search_text)
         elif search_type == "Vector":
             cognitive_search.vector_search(search_text)
 
+    elif task == "Export Documents (JSONL)":
+        vectors = questionary.confirm("Export vectors too?", default=False).ask()
+        cognitive_search.export_documents(vectors=vectors)
+
+    elif task == "Promote Documents From Export":
+        source_path = questionary.path(
+            "Export to promote?", default=os.path.join(backend_dir, "indexes", "dev", f"{cognitive_search.azure_env.INDEX_NAME}.jsonl")
+        ).ask()
+        plan = cognitive_search.plan_promotion(source_path)
+
+        if (plan["add"] or plan["update"] or plan["delete"]) and questionary.confirm(f"Apply the plan to {env}?", default=False).ask():
+            cognitive_search.apply_plan(plan)
+
+    elif task == "Search Local Vector Index":
+        export_path = questionary.path(
+            "Export?", default=os.path.join(backend_dir, "indexes", env, f"{cognitive_search.azure_env.INDEX_NAME}.jsonl")
+        ).ask()
+        search_text = questionary.text("Search Text?").ask()
+
+        vectors_path = export_path.removesuffix(".jsonl") + ".vectors.jsonl"
+        cognitive_search.local_index = LocalVectorIndex.load(export_path, vectors_path=vectors_path if os.path.exists(vectors_path) else None)
+        cognitive_search.vector_search(search_text, k=3, print_results=True)
+
+    elif task == "Search Local Text Index":
+        index_path = os.path.join(backend_dir, "indexes", env, f"{cognitive_search.azure_env.INDEX_NAME}.bm25.npz")
+        if os.path.exists(index_path):
+            cognitive_search.local_text_index = LocalTextIndex.load(index_path)
+        else:
+            corpus_path = questionary.path(
+                "Export or corpus folder?", default=os.path.join(backend_dir, "indexes", env, f"{cognitive_search.azure_env.INDEX_NAME}.jsonl")
+            ).ask()
+            cognitive_search.local_text_index = LocalTextIndex.from_paths([corpus_path])
+            cognitive_search.local_text_index.save(index_path)
+            print(f"Saved the text index to {index_path}")
+
+        search_text = questionary.text("Search Text?").ask()
+        cognitive_search.text_search(search_text, k=3)
+
     elif task == "Delete Posts By Age":
         age = questionary.text("Age(in years)?", default="3").ask()
         cognitive_search.delete_posts(os.path.join(backend_dir, "indexes", env, "clo3d-index-english.json"), age=age)
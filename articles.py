@@ -3,20 +3,26 @@ import multiprocessing
 import os
 import re
 import sys
+import time
 from pathlib import Path
 
 import questionary
 import requests
 
 from tools.azure_env import AzureEnv
+from tools.bulk_delete import bulk_delete, print_delete_report
+from tools.chunking import add_chunk_documents, has_parent_field, stale_chunk_keys
+from tools.indexing_batcher import index_documents, print_indexing_report
 from tools.misc import (
     extract_youtube_links,
-    get_section_and_category,
     num_tokens_from_string,
     remove_html_tags,
     remove_miscellaneous_text,
     trim_tokens,
 )
+from tools.zendesk_sync import ZendeskSyncState, get_section_and_category, get_translation, iter_incremental_articles, iter_listed_articles
+
+backend_dir = Path(__file__).parent
 
 
 class Article:
@@ -35,6 +41,64 @@ class Article:
 
         return json.loads(page_url.text)
 
+    @staticmethod
+    def is_indexable(brand, article):
+        """Whether a Zendesk article belongs in the index: published, visible to everyone and not in an excluded section"""
+        if article["draft"] is not False or article["user_segment_id"] is not None:
+            return False
+
+        # CLO3D:
+        # 115001436607 - Update Article Section
+        # 115012589987 - Requested by John to exclude in CLO3D
+        # 360005512874 - References Article Section that has PDF attachments
+        # 360002306994 - Lessons Section
+        # CLOSET:
+        # 5026352977423, 6280973212175 - Update Article Section
+        # 360001149855, 360001011655, 360000854796 - Joining Connect
+        # 7975498603663 - Account Section, CVF Articles Cover this section
+        if (brand == "clo3d" and (article["section_id"] in [360005512874, 360002306994] or article["id"] in [115012589987])) or (
+            brand == "closet" and article["section_id"] in [5026352977423, 6280973212175, 360001149855, 360001011655, 360000854796, 7975498603663]
+        ):
+            return False
+
+        return True
+
+    @staticmethod
+    def to_document(azure_env, brand, article):
+        """Clean up a Zendesk article into an index document, before chunking and embedding"""
+        if brand == "clo3d":
+            article["html_url"] = re.findall(rf"https:\/\/support\.clo3d\.com\/hc\/{azure_env.get_locale()}\/articles\/\d+", article["html_url"])[0]
+        elif brand == "closet":
+            article["html_url"] = re.findall(rf"https:\/\/support\.clo-set\.com\/hc\/{azure_env.get_locale()}\/articles\/\d+", article["html_url"])[0]
+        elif brand == "clovf":
+            article["html_url"] = re.findall(rf"https:\/\/clovf\.zendesk\.com\/hc\/{azure_env.get_locale()}\/articles\/\d+", article["html_url"])[0]
+        elif brand == "md":
+            article["html_url"] = re.findall(
+                rf"https:\/\/support\.marvelousdesigner\.com\/hc\/{azure_env.get_locale()}\/articles\/\d+", article["html_url"]
+            )[0]
+
+        article["youtube_links"] = extract_youtube_links(str(article["body"]))
+        article["body"] = remove_html_tags(str(article["body"]))
+        article["body"] = remove_miscellaneous_text(article["body"])
+        article["body"] = trim_tokens(article["body"])
+        article["id"] = str(article["id"])
+        article["section_id"], article["section"], article["category_id"], article["category"] = get_section_and_category(
+            azure_env, article["section_id"]
+        )
+
+        return {
+            "ArticleId": article["id"],
+            "Source": article["html_url"],
+            "Title": article["title"],
+            "Content": article["body"],
+            "Tokens": num_tokens_from_string(article["body"], "gpt-3.5-turbo"),
+            "SectionId": article["section_id"],
+            "Section": article["section"],
+            "CategoryId": article["category_id"],
+            "Category": article["category"],
+            "YoutubeLinks": article["youtube_links"],
+        }
+
     @staticmethod
     def get_zendesk_documents(stage, brand, language, article_path, page):
         print("Getting Zendesk Articles for page: " + str(page))
@@ -51,64 +115,7 @@ class Article:
 
         json_objects = json.loads(page_url.text)
 
-        documents = []
-        for article in json_objects["articles"]:
-            if article["draft"] is False and article["user_segment_id"] is None:
-                # CLO3D:
-                # 115001436607 - Update Article Section
-                # 115012589987 - Requested by John to exclude in CLO3D
-                # 360005512874 - References Article Section that has PDF attachments
-                # 360002306994 - Lessons Section
-                # CLOSET:
-                # 5026352977423, 6280973212175 - Update Article Section
-                # 360001149855, 360001011655, 360000854796 - Joining Connect
-                # 7975498603663 - Account Section, CVF Articles Cover this section
-                if (brand == "clo3d" and (article["section_id"] in [360005512874, 360002306994] or article["id"] in [115012589987])) or (
-                    brand == "closet"
-                    and article["section_id"] in [5026352977423, 6280973212175, 360001149855, 360001011655, 360000854796, 7975498603663]
-                ):
-                    continue
-
-                if brand == "clo3d":
-                    article["html_url"] = re.findall(
-                        rf"https:\/\/support\.clo3d\.com\/hc\/{azure_env.get_locale()}\/articles\/\d+", article["html_url"]
-                    )[0]
-                elif brand == "closet":
-                    article["html_url"] = re.findall(
-                        rf"https:\/\/support\.clo-set\.com\/hc\/{azure_env.get_locale()}\/articles\/\d+", article["html_url"]
-                    )[0]
-                elif brand == "clovf":
-                    article["html_url"] = re.findall(
-                        rf"https:\/\/clovf\.zendesk\.com\/hc\/{azure_env.get_locale()}\/articles\/\d+", article["html_url"]
-                    )[0]
-                elif brand == "md":
-                    article["html_url"] = re.findall(
-                        rf"https:\/\/support\.marvelousdesigner\.com\/hc\/{azure_env.get_locale()}\/articles\/\d+", article["html_url"]
-                    )[0]
-
-                article["youtube_links"] = extract_youtube_links(str(article["body"]))
-                article["body"] = remove_html_tags(str(article["body"]))
-                article["body"] = remove_miscellaneous_text(article["body"])
-                article["body"] = trim_tokens(article["body"])
-                article["id"] = str(article["id"])
-                article["section_id"], article["section"], article["category_id"], article["category"] = get_section_and_category(
-                    azure_env, article["section_id"]
-                )
-
-                documents.append(
-                    {
-                        "ArticleId": article["id"],
-                        "Source": article["html_url"],
-                        "Title": article["title"],
-                        "Content": article["body"],
-                        "Tokens": num_tokens_from_string(article["body"], "gpt-3.5-turbo"),
-                        "SectionId": article["section_id"],
-                        "Section": article["section"],
-                        "CategoryId": article["category_id"],
-                        "Category": article["category"],
-                        "YoutubeLinks": article["youtube_links"],
-                    }
-                )
+        documents = [Article.to_document(azure_env, brand, article) for article in json_objects["articles"] if Article.is_indexable(brand, article)]
 
         if len(documents) > 0:
             with open(os.path.join(article_path, f"page_{page}.json"), "w+", encoding="utf-8") as f:
@@ -144,25 +151,48 @@ class Article:
         with open(os.path.join(article_path, file), "r", encoding="utf-8") as f:
             documents = json.load(f)
 
-            for i, document in enumerate(documents):
-                if document["Content"] == "":
-                    document["Content"] = document["Title"]
-
-                documents[i]["@search.action"] = "mergeOrUpload"
-                documents[i]["TitleVector"] = azure_env.openai_helper.generate_embeddings(text=document["Title"])
-                documents[i]["ContentVector"] = azure_env.openai_helper.generate_embeddings(text=document["Content"])
-                del documents[i]["Tokens"]
-                del documents[i]["SectionId"]
-                del documents[i]["Section"]
-                del documents[i]["CategoryId"]
-                del documents[i]["Category"]
-
-            if brand == "clovf":
-                # Upload clovf articles to both clo3d and clo-set
-                AzureEnv(env, "clo3d").search_client.upload_documents(documents)
-                # AzureEnv(env, "closet").search_client.upload_documents(documents)
-            else:
-                azure_env.search_client.upload_documents(documents)
+        print_indexing_report(Article.index_article_documents(azure_env, documents))
+
+    @staticmethod
+    def target_search_client(azure_env):
+        if azure_env.brand == "clovf":
+            # clovf articles are indexed with clo3d's, clo-set does not get them yet
+            return AzureEnv(azure_env.stage, "clo3d").search_client
+
+        return azure_env.search_client
+
+    @staticmethod
+    def index_article_documents(azure_env, documents):
+        """Chunk, embed and upload documents from to_document, returns the indexing report"""
+        for document in documents:
+            if document["Content"] == "":
+                document["Content"] = document["Title"]
+
+        search_client = Article.target_search_client(azure_env)
+
+        # Long articles also get one child document per token window of their Content, if the index has ParentId
+        if has_parent_field(search_client):
+            documents = add_chunk_documents(documents)
+
+        # Embed every Title and Content in the file with as few requests as possible
+        vectors = azure_env.openai_helper.generate_embeddings_batch(
+            [document["Title"] for document in documents] + [document["Content"] for document in documents]
+        )
+
+        for i, document in enumerate(documents):
+            documents[i]["@search.action"] = "mergeOrUpload"
+            documents[i]["TitleVector"] = vectors[i]
+            documents[i]["ContentVector"] = vectors[len(documents) + i]
+            del documents[i]["Tokens"]
+            del documents[i]["SectionId"]
+            del documents[i]["Section"]
+            del documents[i]["CategoryId"]
+            del documents[i]["Category"]
+
+        # Remove chunks left over from a longer version of an article
+        documents += [{"@search.action": "delete", "ArticleId": key} for key in stale_chunk_keys(search_client, documents)]
+
+        return index_documents(search_client, documents)
 
     def mp_upload_documents(self):
         file_paths = sorted(os.listdir(self.azure_env.get_article_path()), key=lambda x: int(x.partition("_")[2].partition(".")[0]))
@@ -178,26 +208,120 @@ class Article:
             p.close()
             p.join()
 
+    def localize(self, article):
+        """The article in the environment's locale, None if it has no translation in it"""
+        if article["locale"] == self.azure_env.get_locale():
+            return article
+
+        translation = get_translation(self.azure_env, article["id"])
+        if translation is None:
+            return None
+
+        return {**article, **{key: translation[key] for key in ("title", "body", "draft", "html_url", "locale") if key in translation}}
+
+    def apply_changes(self, articles):
+        """
+        Index the indexable articles and delete the rest, with their chunks.
+
+        Returns:
+            tuple: The indexed and deleted ids, and whether every change was applied.
+        """
+        brand = self.azure_env.brand
+        documents = [Article.to_document(self.azure_env, brand, article) for article in articles if Article.is_indexable(brand, article)]
+        indexed = [document["ArticleId"] for document in documents]
+        deleted = [str(article["id"]) for article in articles if str(article["id"]) not in indexed]
+
+        succeeded = True
+        if documents:
+            report = Article.index_article_documents(self.azure_env, documents)
+            print_indexing_report(report)
+            succeeded = not report["failed"]
+        if deleted:
+            report = bulk_delete(Article.target_search_client(self.azure_env), deleted)
+            print_delete_report(report)
+            succeeded = succeeded and not report["failed"]
+
+        return indexed, deleted, succeeded
+
+    def reconcile_zendesk_documents(self, state):
+        """
+        Compare the ids the help center lists with the indexed ids, indexing the unknown articles and deleting the missing ones.
+
+        Returns:
+            bool: Whether every change was applied.
+        """
+        listed = {str(article["id"]): article for article in iter_listed_articles(self.azure_env)}
+        known = state.article_ids
+
+        # The listing of known articles is already up to date through the export
+        articles = [article for key, article in listed.items() if key not in known and Article.is_indexable(self.azure_env.brand, article)]
+        articles += [{"id": key, "draft": True} for key in known if key not in listed]
+
+        indexed, deleted, succeeded = self.apply_changes(articles)
+        if succeeded:
+            state.reconciled([key for key in listed if key in known or key in indexed])
+        print(f"Reconciled: indexed {len(indexed)} and deleted {len(deleted)} articles")
+
+        return succeeded
+
+    def sync_zendesk_documents(self, reconcile=False):
+        """
+        Index only the articles that changed since the last sync, from the help center incremental export.
+
+        The watermark of every brand and locale is kept in .cache/zendesk_sync/{brand}-{locale}.json. The
+        first sync lists every article instead, as the export returns articles in their source locale and
+        other locales would need a translation request per article. Changed articles that became drafts,
+        restricted or moved to an excluded section are deleted. Archived articles are missing from the export
+        rather than changed, so every ZENDESK_RECONCILE_DAYS days, or with `reconcile`, the ids the help center
+        lists are compared with the indexed ids. The watermark only moves past a page once all of its changes
+        were applied, so a failed sync is repeated from that page.
+
+        Args:
+            reconcile (bool, optional): List every article to find deleted ones now. Defaults to False.
+        """
+        state = ZendeskSyncState(os.path.join(backend_dir, ".cache", "zendesk_sync", f"{self.azure_env.brand}-{self.azure_env.get_locale()}.json"))
+
+        if state.start_time is None:
+            start_time = int(time.time())
+            print("First sync, listing every article")
+            if self.reconcile_zendesk_documents(state):
+                state.advance(start_time, [], [])
+            return
+
+        print(f"Syncing Zendesk articles changed since {state.start_time}")
+        for page in iter_incremental_articles(self.azure_env, state.start_time):
+            articles = [self.localize(article) or {**article, "draft": True} for article in page["articles"]]
+
+            indexed, deleted, succeeded = self.apply_changes(articles)
+            if not succeeded:
+                print(f"Stopped at {state.start_time}, the next sync retries the failed articles")
+                return
+
+            state.advance(page["end_time"], indexed, deleted)
+            print(f"Indexed {len(indexed)} and deleted {len(deleted)} articles, synced up to {page['end_time']}")
+
+        if reconcile or state.needs_reconcile():
+            print("Listing every article to find deleted ones")
+            self.reconcile_zendesk_documents(state)
+
     def delete_document(self, article_id: str | list):
         print(f"Deleting {article_id}")
 
-        if isinstance(article_id, list):
-            for id in article_id:
-                result = self.search_client.upload_documents({"@search.action": "delete", "ArticleId": id})
-        else:
-            result = self.search_client.upload_documents({"@search.action": "delete", "ArticleId": article_id})
+        article_ids = article_id if isinstance(article_id, list) else [article_id]
+        print_delete_report(bulk_delete(self.search_client, article_ids))
 
     def delete_excluded_documents(self, brand):
         headers = {
             "Content-Type": "application/json",
         }
 
-        response = requests.request("GET", self.zendesk_article_api_endpoint, headers=headers)
+        response = requests.request("GET", self.azure_env.get_zendesk_article_api_endpoint(1), headers=headers)
         json_objects = json.loads(response.text)
         page_count = json_objects["page_count"]
 
+        excluded_ids = []
         for page in range(1, 1 + page_count):
-            response = requests.request("GET", self.azure_env.get_zendesk_articles_api_endpoint(page), headers=headers)
+            response = requests.request("GET", self.azure_env.get_zendesk_article_api_endpoint(page), headers=headers)
             json_objects = json.loads(response.text)
             articles = json_objects["articles"]
 
@@ -211,14 +335,18 @@ class Article:
                     7975498603663,
                 ]:
                     print(article["id"])
-                    self.search_client.upload_documents({"@search.action": "delete", "ArticleId": str(article["id"])})
+                    excluded_ids.append(str(article["id"]))
+
+        print_delete_report(bulk_delete(self.search_client, excluded_ids))
 
 
 if __name__ == "__main__":
     stage = questionary.select("Which stage?", choices=["prod", "dev"]).ask()
     brand = questionary.select("Which brand?", choices=["clo3d", "closet", "clovf", "md"]).ask()
     language = questionary.select("Which language?", choices=["English", "Korean"]).ask()
-    task = questionary.select("What task?", choices=["Get Zendesk Article", "Get All Zendesk Articles", "Delete Articles", "Upload Articles"]).ask()
+    task = questionary.select(
+        "What task?", choices=["Get Zendesk Article", "Get All Zendesk Articles", "Sync Zendesk Articles", "Delete Articles", "Upload Articles"]
+    ).ask()
     article = Article(AzureEnv(stage, brand, language))
 
     if task == "Get Zendesk Article":
@@ -228,6 +356,9 @@ if __name__ == "__main__":
     elif task == "Get All Zendesk Articles":
         article.mp_get_zendesk_documents()
 
+    elif task == "Sync Zendesk Articles":
+        article.sync_zendesk_documents(reconcile=questionary.confirm("List every article to find deleted ones?", default=False).ask())
+
     elif task == "Upload Articles":
         article.mp_upload_documents()
 
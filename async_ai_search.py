@@ -0,0 +1,213 @@
+import asyncio
+import time
+
+import questionary
+from azure.search.documents.aio import SearchClient
+
+from ai_search import vector_query
+from tools.azure_env import AzureEnv
+from tools.chunking import CHUNK_OVERSAMPLE, collapse_to_parents
+from tools.openai_helper import EMBEDDING_MAX_BATCH_INPUTS
+from tools.query_embedding_cache import normalize_query
+from tools.search_cache import index_id
+
+# Seconds a single retrieval may take, embedding included, before it is abandoned
+SEARCH_REQUEST_TIMEOUT = 10.0
+# Searches in flight at once per process
+SEARCH_MAX_CONCURRENCY = 64
+
+SEARCH_SELECT = {
+    "text": None,
+    "vector": ["ArticleId", "ParentId", "Title", "Content", "Source"],
+    "hybrid": None,
+    "semantic": ["ArticleId", "ParentId", "Title", "Content", "Source"],
+}
+# Same score scaling as the AISearch methods, so cached results are interchangeable
+SEARCH_SCORE_SCALE = {"text": 1, "vector": 100, "hybrid": 1, "semantic": 1000}
+
+
+class AsyncAISearch:
+    """
+    asyncio search API for serving retrievals under concurrent load.
+
+    Searches go through the azure-search-documents aio client and query embeddings through
+    AsyncAzureOpenAI, each with one connection pool per instance. Concurrent requests for the same
+    query share one embedding request, and results share AISearch's query embedding and search result
+    caches. Every retrieval is bounded by a timeout.
+
+    The clients are bound to the event loop they are created in, so use it as an async context manager
+    inside the loop that serves requests:
+
+        async with AsyncAISearch(AzureEnv("prod", "clo3d")) as search:
+            results = await search.search("how to install", mode="hybrid", k=3)
+    """
+
+    def __init__(self, azure_env: AzureEnv, timeout: float = SEARCH_REQUEST_TIMEOUT, max_concurrency: int = SEARCH_MAX_CONCURRENCY):
+        self.azure_env = azure_env
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+
+        self.query_embedding_cache = azure_env.query_embedding_cache
+        self.search_result_cache = azure_env.search_result_cache
+        self.index_id = index_id(azure_env.SEARCH_CLIENT_ENDPOINT, azure_env.INDEX_NAME)
+
+        self.search_client = None
+        self.openai_helper = None
+        self.semaphore = None
+        self._pending_embeddings = {}
+
+    async def __aenter__(self) -> "AsyncAISearch":
+        self.search_client = SearchClient(
+            endpoint=self.azure_env.SEARCH_CLIENT_ENDPOINT,
+            index_name=self.azure_env.INDEX_NAME,
+            credential=self.azure_env.AZURE_KEY_CREDENTIAL,
+        )
+        self.openai_helper = self.azure_env.create_async_openai_helper()
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        await self.search_client.close()
+        await self.openai_helper.close()
+
+    async def embed(self, query: str) -> list[float]:
+        """Embed a query, sharing one request between concurrent callers of the same query"""
+        vector = self.query_embedding_cache.peek(query)
+        if vector is not None:
+            return vector
+
+        key = normalize_query(query)
+        task = self._pending_embeddings.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.openai_helper.generate_embeddings([query]))
+            self._pending_embeddings[key] = task
+            task.add_done_callback(lambda _: self._pending_embeddings.pop(key, None))
+
+        # Shielded so one caller timing out does not cancel the request for the others
+        vector = (await asyncio.shield(task))[0]
+        self.query_embedding_cache.put(query, vector)
+
+        return vector
+
+    async def embed_many(self, queries: list[str]) -> None:
+        """Embed every query missing from the query embedding cache, in as few requests as possible"""
+        # The first query of each missing normalized form, embedded as written
+        missing = {}
+        for query in queries:
+            if self.query_embedding_cache.peek(query) is None:
+                missing.setdefault(normalize_query(query), query)
+        missing = list(missing.values())
+
+        for start in range(0, len(missing), EMBEDDING_MAX_BATCH_INPUTS):
+            batch = missing[start : start + EMBEDDING_MAX_BATCH_INPUTS]
+            for query, vector in zip(batch, await self.openai_helper.generate_embeddings(batch)):
+                self.query_embedding_cache.put(query, vector)
+
+    async def _search(self, query: str, mode: str, k: int) -> list[dict]:
+        select = SEARCH_SELECT[mode]
+
+        results = self.search_result_cache.get(self.index_id, mode, query, k, select) if self.search_result_cache else None
+        if results is not None:
+            return results
+
+        generation = self.search_result_cache.generations.get(self.index_id) if self.search_result_cache else None
+
+        kwargs = {"search_text": query, "select": select, "top": k * CHUNK_OVERSAMPLE}
+        if mode != "text":
+            kwargs["vector_queries"] = [vector_query(await self.embed(query), k * CHUNK_OVERSAMPLE)]
+        if mode == "vector":
+            kwargs["search_text"] = None
+        if mode == "semantic":
+            kwargs.update(
+                query_type="semantic",
+                semantic_configuration_name="semantic-config",
+                query_caption="extractive",
+                query_answer="extractive",
+            )
+
+        async with self.semaphore:
+            response = await self.search_client.search(**kwargs)
+            documents = [document async for document in response]
+
+        results = collapse_to_parents(documents, k)
+        for result in results:
+            result["@search.score"] = result["@search.score"] * SEARCH_SCORE_SCALE[mode]
+
+        if self.search_result_cache:
+            self.search_result_cache.put(self.index_id, mode, query, k, results, select, generation=generation)
+
+        return results
+
+    async def search(self, query: str, mode: str = "hybrid", k: int = 3, timeout: float = None) -> list[dict]:
+        """
+        Retrieve the top `k` documents for a query.
+
+        Args:
+            query (str): The search query.
+            mode (str, optional): One of "text", "vector", "hybrid" or "semantic". Defaults to "hybrid".
+            k (int, optional): The number of documents. Defaults to 3.
+            timeout (float, optional): Seconds before giving up. Defaults to the instance's timeout.
+
+        Returns:
+            list[dict]: The documents, shaped like the results of the matching AISearch method.
+
+        Raises:
+            asyncio.TimeoutError: If the retrieval takes longer than the timeout.
+        """
+        if mode not in SEARCH_SELECT:
+            raise ValueError(f"Unknown search mode {mode}, expected one of {', '.join(SEARCH_SELECT)}")
+
+        return await asyncio.wait_for(self._search(query, mode, k), timeout or self.timeout)
+
+    async def search_many(self, queries: list[str], mode: str = "hybrid", k: int = 3, timeout: float = None) -> list[dict]:
+        """
+        Run many retrievals concurrently, embedding all queries in one batch first.
+
+        If the batch fails or times out, every query embeds on its own inside its own timeout, so one bad
+        batch only costs the queries whose own embedding fails.
+
+        Returns:
+            list[dict]: One {"query", "results", "latency", "error"} per query, like AISearch.search_many.
+        """
+        if mode != "text":
+            try:
+                await asyncio.wait_for(self.embed_many(queries), timeout or self.timeout)
+            except Exception:
+                # The queries left out of the cache fall back to embed() in their own search
+                pass
+
+        async def timed_search(query):
+            start = time.perf_counter()
+            try:
+                results, error = await self.search(query, mode=mode, k=k, timeout=timeout), None
+            except asyncio.TimeoutError:
+                results, error = [], "Timed out"
+            except Exception as e:
+                results, error = [], str(e)
+
+            return {"query": query, "results": results, "latency": time.perf_counter() - start, "error": error}
+
+        return await asyncio.gather(*[timed_search(query) for query in queries])
+
+
+if __name__ == "__main__":
+    env = questionary.select("Which environment?", choices=["prod", "dev"]).ask()
+    brand = questionary.select("Which brand?", choices=["clo3d", "closet", "md", "allinone"]).ask()
+    mode = questionary.select("Search Type?", choices=list(SEARCH_SELECT)).ask()
+    queries = questionary.text("Search Texts? (separated by |)").ask().split("|")
+
+    async def main():
+        async with AsyncAISearch(AzureEnv(env, brand)) as search:
+            for response in await search.search_many(queries, mode=mode):
+                print(f"\n{response['query']} ({response['latency'] * 1000:.0f} ms)")
+                if response["error"]:
+                    print(f"Error: {response['error']}")
+
+                for result in response["results"]:
+                    print(f"{result['Title']}\n{result['Source']}")
+
+    asyncio.run(main())
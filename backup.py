@@ -1,12 +1,30 @@
 import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
 
+import questionary
 import tqdm
 from azure.core.credentials import AzureKeyCredential
 from azure.identity import DefaultAzureCredential
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
 
 from tools.azure_env import AzureEnv
+from tools.backup_checkpoint import BackupCheckpoint
+from tools.chunking import CHUNK_LOOKUP_BATCH_SIZE
+from tools.index_export import iter_documents_keyset, odata_string, strip_search_metadata
+from tools.index_snapshot import latest_snapshot, restore_snapshot, write_snapshot
+from tools.indexing_batcher import INDEXING_MAX_BATCH_SIZE, IndexingBatcher
+from tools.key_partitions import key_range_filter, partition_keys
+from tools.search_cache import IndexGenerations, InvalidatingSearchClient, InvalidatingSearchIndexClient, index_generations_directory
+
+backend_dir = Path(__file__).parent
+BACKUP_PAGE_SIZE = INDEXING_MAX_BATCH_SIZE
+BACKUP_READERS = 8
+BACKUP_UPLOADERS = 8
+# Pages of one key range uploading at once
+BACKUP_PAGES_IN_FLIGHT = 2
 
 
 class BackupAISearch:
@@ -17,42 +35,117 @@ class BackupAISearch:
         self.target_endpoint = target_endpoint
         self.target_credential = target_credential
         self.target_index_name = target_index_name
+        self.key_field = None
+        self.batcher = None
+        self._stop = threading.Event()
 
     def create_clients(self, endpoint, credential, index_name):
-        search_client = SearchClient(endpoint=endpoint, index_name=index_name, credential=credential)
-        index_client = SearchIndexClient(endpoint=endpoint, credential=credential)
+        # Writes to the target, and recreating it, invalidate the cached search results of the index
+        generations = IndexGenerations(index_generations_directory())
+        search_client = InvalidatingSearchClient(endpoint=endpoint, index_name=index_name, credential=credential, generations=generations)
+        index_client = InvalidatingSearchIndexClient(endpoint=endpoint, credential=credential, generations=generations)
         return search_client, index_client
 
     def total_count(self, search_client):
         response = search_client.search(include_total_count=True, search_text="*", top=0)
         return response.get_count()
 
-    def search_results_with_filter(self, search_client, key_field_name):
-        last_item = None
-        response = search_client.search(search_text="*", top=100000, order_by=key_field_name).by_page()
-        while True:
-            for page in response:
-                page = list(page)
-                if len(page) > 0:
-                    last_item = page[-1]
-                    yield page
-                else:
-                    last_item = None
-
-            if last_item:
-                response = search_client.search(
-                    search_text="*", top=100000, order_by=key_field_name, filter=f"{key_field_name} gt '{last_item[key_field_name]}'"
-                ).by_page()
-            else:
-                break
-
     def search_results_without_filter(self, search_client):
         response = search_client.search(search_text="*", top=100000).by_page()
         for page in response:
             page = list(page)
             yield page
 
-    def backup_and_restore_index(self, source_endpoint, source_key, source_index_name, target_endpoint, target_key, target_index_name):
+    def upload_page(self, page):
+        """Upload one page of documents, returns the number uploaded and {key: error message} of the rest"""
+        result = self.batcher.send(page)
+        return result["indexed"], result["failed"]
+
+    def copy_partition(self, source_search_client, checkpoint, partition, uploaders, progress_bar):
+        """Read one key range in key order and upload it page by page, acknowledging pages to the checkpoint in order"""
+        state = checkpoint.partitions[partition]
+        documents = iter_documents_keyset(
+            source_search_client,
+            self.key_field,
+            page_size=BACKUP_PAGE_SIZE,
+            filter=key_range_filter(self.key_field, state["low"], state["high"]),
+            after=state["last_key"],
+        )
+
+        in_flight = deque()
+
+        def acknowledge_oldest():
+            future, last_key = in_flight.popleft()
+            uploaded, failed = future.result()
+            checkpoint.acknowledge(partition, last_key, uploaded, failed)
+            progress_bar.update(uploaded + len(failed))
+
+        page = []
+        for document in documents:
+            if self._stop.is_set():
+                return
+
+            page.append(document)
+            if len(page) == BACKUP_PAGE_SIZE:
+                in_flight.append((uploaders.submit(self.upload_page, page), page[-1][self.key_field]))
+                page = []
+
+                # Bounds the documents held in memory, and the checkpoint only moves past pages that were acknowledged
+                if len(in_flight) >= BACKUP_PAGES_IN_FLIGHT:
+                    acknowledge_oldest()
+
+        if page:
+            in_flight.append((uploaders.submit(self.upload_page, page), page[-1][self.key_field]))
+        while in_flight:
+            acknowledge_oldest()
+
+        checkpoint.finish(partition)
+
+    def retry_failed(self, source_search_client, checkpoint):
+        """Read the documents the target rejected before from the source again and upload them"""
+        keys = list(checkpoint.failed)
+        for start in range(0, len(keys), CHUNK_LOOKUP_BATCH_SIZE):
+            batch = keys[start : start + CHUNK_LOOKUP_BATCH_SIZE]
+            page = [
+                strip_search_metadata(document)
+                for document in source_search_client.search(
+                    search_text="*", filter=f"search.in({self.key_field}, {odata_string(','.join(batch))}, ',')", top=len(batch)
+                )
+            ]
+
+            uploaded, failed = self.upload_page(page) if page else (0, {})
+            # Keys that are gone from the source have nothing left to copy, so only the new failures stay
+            checkpoint.retried(batch, uploaded, failed)
+
+    def backup_and_restore_index(
+        self,
+        source_endpoint,
+        source_key,
+        source_index_name,
+        target_endpoint,
+        target_key,
+        target_index_name,
+        readers=BACKUP_READERS,
+        uploaders=BACKUP_UPLOADERS,
+        checkpoint_path=None,
+    ):
+        """
+        Copy an index to another index, possibly on another service, resuming an interrupted copy.
+
+        With a sortable, filterable key, the key space is split into ranges that `readers` threads page
+        through concurrently, feeding a pool of `uploaders` threads. Progress is checkpointed to a local
+        state file after every acknowledged page, so running the same backup again after an interruption
+        continues from the last acknowledged key of every range and retries the documents the target rejected.
+        The state file is removed once every document is copied.
+
+        Args:
+            readers (int, optional): Key ranges read concurrently. Defaults to BACKUP_READERS.
+            uploaders (int, optional): Upload requests in flight. Defaults to BACKUP_UPLOADERS.
+            checkpoint_path (str, optional): The state file. Defaults to .cache/backups/{source}-{target}.json.
+
+        Returns:
+            tuple: The source and target search clients, and {"copied": count, "failed": {key: error message}}.
+        """
         # Create search and index clients
         source_search_client, source_index_client = self.create_clients(source_endpoint, source_key, source_index_name)
         target_search_client, target_index_client = self.create_clients(target_endpoint, target_key, target_index_name)
@@ -60,6 +153,7 @@ class BackupAISearch:
         # Get the source index definition
         source_index = source_index_client.get_index(name=source_index_name)
         non_retrievable_fields = []
+        key_field = None
         for field in source_index.fields:
             if field.hidden == True:
                 non_retrievable_fields.append(field)
@@ -68,6 +162,7 @@ class BackupAISearch:
 
         if not key_field:
             raise Exception("Key Field Not Found")
+        self.key_field = key_field.name
 
         if len(non_retrievable_fields) > 0:
             print(
@@ -78,39 +173,119 @@ class BackupAISearch:
         source_index.name = target_index_name
         target_index_client.create_or_update_index(source_index)
 
+        # One batcher for every uploader thread, so they share what the target tolerates
+        self.batcher = IndexingBatcher(target_search_client, key_field=self.key_field)
+
         document_count = self.total_count(source_search_client)
-        can_use_filter = key_field.sortable and key_field.filterable
-        if not can_use_filter:
-            print("WARNING: The key field is not filterable or not sortable. A maximum of 100,000 records can be backed up and restored.")
-        # Backup and restore documents
-        all_documents = (
-            self.search_results_with_filter(source_search_client, key_field.name)
-            if can_use_filter
-            else self.search_results_without_filter(source_search_client)
-        )
+        if not (key_field.sortable and key_field.filterable):
+            print("WARNING: The key field is not filterable or not sortable. A maximum of 100,000 records can be backed up and restored, without resuming.")
+            return self.backup_and_restore_serially(source_search_client, target_search_client, document_count)
+
+        source = f"{source_endpoint}/indexes/{source_index_name}"
+        target = f"{target_endpoint}/indexes/{target_index_name}"
+        checkpoint = BackupCheckpoint(checkpoint_path or os.path.join(backend_dir, ".cache", "backups", f"{source_index_name}-{target_index_name}.json"))
+
+        if checkpoint.matches(source, target):
+            print(f"Resuming the backup from {checkpoint.path}")
+        else:
+            # Several ranges per reader, so one slow range does not leave the other readers idle
+            partitions = partition_keys(source_search_client, self.key_field, max(BACKUP_PAGE_SIZE, document_count // (readers * 4)))
+            checkpoint.start(source, target, partitions)
+            print(f"Split {document_count} documents into {len(partitions)} key ranges")
 
         print("Backing up and restoring documents:")
-        failed_documents = 0
-        failed_keys = []
-        with tqdm.tqdm(total=document_count) as progress_bar:
-            for page in all_documents:
-                result = target_search_client.upload_documents(documents=page)
-                progress_bar.update(len(result))
-
-                for item in result:
-                    if item.succeeded is not True:
-                        failed_documents += 1
-                        failed_keys.append(page[result.index_of(item)].id)
-                        print(f"Document upload error: {item.error.message}")
-
-        if failed_documents > 0:
-            print(f"Failed documents: {failed_documents}")
-            print(f"Failed document keys: {failed_keys}")
+        self._stop.clear()
+        with tqdm.tqdm(total=document_count, initial=checkpoint.copied) as progress_bar, ThreadPoolExecutor(
+            max_workers=uploaders
+        ) as upload_executor, ThreadPoolExecutor(max_workers=readers) as read_executor:
+            futures = [
+                read_executor.submit(self.copy_partition, source_search_client, checkpoint, partition, upload_executor, progress_bar)
+                for partition, state in enumerate(checkpoint.partitions)
+                if not state["done"]
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Stop every reader at its next document, the checkpoint already holds what was acknowledged
+                self._stop.set()
+                raise
+
+        if checkpoint.failed:
+            print(f"Retrying {len(checkpoint.failed)} failed documents")
+            self.retry_failed(source_search_client, checkpoint)
+
+        report = {"copied": checkpoint.copied, "failed": dict(checkpoint.failed)}
+        if not all(state["done"] for state in checkpoint.partitions):
+            print(f"The backup stopped before every key range was copied, run it again to resume from {checkpoint.path}")
+        elif report["failed"]:
+            print(f"Failed documents: {len(report['failed'])}")
+            for key, message in report["failed"].items():
+                print(f"{key}: {message}")
+            print(f"Run the backup again to retry them, the state is kept in {checkpoint.path}")
         else:
+            checkpoint.delete()
             print("All documents uploaded successfully.")
+            print(f"Successfully backed up '{source_index_name}' and restored to '{target_index_name}'")
+
+        return source_search_client, target_search_client, report
+
+    def backup_and_restore_serially(self, source_search_client, target_search_client, document_count):
+        report = {"copied": 0, "failed": {}}
+        with tqdm.tqdm(total=document_count) as progress_bar:
+            for page in self.search_results_without_filter(source_search_client):
+                page = [strip_search_metadata(document) for document in page]
+                for start in range(0, len(page), BACKUP_PAGE_SIZE):
+                    uploaded, failed = self.upload_page(page[start : start + BACKUP_PAGE_SIZE])
+                    report["copied"] += uploaded
+                    report["failed"].update(failed)
+                progress_bar.update(len(page))
+
+        for key, message in report["failed"].items():
+            print(f"Document upload error {key}: {message}")
+
+        return source_search_client, target_search_client, report
+
+    def snapshot_index(self, endpoint, credential, index_name, incremental=False, vector_dtype="float32"):
+        """
+        Back up an index to snapshots/{index}/{timestamp}, see tools/index_snapshot.py for the format.
+
+        Args:
+            incremental (bool, optional): Only store what changed since the latest snapshot of the index. Defaults to False.
+            vector_dtype (str, optional): "float32" or "float16". Defaults to "float32".
+
+        Returns:
+            str: The snapshot's directory.
+        """
+        search_client, index_client = self.create_clients(endpoint, credential, index_name)
 
-        print(f"Successfully backed up '{source_index_name}' and restored to '{target_index_name}'")
-        return source_search_client, target_search_client, all_documents
+        snapshots_directory = os.path.join(backend_dir, "snapshots", index_name)
+        base = latest_snapshot(snapshots_directory) if incremental else None
+        if incremental and base is None:
+            print("No previous snapshot, writing a full one")
+
+        directory = os.path.join(snapshots_directory, datetime.now().strftime("%Y%m%d-%H%M%S"))
+        manifest = write_snapshot(search_client, index_client.get_index(index_name), directory, base=base, vector_dtype=vector_dtype)
+
+        print(f"Snapshot of {manifest['total']} documents written to {directory}")
+        if base:
+            print(f"Stored {manifest['documents']} changed documents and {len(manifest['deleted'])} deletions since {base}")
+
+        return directory
+
+    def restore_index(self, directory, endpoint, credential, index_name):
+        """Create an index from a snapshot and upload its documents"""
+        search_client, index_client = self.create_clients(endpoint, credential, index_name)
+
+        report = restore_snapshot(directory, index_client, search_client, index_name)
+
+        print(f"Restored {report['uploaded']} documents to '{index_name}'")
+        if report["failed"]:
+            print(f"Failed documents: {len(report['failed'])}")
+            for key, message in report["failed"].items():
+                print(f"{key}: {message}")
+
+        return report
 
 
 if __name__ == "__main__":
@@ -128,6 +303,18 @@ if __name__ == "__main__":
 
     backup = BackupAISearch(source_endpoint, source_credential, source_index_name, target_endpoint, target_credential, target_index_name)
 
-    source_search_client, target_search_client, all_documents = backup.backup_and_restore_index(
-        source_endpoint, source_credential, source_index_name, target_endpoint, target_credential, target_index_name
-    )
+    task = questionary.select("What task?", choices=["Copy Index", "Snapshot Index", "Restore Snapshot"]).ask()
+
+    if task == "Copy Index":
+        source_search_client, target_search_client, report = backup.backup_and_restore_index(
+            source_endpoint, source_credential, source_index_name, target_endpoint, target_credential, target_index_name
+        )
+
+    elif task == "Snapshot Index":
+        incremental = questionary.confirm("Only store changes since the latest snapshot?", default=True).ask()
+        vector_dtype = questionary.select("Vector precision?", choices=["float32", "float16"]).ask()
+        backup.snapshot_index(source_endpoint, source_credential, source_index_name, incremental=incremental, vector_dtype=vector_dtype)
+
+    elif task == "Restore Snapshot":
+        directory = questionary.path("Snapshot?", default=latest_snapshot(os.path.join(backend_dir, "snapshots", source_index_name)) or "").ask()
+        backup.restore_index(directory, target_endpoint, target_credential, target_index_name)
@@ -0,0 +1,167 @@
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import questionary
+
+from ai_search import SEARCH_MANY_CONCURRENCY, AISearch
+from tools.azure_env import AzureEnv
+
+backend_dir = Path(__file__).parent
+SEARCH_MODES = ["text", "vector", "hybrid", "semantic"]
+
+
+def load_query_set(path: str) -> list[dict]:
+    """
+    Load a JSONL query set, one {"question": ..., "ArticleId": ...} per line.
+
+    "query" is accepted for "question", and "ArticleIds" (a list) for "ArticleId".
+
+    Args:
+        path (str): The JSONL file.
+
+    Returns:
+        list[dict]: One {"question", "expected"} per line, expected being a list of ArticleIds.
+    """
+    queries = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+
+            item = json.loads(line)
+            expected = item.get("ArticleIds") or [item["ArticleId"]]
+            queries.append({"question": item.get("question") or item["query"], "expected": [str(article_id) for article_id in expected]})
+
+    return queries
+
+
+def ranked_ids(results: list[dict]) -> list[str]:
+    """ArticleIds of the parent documents in result order, chunks count as their parent"""
+    return [str(result.get("ParentId") or result.get("ArticleId")) for result in results]
+
+
+class SearchBenchmark:
+    def __init__(self, ai_search: AISearch):
+        self.ai_search = ai_search
+
+    def run_mode(self, queries: list[dict], mode: str, k: int, concurrency: int) -> dict:
+        """
+        Replay a query set against one search mode.
+
+        Args:
+            queries (list[dict]): The query set from load_query_set.
+            mode (str): The AISearch.search_many mode.
+            k (int): The number of documents per query, also the cut-off of recall and MRR.
+            concurrency (int): The number of searches in flight.
+
+        Returns:
+            dict: Latency percentiles in milliseconds, throughput, recall@k, MRR and the error count.
+        """
+        start = time.perf_counter()
+        responses = self.ai_search.search_many([query["question"] for query in queries], mode=mode, k=k, concurrency=concurrency)
+        wall_seconds = time.perf_counter() - start
+
+        recalls, reciprocal_ranks = [], []
+        for query, response in zip(queries, responses):
+            retrieved = ranked_ids(response["results"])[:k]
+            expected = set(query["expected"])
+
+            recalls.append(len(expected.intersection(retrieved)) / len(expected))
+            reciprocal_ranks.append(next((1 / rank for rank, article_id in enumerate(retrieved, start=1) if article_id in expected), 0.0))
+
+        latencies = np.array([response["latency"] for response in responses]) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0.0, 0.0, 0.0)
+
+        return {
+            "queries": len(queries),
+            "errors": sum(1 for response in responses if response["error"]),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "mean_ms": float(latencies.mean()) if len(latencies) else 0.0,
+            "throughput_qps": len(queries) / wall_seconds if wall_seconds else 0.0,
+            f"recall@{k}": float(np.mean(recalls)) if recalls else 0.0,
+            "mrr": float(np.mean(reciprocal_ranks)) if reciprocal_ranks else 0.0,
+        }
+
+    def run(self, queries: list[dict], modes: list[str] = SEARCH_MODES, k: int = 3, concurrency: int = SEARCH_MANY_CONCURRENCY) -> dict:
+        """
+        Replay a query set against several search modes.
+
+        Query embeddings are fetched once before any mode runs, so the latencies only measure the searches.
+
+        Args:
+            queries (list[dict]): The query set from load_query_set.
+            modes (list[str], optional): The modes to benchmark. Defaults to SEARCH_MODES.
+            k (int, optional): The number of documents per query. Defaults to 3.
+            concurrency (int, optional): The number of searches in flight. Defaults to SEARCH_MANY_CONCURRENCY.
+
+        Returns:
+            dict: The report, with one entry per mode under "modes".
+        """
+        start = time.perf_counter()
+        if any(mode != "text" for mode in modes):
+            self.ai_search.query_embedding_cache.get_many([query["question"] for query in queries])
+        embedding_seconds = time.perf_counter() - start
+
+        report = {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "stage": self.ai_search.azure_env.stage,
+            "brand": self.ai_search.azure_env.brand,
+            "index": self.ai_search.azure_env.INDEX_NAME,
+            "local_index": self.ai_search.local_index is not None,
+            "k": k,
+            "concurrency": concurrency,
+            "queries": len(queries),
+            "embedding_seconds": embedding_seconds,
+            "modes": {},
+        }
+
+        for mode in modes:
+            report["modes"][mode] = self.run_mode(queries, mode, k, concurrency)
+
+        return report
+
+    @staticmethod
+    def print_report(report: dict) -> None:
+        k = report["k"]
+
+        print(f"\n{report['index']} ({report['stage']}), {report['queries']} queries, k={k}, concurrency={report['concurrency']}")
+        print(f"{'mode':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'qps':>10}{f'recall@{k}':>12}{'mrr':>8}{'errors':>8}")
+        for mode, metrics in report["modes"].items():
+            print(
+                f"{mode:<10}{metrics['p50_ms']:>10.1f}{metrics['p95_ms']:>10.1f}{metrics['p99_ms']:>10.1f}{metrics['throughput_qps']:>10.1f}"
+                f"{metrics[f'recall@{k}']:>12.3f}{metrics['mrr']:>8.3f}{metrics['errors']:>8}"
+            )
+
+    @staticmethod
+    def write_report(report: dict, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    env = questionary.select("Which environment?", choices=["prod", "dev"]).ask()
+    brand = questionary.select("Which brand?", choices=["clo3d", "closet", "md", "allinone"]).ask()
+    query_set_path = questionary.path("Query set (JSONL)?", default=os.path.join(backend_dir, "benchmarks", f"{brand}-queries.jsonl")).ask()
+    modes = questionary.checkbox("Search modes?", choices=SEARCH_MODES).ask()
+    k = int(questionary.text("k?", default="3").ask())
+    concurrency = int(questionary.text("Concurrency?", default=str(SEARCH_MANY_CONCURRENCY)).ask())
+
+    ai_search = AISearch(AzureEnv(env, brand))
+    # Measure the search service, not the result cache
+    ai_search.search_result_cache = None
+
+    benchmark = SearchBenchmark(ai_search)
+    report = benchmark.run(load_query_set(query_set_path), modes=modes, k=k, concurrency=concurrency)
+    benchmark.print_report(report)
+
+    report_path = os.path.join(backend_dir, "benchmarks", f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{report['index']}.json")
+    benchmark.write_report(report, report_path)
+    print(f"\nReport written to {report_path}")
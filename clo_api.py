@@ -9,6 +9,7 @@ import requests
 import shortuuid
 
 from tools.azure_env import AzureEnv
+from tools.indexing_batcher import index_documents, print_indexing_report
 from tools.misc import trim_tokens
 
 
@@ -170,12 +171,16 @@ class CLOAPI:
                     with open(os.path.join(self.clo_api_path, dir, files), "r", encoding="utf-8") as f:
                         documents = json.load(f)
 
+                        vectors = self.environment.openai_helper.generate_embeddings_batch(
+                            [document["Title"] for document in documents] + [document["Content"] for document in documents]
+                        )
+
                         for i, document in enumerate(documents):
                             documents[i]["@search.action"] = "mergeOrUpload"
-                            documents[i]["TitleVector"] = self.environment.openai_helper.generate_embeddings(text=document["Title"])
-                            documents[i]["ContentVector"] = self.environment.openai_helper.generate_embeddings(text=document["Content"])
+                            documents[i]["TitleVector"] = vectors[i]
+                            documents[i]["ContentVector"] = vectors[len(documents) + i]
 
-                        self.environment.search_client.upload_documents(documents)
+                        print_indexing_report(index_documents(self.environment.search_client, documents))
 
     def delete_documents(self):
         for dir in os.listdir(os.path.join(self.clo_api_path)):
@@ -187,7 +192,7 @@ class CLOAPI:
                         for i, document in enumerate(documents):
                             documents[i]["@search.action"] = "delete"
 
-                        self.environment.search_client.upload_documents(documents)
+                        print_indexing_report(index_documents(self.environment.search_client, documents))
 
 
 if __name__ == "__main__":
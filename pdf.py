@@ -1,3 +1,4 @@
+import asyncio
 import glob
 import io
 import json
@@ -11,13 +12,17 @@ import requests
 import shortuuid
 from tqdm import tqdm
 
+from tools.async_openai_helper import AsyncOpenAIHelper
 from tools.azure_env import AzureEnv
+from tools.chunking import add_chunk_documents, has_parent_field, stale_chunk_keys
+from tools.indexing_batcher import index_documents, print_indexing_report
 from tools.misc import trim_tokens
 
 
 class PDF:
     def __init__(self, environment: AzureEnv):
         self.env = env
+        self.environment = environment
         self.brand = environment.brand
         self.language = environment.language
         self.pdf_path = environment.get_locale_path("pdf")
@@ -84,16 +89,28 @@ class PDF:
         return trim_tokens(PDF.remove_miscellaneous_text(trim_tokens(content)))
 
     def add_labels(env, brand, language, pdf_path, file):
-        print(f"Adding labels to: {file}")
-
         environment = AzureEnv(env, brand, language)
 
+        async def add_labels():
+            openai_helper = environment.create_async_openai_helper()
+            try:
+                await PDF.async_add_labels(openai_helper, pdf_path, file)
+            finally:
+                await openai_helper.close()
+
+        asyncio.run(add_labels())
+
+    async def async_add_labels(openai_helper: AsyncOpenAIHelper, pdf_path, file):
+        """Generates labels for every PDF in a file concurrently"""
+        print(f"Adding labels to: {file}")
+
         with open(os.path.join(pdf_path, file), "r", encoding="utf-8") as f:
             documents = json.load(f)
 
+        labels = await asyncio.gather(*[openai_helper.generate_labels(document["PDF_Text"]) for document in documents])
+
         for i, document in enumerate(documents):
-            labels = environment.openai_helper.generate_labels(document["PDF_Text"])
-            documents[i]["Labels"] = labels
+            documents[i]["Labels"] = labels[i]
 
         with open(os.path.join(pdf_path, file), "w", encoding="utf-8") as f:
             json.dump(documents, f, ensure_ascii=False, indent=4)
@@ -101,14 +118,23 @@ class PDF:
     def mp_add_labels(self):
         file_paths = sorted(os.listdir(self.pdf_path), key=lambda x: int(x.partition("_")[2].partition(".")[0]))
 
-        add_labels_params = []
-        for file in file_paths:
-            add_labels_params.append((self.env, self.brand, self.language, self.pdf_path, file))
+        PDF.run_async_for_files(self.environment, PDF.async_add_labels, self.pdf_path, file_paths)
 
-        with multiprocessing.Pool(5) as p:
-            p.starmap_async(PDF.add_labels, add_labels_params, error_callback=lambda e: print(e))
-            p.close()
-            p.join()
+    def run_async_for_files(environment: AzureEnv, func, pdf_path, file_paths):
+        """Runs `func(openai_helper, pdf_path, file)` for every file in one event loop, sharing a single AsyncOpenAIHelper"""
+
+        async def run_all():
+            openai_helper = environment.create_async_openai_helper()
+            try:
+                results = await asyncio.gather(*[func(openai_helper, pdf_path, file) for file in file_paths], return_exceptions=True)
+            finally:
+                await openai_helper.close()
+
+            for result in results:
+                if isinstance(result, Exception):
+                    print(result)
+
+        asyncio.run(run_all())
 
     def get_zendesk_articles_with_pdf(env, brand, language, pdf_path, page):
         """Retrieves all articles with PDF attachments and stores them in a JSON"""
@@ -211,16 +237,28 @@ class PDF:
                 json.dump(documents, f, ensure_ascii=False, indent=4)
 
     def summarize_pdf(env, brand, language, pdf_path, file):
-        print(f"Summarizing {file}")
-
         environment = AzureEnv(env, brand, language)
 
+        async def summarize_pdf():
+            openai_helper = environment.create_async_openai_helper()
+            try:
+                await PDF.async_summarize_pdf(openai_helper, pdf_path, file)
+            finally:
+                await openai_helper.close()
+
+        asyncio.run(summarize_pdf())
+
+    async def async_summarize_pdf(openai_helper: AsyncOpenAIHelper, pdf_path, file):
+        """Summarizes every PDF in a file concurrently"""
+        print(f"Summarizing {file}")
+
         with open(f"{os.path.join(pdf_path, file)}", "r", encoding="utf-8") as f:
             documents = json.load(f)
 
+        pdf_summaries = await asyncio.gather(*[openai_helper.generate_pdf_summary(document["PDF_Text"]) for document in documents])
+
         for i, document in enumerate(documents):
-            pdf_summary = environment.openai_helper.generate_pdf_summary(document["PDF_Text"])
-            documents[i]["PDF_Summary"] = pdf_summary
+            documents[i]["PDF_Summary"] = pdf_summaries[i]
 
         with open(os.path.join(pdf_path, file), "w", encoding="utf-8") as f:
             json.dump(documents, f, ensure_ascii=False, indent=4)
@@ -229,14 +267,7 @@ class PDF:
         file_paths = os.listdir(self.pdf_path)
         file_paths = sorted(file_paths, key=lambda x: int(x.partition("_")[2].partition(".")[0]))
 
-        with multiprocessing.Pool(5) as p:
-            p.starmap_async(
-                PDF.summarize_pdf,
-                [(self.env, self.brand, self.language, self.pdf_path, file) for file in file_paths],
-                error_callback=lambda e: print(e),
-            )
-            p.close()
-            p.join()
+        PDF.run_async_for_files(self.environment, PDF.async_summarize_pdf, self.pdf_path, file_paths)
 
     def upload_pdfs(self):
         pdf_path = sorted(os.listdir(self.pdf_path), key=lambda x: int(x.partition("_")[2].partition(".")[0]))
@@ -245,34 +276,59 @@ class PDF:
             with open(os.path.join(self.pdf_path, file), "r", encoding="utf-8") as f:
                 documents = json.load(f)
 
+            # Chunk the full text of every PDF so it is searchable without waiting for a summary
+            for document in documents:
+                document["Content"] = document["PDF_Text"]
+
+            # Indexes created before chunking have no ParentId, their documents stay whole
+            if has_parent_field(self.search_client):
+                documents = add_chunk_documents(documents)
+
+            for document in documents:
+                # Parents keep the summary when there is one, their chunks carry the full text
+                if document["ArticleId"] == document.get("ParentId", document["ArticleId"]):
+                    document["Content"] = document.get("PDF_Summary") or document["PDF_Text"]
+
+            vectors = self.openai_helper.generate_embeddings_batch(
+                [document["Title"] for document in documents] + [document["Content"] for document in documents]
+            )
+
             for i, document in enumerate(documents):
                 document["@search.action"] = "mergeOrUpload"
-                document["Content"] = document["PDF_Summary"]
-                document["TitleVector"] = self.openai_helper.generate_embeddings(text=document["Title"])
-                document["ContentVector"] = self.openai_helper.generate_embeddings(text=document["PDF_Summary"])
+                document["TitleVector"] = vectors[i]
+                document["ContentVector"] = vectors[len(documents) + i]
                 document["YoutubeLinks"] = []
                 del document["PDF_URL"]
                 del document["PDF_Text"]
-                del document["PDF_Summary"]
+                document.pop("PDF_Summary", None)
+
+            # Remove chunks left over from a longer version of a PDF
+            documents += [{"@search.action": "delete", "ArticleId": key} for key in stale_chunk_keys(self.search_client, documents)]
 
-            self.search_client.upload_documents(documents)
+            print_indexing_report(index_documents(self.search_client, documents))
 
     def upload_udemy_pdfs(self):
         with open(os.path.join(self.udemy_path, "udemy_pdf.json"), "r", encoding="utf-8") as f:
             documents = json.load(f)
 
+        vectors = self.openai_helper.generate_embeddings_batch(
+            [document["Title"] for document in documents] + [document["PDF_Summary"] for document in documents]
+        )
+
         for i, document in enumerate(documents):
             document["@search.action"] = "mergeOrUpload"
             document["Content"] = document["PDF_Summary"]
-            document["Labels"] = self.openai_helper.generate_labels(document["PDF_Summary"])
-            document["TitleVector"] = self.openai_helper.generate_embeddings(text=document["Title"])
-            document["ContentVector"] = self.openai_helper.generate_embeddings(text=document["PDF_Summary"])
+            # get_udemy_pdfs already generated labels from the full text
+            if not document.get("Labels"):
+                document["Labels"] = self.openai_helper.generate_labels(document["PDF_Summary"])
+            document["TitleVector"] = vectors[i]
+            document["ContentVector"] = vectors[len(documents) + i]
             document["YoutubeLinks"] = []
 
             del document["PDF_Text"]
             del document["PDF_Summary"]
 
-        self.search_client.upload_documents(documents)
+        print_indexing_report(index_documents(self.search_client, documents))
 
 
 if __name__ == "__main__":
@@ -8,6 +8,9 @@ import questionary
 import requests
 
 from tools.azure_env import AzureEnv
+from tools.bulk_delete import bulk_delete, print_delete_report
+from tools.chunking import add_chunk_documents, has_parent_field, stale_chunk_keys
+from tools.indexing_batcher import index_documents, print_indexing_report
 from tools.misc import remove_html_tags, trim_tokens
 
 ZENDESK_POSTS_ENDPOINT = "https://support.{brand}.com/api/v2/help_center/community/posts.json?page={page}&per_page=60"
@@ -211,24 +214,53 @@ class Posts:
                 for comments in document["comments"]:
                     content += " " + comments["comment_body"]
 
-                try:
-                    upload_documents.append(
-                        {
-                            "@search.action": "mergeOrUpload",
-                            "ArticleId": str(document["post_id"]),
-                            "Source": document["post_url"],
-                            "Title": document["post_title"],
-                            "Content": content,
-                            "Labels": [],
-                            "YoutubeLinks": [],
-                            "titleVector": openai_helper.generate_embeddings(text=document["post_title"]),
-                            "contentVector": openai_helper.generate_embeddings(text=content if content != "" else document["post_title"]),
-                        }
-                    )
-                except Exception:
-                    print(f"Failed to upload: {document['post_id']}")
+                upload_documents.append(
+                    {
+                        "@search.action": "mergeOrUpload",
+                        "ArticleId": str(document["post_id"]),
+                        "Source": document["post_url"],
+                        "Title": document["post_title"],
+                        "Content": content,
+                        "Labels": [],
+                        "YoutubeLinks": [],
+                    }
+                )
+
+            # Long threads also get one child document per token window of the post and its comments, if the index has ParentId
+            if has_parent_field(search_client):
+                upload_documents = add_chunk_documents(upload_documents)
+
+            try:
+                vectors = openai_helper.generate_embeddings_batch(
+                    [document["Title"] for document in upload_documents]
+                    + [document["Content"] if document["Content"] != "" else document["Title"] for document in upload_documents]
+                )
 
-            search_client.upload_documents(upload_documents)
+                for i, document in enumerate(upload_documents):
+                    document["TitleVector"] = vectors[i]
+                    document["ContentVector"] = vectors[len(upload_documents) + i]
+            except Exception as e:
+                # Embed each document on its own so one bad post only loses itself, not the whole page
+                print(f"Failed to embed {file} in one batch, embedding each post separately: {e}")
+
+                embedded_documents = []
+                for document in upload_documents:
+                    try:
+                        document["TitleVector"], document["ContentVector"] = openai_helper.generate_embeddings_batch(
+                            [document["Title"], document["Content"] if document["Content"] != "" else document["Title"]]
+                        )
+                    except Exception as e:
+                        print(f"Failed to upload: {document['ArticleId']}: {e}")
+                        continue
+
+                    embedded_documents.append(document)
+
+                upload_documents = embedded_documents
+
+            # Remove chunks left over from a longer version of a thread
+            upload_documents += [{"@search.action": "delete", "ArticleId": key} for key in stale_chunk_keys(search_client, upload_documents)]
+
+            print_indexing_report(index_documents(search_client, upload_documents))
             print(f"Uploaded {file}")
 
     def mp_upload(self):
@@ -262,6 +294,7 @@ class Posts:
         with open(index_path, "r", encoding="utf-8") as f:
             documents = json.load(f)
 
+            old_post_ids = []
             # Loop through the documents and check the created_at date
             for i, document in enumerate(documents):
                 # Get the post from the Zendesk API
@@ -288,12 +321,10 @@ class Posts:
                 # If the created_at date is less than the cutoff date, delete the post
                 if created_at < cutoff_date:
                     print(f"Deleting {document['ArticleId']}")
-                    self.azure_env.search_client.upload_documents(
-                        {
-                            "@search.action": "delete",
-                            "ArticleId": str(document["ArticleId"]),
-                        }
-                    )
+                    old_post_ids.append(document["ArticleId"])
+
+            # Deleted in batches together with their chunk documents
+            print_delete_report(bulk_delete(self.azure_env.search_client, old_post_ids))
 
 
 if __name__ == "__main__":
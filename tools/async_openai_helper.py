@@ -0,0 +1,220 @@
+import asyncio
+
+from openai import AsyncAzureOpenAI, RateLimitError
+from tenacity import retry, stop_after_attempt, wait_random_exponential
+
+from tools.completion_cache import CompletionCache
+from tools.misc import num_tokens_from_string
+from tools.openai_helper import (
+    EMBEDDING_ADA_002_MAX_INPUT_TOKENS,
+    GPT_4_MINI_MAX_INPUT_TOKENS,
+    LABELS_PROMPT,
+    PDF_SUMMARY_PROMPT,
+    PROMPT_VERSIONS,
+    QUESTIONS_PROMPT,
+    TRANSCRIPT_SUMMARY_PROMPT,
+    parse_labels,
+    parse_questions,
+    parse_summary,
+)
+from tools.rate_governor import RateGovernor, retry_after_seconds, wait_retry_after
+from tools.tokenizer import count_tokens, truncate_to_tokens
+
+# Completions allowed in flight at once per helper
+ASYNC_OPENAI_MAX_CONCURRENCY = 32
+
+
+class AsyncOpenAIHelper:
+    """
+    asyncio counterpart of OpenAIHelper for the LLM-heavy pipeline steps.
+
+    Every request holds a slot of a shared semaphore while it is in flight, so a single process can
+    keep up to `max_concurrency` completions running. Retries are applied per request and back off
+    outside the semaphore, so a throttled request does not block the others.
+
+    The underlying httpx pool and the semaphore are bound to the event loop they are first used in,
+    so create a helper inside the coroutine that uses it (see AzureEnv.create_async_openai_helper).
+    """
+
+    def __init__(
+        self,
+        openai_client: AsyncAzureOpenAI,
+        AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+        AZURE_OPENAI_EMB_DEPLOYMENT,
+        language="English",
+        max_concurrency: int = ASYNC_OPENAI_MAX_CONCURRENCY,
+        rate_governor: RateGovernor | None = None,
+        completion_cache: CompletionCache | None = None,
+    ):
+        self.openai_client = openai_client
+        self.AZURE_OPENAI_CHATGPT_DEPLOYMENT = AZURE_OPENAI_CHATGPT_DEPLOYMENT
+        self.AZURE_OPENAI_EMB_DEPLOYMENT = AZURE_OPENAI_EMB_DEPLOYMENT
+        self.language = language
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_governor = rate_governor
+        self.completion_cache = completion_cache
+
+    async def _cached_chat_completion(self, template: str, content: str, tokens: int, temperature: float, max_tokens: int) -> str:
+        """Send a single chat completion request unless the completion cache already holds its reply"""
+        key = None
+        if self.completion_cache is not None:
+            key = CompletionCache.key(
+                self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, f"{template}:v{PROMPT_VERSIONS[template]}", temperature, max_tokens, content
+            )
+            completion = self.completion_cache.get(key)
+
+            if completion is not None:
+                return completion
+
+        completion = await self._chat_completion(content, tokens, temperature=temperature, max_tokens=max_tokens)
+
+        if key is not None:
+            self.completion_cache.put(key, completion)
+
+        return completion
+
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
+    async def _chat_completion(self, content: str, tokens: int, temperature: float, max_tokens: int) -> str:
+        """Send a single chat completion request and return the message content"""
+        if self.rate_governor is not None:
+            await self.rate_governor.async_acquire(self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, tokens + max_tokens)
+
+        try:
+            async with self.semaphore:
+                chat_completion = await self.openai_client.chat.completions.create(
+                    model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+                    messages=[{"role": "user", "content": content}],
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    n=1,
+                )
+        except RateLimitError as e:
+            # Outside the semaphore and off the event loop, penalize can wait on the SQLite lock
+            if self.rate_governor is not None:
+                await asyncio.to_thread(self.rate_governor.penalize, self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, retry_after_seconds(e))
+            raise
+
+        return chat_completion.choices[0].message.content
+
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
+    async def generate_embeddings(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed a small batch of texts, such as search queries, in a single request.
+
+        Args:
+            texts (list[str]): The texts to embed, each truncated to the model's input limit.
+
+        Returns:
+            list[list[float]]: The embeddings, in the same order as `texts`.
+        """
+        tokens = count_tokens(texts, "text-embedding-ada-002")
+        inputs = [
+            truncate_to_tokens(text, EMBEDDING_ADA_002_MAX_INPUT_TOKENS, "text-embedding-ada-002") if count > EMBEDDING_ADA_002_MAX_INPUT_TOKENS else text
+            for text, count in zip(texts, tokens)
+        ]
+
+        if self.rate_governor is not None:
+            await self.rate_governor.async_acquire(self.AZURE_OPENAI_EMB_DEPLOYMENT, min(sum(tokens), EMBEDDING_ADA_002_MAX_INPUT_TOKENS * len(texts)))
+
+        try:
+            async with self.semaphore:
+                response = await self.openai_client.embeddings.create(input=inputs, model=self.AZURE_OPENAI_EMB_DEPLOYMENT)
+        except RateLimitError as e:
+            # Outside the semaphore and off the event loop, penalize can wait on the SQLite lock
+            if self.rate_governor is not None:
+                await asyncio.to_thread(self.rate_governor.penalize, self.AZURE_OPENAI_EMB_DEPLOYMENT, retry_after_seconds(e))
+            raise
+
+        return [data.embedding for data in sorted(response.data, key=lambda data: data.index)]
+
+    async def generate_questions(self, text: str) -> str:
+        """
+        Generate questions from a given text.
+
+        Args:
+            text (str): The text to generate questions from.
+
+        Returns:
+            str: The generated questions.
+        """
+        tokens = num_tokens_from_string(text, "gpt-4o-mini")
+
+        if tokens >= GPT_4_MINI_MAX_INPUT_TOKENS:
+            text = truncate_to_tokens(text, GPT_4_MINI_MAX_INPUT_TOKENS)
+
+        questions = await self._cached_chat_completion(
+            "questions", QUESTIONS_PROMPT.format(language=self.language, text=text), tokens, temperature=0.7, max_tokens=200
+        )
+
+        return parse_questions(questions)
+
+    async def generate_labels(self, text: str) -> list[str]:
+        """
+        Generate keywords from a given text.
+
+        Args:
+            text (str): The text to generate keywords from.
+
+        Returns:
+            list[str]: A list of keywords.
+        """
+        # 50 tokens or less, generate 5 keywords
+        # otherwise, generate 10 keywords
+        tokens = num_tokens_from_string(text, "gpt-4o-mini")
+        keywords_num = 10
+
+        if tokens <= 50:
+            keywords_num = 5
+
+        if tokens >= GPT_4_MINI_MAX_INPUT_TOKENS:
+            text = truncate_to_tokens(text, GPT_4_MINI_MAX_INPUT_TOKENS)
+
+        labels = await self._cached_chat_completion(
+            "labels",
+            LABELS_PROMPT.format(keywords_num=keywords_num, language=self.language, text=text), tokens, temperature=0, max_tokens=200
+        )
+
+        return parse_labels(labels)
+
+    async def generate_transcript_summary(self, transcript: str) -> str:
+        """
+        Summarize a transcript
+
+        Args:
+            transcript (str): The text of the transcript to summarize
+
+        Returns:
+            str: A summary of the transcript
+        """
+        tokens = num_tokens_from_string(transcript, "gpt-4o-mini")
+
+        if tokens >= GPT_4_MINI_MAX_INPUT_TOKENS:
+            transcript = truncate_to_tokens(transcript, GPT_4_MINI_MAX_INPUT_TOKENS)
+
+        summary = await self._cached_chat_completion(
+            "transcript_summary", TRANSCRIPT_SUMMARY_PROMPT.format(transcript=transcript), tokens, temperature=0.7, max_tokens=2000
+        )
+
+        return parse_summary(summary)
+
+    async def generate_pdf_summary(self, pdf: str) -> str:
+        """
+        Summarize a PDF
+
+        Args:
+            pdf (str): The text of the PDF to summarize
+
+        Returns:
+            str: A summary of the PDF
+        """
+        tokens = num_tokens_from_string(pdf, "gpt-4o-mini")
+
+        if tokens >= GPT_4_MINI_MAX_INPUT_TOKENS:
+            pdf = truncate_to_tokens(pdf, GPT_4_MINI_MAX_INPUT_TOKENS)
+
+        summary = await self._cached_chat_completion("pdf_summary", PDF_SUMMARY_PROMPT.format(pdf=pdf), tokens, temperature=0.7, max_tokens=1000)
+
+        return parse_summary(summary)
+
+    async def close(self) -> None:
+        await self.openai_client.close()
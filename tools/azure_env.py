@@ -1,19 +1,34 @@
 import os
 from pathlib import Path
+from urllib.parse import urlsplit
 
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AsyncAzureOpenAI, AzureOpenAI
 
+from tools.async_openai_helper import ASYNC_OPENAI_MAX_CONCURRENCY, AsyncOpenAIHelper
+from tools.completion_cache import COMPLETION_CACHE_MAX_BYTES, COMPLETION_CACHE_TTL, CompletionCache
+from tools.embedding_cache import EMBEDDING_CACHE_MAX_BYTES, EmbeddingCache
 from tools.openai_helper import OpenAIHelper
+from tools.query_embedding_cache import QUERY_EMBEDDING_CACHE_MAX_ENTRIES, QueryEmbeddingCache
+from tools.rate_governor import RateGovernor
+from tools.search_cache import (
+    SEARCH_CACHE_MAX_ENTRIES,
+    SEARCH_CACHE_TTL,
+    IndexGenerations,
+    InvalidatingSearchClient,
+    InvalidatingSearchIndexClient,
+    SearchResultCache,
+    index_generations_directory,
+)
 
 backend_dir = Path(__file__).parent.parent
 zendesk_article_api_endpoint = "https://{0}.zendesk.com/api/v2/help_center/{1}/articles.json?page={2}&per_page=30&sort_by=updated_at&sort_order=desc"
 zendesk_article_section_api_endpoint = "https://{0}.zendesk.com/api/v2/help_center/{1}/sections/{2}.json"
 zendesk_article_category_api_endpoint = "https://{0}.zendesk.com/api/v2/help_center/{1}/categories/{2}.json"
 zendesk_article_attachment_api_endpoint = "https://support.{0}.com/api/v2/help_center/{1}/articles/{2}/attachments"
+zendesk_article_translation_api_endpoint = "https://{0}.zendesk.com/api/v2/help_center/articles/{1}/translations/{2}.json"
+zendesk_incremental_article_api_endpoint = "https://{0}.zendesk.com/api/v2/help_center/incremental/articles.json?start_time={1}"
 
 
 class AzureEnv:
@@ -31,26 +46,49 @@ class AzureEnv:
 
         self.INDEX_NAME = os.environ.get(f"{brand.upper()}_AZURE_SEARCH_INDEX_{language.upper()}", "clo3d-index-english")
 
-        self.SEARCH_CLIENT_ENDPOINT = f"https://{self.AZURE_SEARCH_SERVICE}.search.windows.net"
+        # AZURE_SEARCH_ENDPOINT overrides the service endpoint, e.g. to point at tools/mock_search_server.py
+        self.SEARCH_CLIENT_ENDPOINT = os.environ.get("AZURE_SEARCH_ENDPOINT") or f"https://{self.AZURE_SEARCH_SERVICE}.search.windows.net"
         self.AZURE_KEY_CREDENTIAL = AzureKeyCredential(os.environ.get("AZURE_SEARCH_KEY"))
 
-        self.search_client = SearchClient(
-            endpoint=f"https://{self.AZURE_SEARCH_SERVICE}.search.windows.net",
+        # ZENDESK_ENDPOINT overrides the host of every Zendesk endpoint, e.g. to point at tools/mock_zendesk_server.py
+        self.ZENDESK_ENDPOINT = os.environ.get("ZENDESK_ENDPOINT")
+        # An admin's email and API token, the incremental article export only answers authenticated requests
+        self.ZENDESK_EMAIL = os.environ.get("ZENDESK_EMAIL")
+        self.ZENDESK_API_TOKEN = os.environ.get("ZENDESK_API_TOKEN")
+
+        # Every upload or delete through these clients, and every index they create or drop, invalidates its cached search results
+        self.index_generations = IndexGenerations(index_generations_directory())
+        self.search_client = InvalidatingSearchClient(
+            endpoint=self.SEARCH_CLIENT_ENDPOINT,
             index_name=self.INDEX_NAME,
             credential=self.AZURE_KEY_CREDENTIAL,
+            generations=self.index_generations,
+        )
+        # Set SEARCH_CACHE_MAX_ENTRIES to 0 to disable the search result cache
+        self.search_result_cache = SearchResultCache(
+            self.index_generations,
+            ttl=int(os.environ.get("SEARCH_CACHE_TTL", SEARCH_CACHE_TTL)),
+            max_entries=int(os.environ.get("SEARCH_CACHE_MAX_ENTRIES", SEARCH_CACHE_MAX_ENTRIES)),
         )
 
-        self.search_index_client = SearchIndexClient(
-            endpoint=f"https://{self.AZURE_SEARCH_SERVICE}.search.windows.net", credential=self.AZURE_KEY_CREDENTIAL
+        self.search_index_client = InvalidatingSearchIndexClient(
+            endpoint=self.SEARCH_CLIENT_ENDPOINT,
+            credential=self.AZURE_KEY_CREDENTIAL,
+            generations=self.index_generations,
         )
 
         self.AZURE_OPENAI_SERVICE = os.environ.get("AZURE_OPENAI_SERVICE")
         self.AZURE_OPENAI_CHATGPT_DEPLOYMENT = os.environ.get("AZURE_OPENAI_CHATGPT_DEPLOYMENT")
         self.AZURE_OPENAI_EMB_DEPLOYMENT = os.environ.get("AZURE_OPENAI_EMB_DEPLOYMENT")
+        # AZURE_OPENAI_ENDPOINT overrides the service endpoint, e.g. to point at tools/mock_openai_server.py
+        self.AZURE_OPENAI_ENDPOINT = os.environ.get("AZURE_OPENAI_ENDPOINT") or f"https://{self.AZURE_OPENAI_SERVICE}.openai.azure.com"
+        self.AZURE_OPENAI_MAX_CONCURRENCY = int(os.environ.get("AZURE_OPENAI_MAX_CONCURRENCY", ASYNC_OPENAI_MAX_CONCURRENCY))
         self.openai_client = AzureOpenAI(
             api_version="2023-07-01-preview",
-            azure_endpoint=f"https://{self.AZURE_OPENAI_SERVICE}.openai.azure.com",
+            azure_endpoint=self.AZURE_OPENAI_ENDPOINT,
             api_key=os.environ.get("AZURE_OPENAI_KEY"),
+            # OpenAIHelper retries itself so that every 429 passes through the rate governor
+            max_retries=0,
         )
 
         self.URI = os.environ.get("MONGO_URI")
@@ -60,10 +98,78 @@ class AzureEnv:
         self.COLLECTION_ARTICLE = os.environ.get("MONGO_COLLECTION_ARTICLES")
         self.COLLECTION_FEEDBACK = os.environ.get("MONGO_COLLECTION_FEEDBACK")
 
+        # Set EMBEDDING_CACHE_PATH to an empty string to disable the embedding cache
+        self.EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", os.path.join(backend_dir, ".cache", "embeddings.sqlite"))
+        self.embedding_cache = (
+            EmbeddingCache(
+                self.EMBEDDING_CACHE_PATH,
+                self.AZURE_OPENAI_EMB_DEPLOYMENT,
+                max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_BYTES", EMBEDDING_CACHE_MAX_BYTES)),
+            )
+            if self.EMBEDDING_CACHE_PATH
+            else None
+        )
+
+        # Set COMPLETION_CACHE_PATH to an empty string to disable the completion cache
+        self.COMPLETION_CACHE_PATH = os.environ.get("COMPLETION_CACHE_PATH", os.path.join(backend_dir, ".cache", "completions.sqlite"))
+        self.completion_cache = (
+            CompletionCache(
+                self.COMPLETION_CACHE_PATH,
+                ttl=int(os.environ.get("COMPLETION_CACHE_TTL", COMPLETION_CACHE_TTL)),
+                max_bytes=int(os.environ.get("COMPLETION_CACHE_MAX_BYTES", COMPLETION_CACHE_MAX_BYTES)),
+            )
+            if self.COMPLETION_CACHE_PATH
+            else None
+        )
+
+        # Deployment quotas shared by every thread and pool worker, deployments without a TPM/RPM are not throttled
+        self.rate_governor = RateGovernor(
+            os.environ.get("RATE_GOVERNOR_PATH", os.path.join(backend_dir, ".cache", "rate_governor.sqlite")),
+            {
+                self.AZURE_OPENAI_CHATGPT_DEPLOYMENT: (
+                    int(os.environ.get("AZURE_OPENAI_CHATGPT_TPM", 0)),
+                    int(os.environ.get("AZURE_OPENAI_CHATGPT_RPM", 0)),
+                ),
+                self.AZURE_OPENAI_EMB_DEPLOYMENT: (
+                    int(os.environ.get("AZURE_OPENAI_EMB_TPM", 0)),
+                    int(os.environ.get("AZURE_OPENAI_EMB_RPM", 0)),
+                ),
+            },
+        )
+
         self.openai_helper = OpenAIHelper(
             self.openai_client,
             self.AZURE_OPENAI_CHATGPT_DEPLOYMENT,
             self.AZURE_OPENAI_EMB_DEPLOYMENT,
+            embedding_cache=self.embedding_cache,
+            rate_governor=self.rate_governor,
+            completion_cache=self.completion_cache,
+        )
+
+        # Repeated search queries skip the embedding request, size 0 disables it
+        self.query_embedding_cache = QueryEmbeddingCache(
+            self.openai_helper,
+            max_entries=int(os.environ.get("QUERY_EMBEDDING_CACHE_MAX_ENTRIES", QUERY_EMBEDDING_CACHE_MAX_ENTRIES)),
+        )
+
+    def create_async_openai_helper(self, max_concurrency: int = None) -> AsyncOpenAIHelper:
+        """Create an AsyncOpenAIHelper, call this inside the event loop that will use it"""
+        async_openai_client = AsyncAzureOpenAI(
+            api_version="2023-07-01-preview",
+            azure_endpoint=self.AZURE_OPENAI_ENDPOINT,
+            api_key=os.environ.get("AZURE_OPENAI_KEY"),
+            # OpenAIHelper retries itself so that every 429 passes through the rate governor
+            max_retries=0,
+        )
+
+        return AsyncOpenAIHelper(
+            async_openai_client,
+            self.AZURE_OPENAI_CHATGPT_DEPLOYMENT,
+            self.AZURE_OPENAI_EMB_DEPLOYMENT,
+            language=self.language,
+            max_concurrency=max_concurrency or self.AZURE_OPENAI_MAX_CONCURRENCY,
+            rate_governor=self.rate_governor,
+            completion_cache=self.completion_cache,
         )
 
     def get_locale(self):
@@ -85,34 +191,39 @@ class AzureEnv:
 
         return document_path[self.language]
 
-    def get_zendesk_article_api_endpoint(self, page: int):
-        if self.brand == "closet":
-            return zendesk_article_api_endpoint.format("clo-set", self.get_locale(), page)
-        elif self.brand == "md":
-            return zendesk_article_api_endpoint.format("marvelousdesigner", self.get_locale(), page)
+    def get_zendesk_subdomain(self) -> str:
+        return {"closet": "clo-set", "md": "marvelousdesigner"}.get(self.brand, self.brand)
 
-        return zendesk_article_api_endpoint.format(self.brand, self.get_locale(), page)
+    def get_zendesk_auth(self) -> tuple[str, str] | None:
+        """Basic auth for Zendesk API token access, None when ZENDESK_EMAIL or ZENDESK_API_TOKEN is not set"""
+        if not (self.ZENDESK_EMAIL and self.ZENDESK_API_TOKEN):
+            return None
 
-    def get_zendesk_article_attachment_api_endpoint(self, article_id):
-        if self.brand == "closet":
-            return zendesk_article_attachment_api_endpoint.format("clo-set", self.get_locale(), article_id)
-        elif self.brand == "md":
-            return zendesk_article_attachment_api_endpoint.format("marvelousdesigner", self.get_locale(), article_id)
+        return (f"{self.ZENDESK_EMAIL}/token", self.ZENDESK_API_TOKEN)
 
-        return zendesk_article_attachment_api_endpoint.format(self.brand, self.get_locale(), article_id)
+    def format_zendesk_endpoint(self, endpoint: str, *args) -> str:
+        url = endpoint.format(self.get_zendesk_subdomain(), *args)
 
-    def get_zendesk_article_section_api_endpoint(self, section_id):
-        if self.brand == "closet":
-            return zendesk_article_section_api_endpoint.format("clo-set", self.get_locale(), section_id)
-        elif self.brand == "md":
-            return zendesk_article_section_api_endpoint.format("marvelousdesigner", self.get_locale(), section_id)
+        if self.ZENDESK_ENDPOINT:
+            parts = urlsplit(url)
+            url = self.ZENDESK_ENDPOINT.rstrip("/") + parts.path + (f"?{parts.query}" if parts.query else "")
 
-        return zendesk_article_section_api_endpoint.format(self.brand, self.get_locale(), section_id)
+        return url
+
+    def get_zendesk_article_api_endpoint(self, page: int):
+        return self.format_zendesk_endpoint(zendesk_article_api_endpoint, self.get_locale(), page)
+
+    def get_zendesk_article_attachment_api_endpoint(self, article_id):
+        return self.format_zendesk_endpoint(zendesk_article_attachment_api_endpoint, self.get_locale(), article_id)
+
+    def get_zendesk_article_section_api_endpoint(self, section_id):
+        return self.format_zendesk_endpoint(zendesk_article_section_api_endpoint, self.get_locale(), section_id)
 
     def get_zendesk_article_category_api_endpoint(self, category_id):
-        if self.brand == "closet":
-            return zendesk_article_category_api_endpoint.format("clo-set", self.get_locale(), category_id)
-        elif self.brand == "md":
-            return zendesk_article_category_api_endpoint.format("marvelousdesigner", self.get_locale(), category_id)
+        return self.format_zendesk_endpoint(zendesk_article_category_api_endpoint, self.get_locale(), category_id)
+
+    def get_zendesk_article_translation_api_endpoint(self, article_id):
+        return self.format_zendesk_endpoint(zendesk_article_translation_api_endpoint, article_id, self.get_locale())
 
-        return zendesk_article_category_api_endpoint.format(self.brand, self.get_locale(), category_id)
+    def get_zendesk_incremental_article_api_endpoint(self, start_time: int):
+        return self.format_zendesk_endpoint(zendesk_incremental_article_api_endpoint, start_time)
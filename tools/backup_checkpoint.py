@@ -0,0 +1,82 @@
+import json
+import os
+import threading
+
+
+class BackupCheckpoint:
+    """
+    Progress of a partitioned backup in a local JSON state file, so an interrupted backup resumes where it stopped.
+
+    Each partition remembers the last key whose page the target acknowledged, and keys the target
+    rejected are kept in "failed" to be retried. The file is rewritten atomically after every change, so
+    it is never left half-written by a crash.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state = None
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def start(self, source: str, target: str, partitions: list[dict]) -> None:
+        self.state = {
+            "source": source,
+            "target": target,
+            "partitions": [{**partition, "last_key": None, "copied": 0, "done": False} for partition in partitions],
+            "failed": {},
+            "retried": 0,
+        }
+        self.save()
+
+    def matches(self, source: str, target: str) -> bool:
+        return self.state is not None and self.state["source"] == source and self.state["target"] == target
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
+
+    def acknowledge(self, partition: int, last_key: str, copied: int, failed: dict = None) -> None:
+        """Record that every document of a partition up to `last_key` was sent, `failed` holding the ones the target rejected"""
+        with self._lock:
+            self.state["partitions"][partition]["last_key"] = last_key
+            self.state["partitions"][partition]["copied"] += copied
+            self.state["failed"].update(failed or {})
+            self.save()
+
+    def finish(self, partition: int) -> None:
+        with self._lock:
+            self.state["partitions"][partition]["done"] = True
+            self.save()
+
+    def retried(self, keys: list[str], copied: int, failed: dict) -> None:
+        """Record the outcome of retrying failed keys, `failed` holding the ones that failed again"""
+        with self._lock:
+            for key in keys:
+                self.state["failed"].pop(key, None)
+            self.state["failed"].update(failed)
+            self.state["retried"] += copied
+            self.save()
+
+    @property
+    def partitions(self) -> list[dict]:
+        return self.state["partitions"]
+
+    @property
+    def failed(self) -> dict:
+        return self.state["failed"]
+
+    @property
+    def copied(self) -> int:
+        return sum(partition["copied"] for partition in self.state["partitions"]) + self.state["retried"]
+
+    def delete(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.state = None
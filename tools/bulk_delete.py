@@ -0,0 +1,83 @@
+from azure.search.documents import SearchClient
+
+from tools.chunking import chunk_keys
+from tools.indexing_batcher import INDEXING_MAX_BATCH_SIZE, IndexingBatcher
+
+BULK_DELETE_MAX_WORKERS = 4
+
+
+class BulkDeleter(IndexingBatcher):
+    """
+    Accumulates document keys and deletes them through an IndexingBatcher.
+
+    Full batches are flushed as keys are added, on `max_workers` threads when more than one, and the rest
+    on close(). Every key that the service did not delete is recorded in `failed` with its error message.
+
+    Usage:
+        with BulkDeleter(search_client) as deleter:
+            for key in keys:
+                deleter.add(key)
+        print(deleter.deleted, deleter.failed)
+    """
+
+    def __init__(self, search_client: SearchClient, key_field: str = "ArticleId", batch_size: int = INDEXING_MAX_BATCH_SIZE, max_workers: int = 1):
+        super().__init__(search_client, key_field=key_field, action="delete", max_batch_size=batch_size, max_workers=max_workers)
+
+    @property
+    def deleted(self) -> int:
+        return self.indexed
+
+    def add(self, key: str) -> None:
+        super().add({self.key_field: str(key)})
+
+    def close(self) -> dict:
+        """
+        Flush the remaining keys and wait for every batch to finish.
+
+        Returns:
+            dict: {"deleted": count, "failed": {key: error message}}
+        """
+        report = super().close()
+
+        return {"deleted": report["indexed"], "failed": report["failed"]}
+
+
+def bulk_delete(
+    search_client: SearchClient,
+    keys: list[str],
+    key_field: str = "ArticleId",
+    include_chunks: bool = True,
+    batch_size: int = INDEXING_MAX_BATCH_SIZE,
+    max_workers: int = BULK_DELETE_MAX_WORKERS,
+) -> dict:
+    """
+    Delete documents by key in as few requests as possible.
+
+    Args:
+        search_client (SearchClient): The client of the index.
+        keys (list[str]): The keys of the documents to delete.
+        key_field (str, optional): The key field. Defaults to "ArticleId".
+        include_chunks (bool, optional): Also delete the chunk documents of every key. Defaults to True.
+        batch_size (int, optional): The actions per request. Defaults to INDEXING_MAX_BATCH_SIZE.
+        max_workers (int, optional): The number of requests in flight. Defaults to BULK_DELETE_MAX_WORKERS.
+
+    Returns:
+        dict: {"deleted": count, "failed": {key: error message}}
+    """
+    keys = list(dict.fromkeys(str(key) for key in keys))
+    if include_chunks and keys:
+        keys += chunk_keys(search_client, keys)
+
+    with BulkDeleter(search_client, key_field=key_field, batch_size=batch_size, max_workers=max_workers) as deleter:
+        deleter.add_many(keys)
+
+    return {"deleted": deleter.deleted, "failed": dict(deleter.failed)}
+
+
+def print_delete_report(report: dict) -> None:
+    print(f"Documents deleted: {report['deleted']}")
+
+    if report["failed"]:
+        print(f"Failed to delete {len(report['failed'])} documents:")
+        for key, message in report["failed"].items():
+            print(f"{key}: {message}")
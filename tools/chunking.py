@@ -0,0 +1,171 @@
+from functools import lru_cache
+
+from azure.core.exceptions import HttpResponseError
+
+from tools.tokenizer import get_encoding
+
+CHUNK_MAX_TOKENS = 512
+CHUNK_OVERLAP_TOKENS = 64
+# Fetch this many times `k` results from the index so there are still `k` parents left after collapsing chunks
+CHUNK_OVERSAMPLE = 4
+# Parents per search.in filter when looking up chunk documents
+CHUNK_LOOKUP_BATCH_SIZE = 200
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS, model: str = "text-embedding-ada-002") -> list[str]:
+    """
+    Split a text into overlapping windows of at most `max_tokens` tokens.
+
+    Args:
+        text (str): The text to split.
+        max_tokens (int, optional): The size of each window. Defaults to CHUNK_MAX_TOKENS.
+        overlap (int, optional): The number of tokens shared by consecutive windows. Defaults to CHUNK_OVERLAP_TOKENS.
+        model (str, optional): The model whose encoding is used. Defaults to "text-embedding-ada-002".
+
+    Returns:
+        list[str]: The windows, a single element when the text already fits.
+    """
+    encoding = get_encoding(model)
+    tokens = encoding.encode_ordinary(text)
+
+    if len(tokens) <= max_tokens:
+        return [text]
+
+    step = max_tokens - overlap
+
+    chunks = []
+    for start in range(0, len(tokens), step):
+        chunks.append(encoding.decode(tokens[start : start + max_tokens]).strip())
+
+        if start + max_tokens >= len(tokens):
+            break
+
+    return chunks
+
+
+def add_chunk_documents(documents: list[dict], max_tokens: int = CHUNK_MAX_TOKENS, overlap: int = CHUNK_OVERLAP_TOKENS) -> list[dict]:
+    """
+    Add a child document for every window of each document's Content that is longer than `max_tokens`.
+
+    Every parent gets ParentId set to its own ArticleId, and every child copies its parent's fields with
+    ArticleId "{ParentId}_{n}" and Content set to the window, so children can be embedded and uploaded
+    alongside their parents and collapsed back to them at query time. Only call it for indexes that
+    has_parent_field accepts, others reject every upload that carries ParentId.
+
+    Args:
+        documents (list[dict]): The parent documents, updated in place.
+        max_tokens (int, optional): The size of each window. Defaults to CHUNK_MAX_TOKENS.
+        overlap (int, optional): The number of tokens shared by consecutive windows. Defaults to CHUNK_OVERLAP_TOKENS.
+
+    Returns:
+        list[dict]: The parents followed by their chunk documents.
+    """
+    chunk_documents = []
+    for document in documents:
+        document["ParentId"] = document["ArticleId"]
+
+        chunks = chunk_text(document["Content"], max_tokens=max_tokens, overlap=overlap)
+        if len(chunks) == 1:
+            continue
+
+        for i, chunk in enumerate(chunks):
+            chunk_documents.append({**document, "ArticleId": f"{document['ArticleId']}_{i}", "Content": chunk})
+
+    return documents + chunk_documents
+
+
+@lru_cache(maxsize=64)
+def has_parent_field(search_client) -> bool:
+    """Whether the index can be filtered on ParentId, indexes created before chunking cannot and answer such filters with a 400"""
+    try:
+        list(search_client.search(search_text="*", filter="ParentId eq null", select=["ArticleId"], top=1))
+    except HttpResponseError as e:
+        if e.status_code == 400:
+            return False
+        raise
+
+    return True
+
+
+def chunk_keys(search_client, parent_ids: list[str]) -> list[str]:
+    """
+    Find the chunk documents of the given parents in the index.
+
+    Indexes without a ParentId field have no chunks, so they are checked once per client and never filtered.
+
+    Args:
+        search_client (SearchClient): The client of the index.
+        parent_ids (list[str]): The ArticleIds of the parents.
+
+    Returns:
+        list[str]: The ArticleIds of their chunks, not including the parents themselves.
+    """
+    parent_ids = list(dict.fromkeys(str(parent_id) for parent_id in parent_ids))
+    if not parent_ids or not has_parent_field(search_client):
+        return []
+
+    keys = []
+    # Keep each filter well below the service's filter length limit
+    for start in range(0, len(parent_ids), CHUNK_LOOKUP_BATCH_SIZE):
+        batch = parent_ids[start : start + CHUNK_LOOKUP_BATCH_SIZE]
+        results = search_client.search(
+            search_text="*",
+            filter=f"search.in(ParentId, '{','.join(batch)}', ',')",
+            select=["ArticleId"],
+        )
+
+        keys += [result["ArticleId"] for result in results if result["ArticleId"] not in batch]
+
+    return keys
+
+
+def stale_chunk_keys(search_client, documents: list[dict]) -> list[str]:
+    """
+    Find chunk documents in the index that belong to the given parents but were not produced this time,
+    e.g. because the parent's Content got shorter.
+
+    Args:
+        search_client (SearchClient): The client of the index.
+        documents (list[dict]): The parents and chunks about to be uploaded.
+
+    Returns:
+        list[str]: The ArticleIds of the stale chunks.
+    """
+    current_ids = {document["ArticleId"] for document in documents}
+    parent_ids = [document["ParentId"] for document in documents if "ParentId" in document]
+
+    return [key for key in chunk_keys(search_client, parent_ids) if key not in current_ids]
+
+
+def collapse_to_parents(results: list[dict], k: int = None) -> list[dict]:
+    """
+    Keep only the best scoring result of each parent document.
+
+    A kept chunk is returned under its parent's key, so ArticleId is always the parent's. Its own key moves to
+    ChunkId and its Content stays the matched window.
+
+    Args:
+        results (list[dict]): Search results ordered by descending score.
+        k (int, optional): The number of parents to return. Defaults to all of them.
+
+    Returns:
+        list[dict]: At most `k` results, one per parent, in their original order.
+    """
+    seen = set()
+
+    collapsed = []
+    for result in results:
+        parent_id = result.get("ParentId") or result.get("ArticleId")
+
+        if parent_id in seen:
+            continue
+
+        seen.add(parent_id)
+        if result.get("ArticleId") != parent_id:
+            result = {**result, "ArticleId": parent_id, "ChunkId": result.get("ArticleId")}
+        collapsed.append(result)
+
+        if k is not None and len(collapsed) >= k:
+            break
+
+    return collapsed
@@ -0,0 +1,163 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+COMPLETION_CACHE_MAX_BYTES = 256 * 1024 * 1024
+COMPLETION_CACHE_TTL = 30 * 24 * 60 * 60
+
+
+class CompletionCache:
+    """
+    SQLite-backed store of chat completions for the deterministic pipeline prompts.
+
+    Entries are keyed by (deployment, prompt template and version, temperature, max tokens, hash of the
+    prompt), so reprocessing a page file only pays for documents whose input changed. Entries expire after
+    `ttl` seconds and the least recently used ones are evicted once the store grows past `max_bytes`. Triggers
+    keep the total size in completions_size, so checking the budget after a write does not scan the table.
+    """
+
+    def __init__(self, path: str, ttl: int = COMPLETION_CACHE_TTL, max_bytes: int = COMPLETION_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked pool workers, so open one per process
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, completion TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS completions_last_used ON completions (last_used)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS completions_created_at ON completions (created_at)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS completions_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS completions_insert AFTER INSERT ON completions "
+                "BEGIN UPDATE completions_size SET total = total + new.size WHERE id = 0; END"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS completions_update AFTER UPDATE OF size ON completions "
+                "BEGIN UPDATE completions_size SET total = total + new.size - old.size WHERE id = 0; END"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS completions_delete AFTER DELETE ON completions "
+                "BEGIN UPDATE completions_size SET total = total - old.size WHERE id = 0; END"
+            )
+            # Caches written before the running total existed are summed once
+            self._connection.execute(
+                "INSERT OR IGNORE INTO completions_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM completions "
+                "WHERE NOT EXISTS (SELECT 1 FROM completions_size)"
+            )
+            self._connection.commit()
+            self._pid = os.getpid()
+
+        return self._connection
+
+    @staticmethod
+    def key(deployment: str, template: str, temperature: float, max_tokens: int, prompt: str) -> str:
+        """
+        Build the cache key of a completion.
+
+        Args:
+            deployment (str): The chat deployment.
+            template (str): The prompt template name and version, e.g. "labels:v1".
+            temperature (float): The sampling temperature.
+            max_tokens (int): The maximum number of tokens to generate.
+            prompt (str): The fully formatted prompt.
+
+        Returns:
+            str: The cache key.
+        """
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+        return hashlib.sha256(json.dumps([deployment, template, temperature, max_tokens, prompt_hash]).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached completion, or None if it is missing or has expired"""
+        now = time.time()
+        row = self.connection.execute("SELECT completion, created_at FROM completions WHERE key = ?", (key,)).fetchone()
+
+        if row is None or now - row[1] > self.ttl:
+            if row is not None:
+                self.connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self.connection.commit()
+                self.evictions += 1
+
+            self.misses += 1
+            return None
+
+        self.connection.execute("UPDATE completions SET last_used = ? WHERE key = ?", (now, key))
+        self.connection.commit()
+        self.hits += 1
+
+        return row[0]
+
+    def put(self, key: str, completion: str | None) -> None:
+        # The chat API returns no content for filtered or tool-call responses, there is nothing to cache
+        if completion is None:
+            return
+
+        now = time.time()
+
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger
+        self.connection.execute(
+            "INSERT INTO completions (key, completion, size, created_at, last_used) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET completion = excluded.completion, size = excluded.size, "
+            "created_at = excluded.created_at, last_used = excluded.last_used",
+            (key, completion, len(completion.encode("utf-8")), now, now),
+        )
+        self.connection.commit()
+
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete expired entries, then the least recently used ones until the cache is back under 90% of `max_bytes`"""
+        cursor = self.connection.execute("DELETE FROM completions WHERE created_at < ?", (time.time() - self.ttl,))
+        self.evictions += cursor.rowcount
+
+        total_bytes = self.connection.execute("SELECT total FROM completions_size WHERE id = 0").fetchone()[0]
+
+        if total_bytes > self.max_bytes:
+            excess = total_bytes - int(self.max_bytes * 0.9)
+
+            evicted_keys = []
+            cursor = self.connection.execute("SELECT key, size FROM completions ORDER BY last_used ASC")
+            for key, size in cursor:
+                if excess <= 0:
+                    break
+
+                evicted_keys.append((key,))
+                excess -= size
+            cursor.close()
+
+            self.connection.executemany("DELETE FROM completions WHERE key = ?", evicted_keys)
+            self.evictions += len(evicted_keys)
+
+        self.connection.commit()
+
+    def stats(self) -> dict:
+        entries, total_bytes = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completions").fetchone()
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import re
+import sqlite3
+import time
+from array import array
+
+# Default on-disk budget for cached vectors, a 1536-d float32 vector is ~6KB
+EMBEDDING_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+
+def normalize_embedding_text(text: str) -> str:
+    """Collapse whitespace so texts that only differ in spacing share a cache entry"""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed, SQLite-backed store of embeddings.
+
+    Entries are keyed by a hash of the embedding deployment and the normalized text, so an unchanged
+    Title or Content is never embedded twice. Vectors are stored as raw float32 blobs and the least
+    recently used entries are evicted once the store grows past `max_bytes`. Triggers keep the total size
+    in embeddings_size, so checking the budget after a write does not scan the table.
+    """
+
+    def __init__(self, path: str, deployment: str, max_bytes: int = EMBEDDING_CACHE_MAX_BYTES):
+        self.path = path
+        self.deployment = deployment
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked pool workers, so open one per process
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL)")
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings "
+                "BEGIN UPDATE embeddings_size SET total = total + new.size WHERE id = 0; END"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_update AFTER UPDATE OF size ON embeddings "
+                "BEGIN UPDATE embeddings_size SET total = total + new.size - old.size WHERE id = 0; END"
+            )
+            self._connection.execute(
+                "CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings "
+                "BEGIN UPDATE embeddings_size SET total = total - old.size WHERE id = 0; END"
+            )
+            # Caches written before the running total existed are summed once
+            self._connection.execute(
+                "INSERT OR IGNORE INTO embeddings_size (id, total) SELECT 0, COALESCE(SUM(size), 0) FROM embeddings "
+                "WHERE NOT EXISTS (SELECT 1 FROM embeddings_size)"
+            )
+            self._connection.commit()
+            self._pid = os.getpid()
+
+        return self._connection
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.deployment}\n{normalize_embedding_text(text)}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: list[str]) -> list[list[float] | None]:
+        """
+        Look up the embeddings of many texts.
+
+        Args:
+            texts (list[str]): The texts to look up.
+
+        Returns:
+            list[list[float] | None]: The cached embeddings in the same order as `texts`, None for a miss.
+        """
+        keys = [self.key(text) for text in texts]
+
+        found = {}
+        # Stay well below SQLite's bound parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = list(set(keys[start : start + 500]))
+            rows = self.connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+
+            for key, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                found[key] = vector.tolist()
+
+        if found:
+            now = time.time()
+            self.connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+            self.connection.commit()
+
+        embeddings = [found.get(key) for key in keys]
+
+        hits = sum(1 for embedding in embeddings if embedding is not None)
+        self.hits += hits
+        self.misses += len(embeddings) - hits
+
+        return embeddings
+
+    def put_many(self, texts: list[str], embeddings: list[list[float]]) -> None:
+        """
+        Store the embeddings of many texts, evicting old entries if the cache is over budget.
+
+        Args:
+            texts (list[str]): The texts that were embedded.
+            embeddings (list[list[float]]): The embeddings, in the same order as `texts`.
+        """
+        now = time.time()
+
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            blob = array("f", embedding).tobytes()
+            rows.append((self.key(text), blob, len(blob), now))
+
+        # An upsert rather than INSERT OR REPLACE, whose implicit delete would not fire the size trigger
+        self.connection.executemany(
+            "INSERT INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET vector = excluded.vector, size = excluded.size, last_used = excluded.last_used",
+            rows,
+        )
+        self.connection.commit()
+
+        self.evict()
+
+    def get(self, text: str) -> list[float] | None:
+        return self.get_many([text])[0]
+
+    def put(self, text: str, embedding: list[float]) -> None:
+        self.put_many([text], [embedding])
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache is back under 90% of `max_bytes`"""
+        total_bytes = self.connection.execute("SELECT total FROM embeddings_size WHERE id = 0").fetchone()[0]
+
+        if total_bytes <= self.max_bytes:
+            return
+
+        excess = total_bytes - int(self.max_bytes * 0.9)
+
+        evicted_keys = []
+        cursor = self.connection.execute("SELECT key, size FROM embeddings ORDER BY last_used ASC")
+        for key, size in cursor:
+            if excess <= 0:
+                break
+
+            evicted_keys.append((key,))
+            excess -= size
+        cursor.close()
+
+        self.connection.executemany("DELETE FROM embeddings WHERE key = ?", evicted_keys)
+        self.connection.commit()
+        self.evictions += len(evicted_keys)
+
+    def stats(self) -> dict:
+        entries, total_bytes = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": total_bytes,
+        }
@@ -0,0 +1,187 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from tools.local_vector_index import LocalVectorIndex
+
+# The settings create_search_index used before it took a profile
+DEFAULT_HNSW_PROFILE = {"algorithm": "hnsw", "m": 4, "ef_construction": 400, "ef_search": 500}
+
+# Azure AI Search accepts m in 4..10 and ef_construction, ef_search in 100..1000, so only sweep those
+HNSW_M_VALUES = [4, 6, 8, 10]
+HNSW_EF_CONSTRUCTION_VALUES = [100, 200, 400, 800]
+HNSW_EF_SEARCH_VALUES = [100, 200, 400, 500, 800, 1000]
+HNSW_MIN_RECALL = 0.95
+HNSW_SWEEP_QUERIES = 500
+
+
+def load_hnsw_profile(path: str) -> dict:
+    """Load a profile written by HnswSweep.write_profile, falling back to DEFAULT_HNSW_PROFILE for missing settings"""
+    with open(path, "r", encoding="utf-8") as f:
+        profile = json.load(f)
+
+    return {**DEFAULT_HNSW_PROFILE, **{key: profile[key] for key in DEFAULT_HNSW_PROFILE if key in profile}}
+
+
+def pareto_front(rows: list[dict], maximize: list[str], minimize: list[str]) -> list[dict]:
+    """
+    The rows no other row dominates, i.e. is at least as good on every objective and better on one.
+
+    Args:
+        rows (list[dict]): The measurements.
+        maximize (list[str]): The keys where higher is better.
+        minimize (list[str]): The keys where lower is better.
+
+    Returns:
+        list[dict]: The Pareto-optimal rows, in their original order.
+    """
+    # Negate the maximized objectives so every column is "lower is better"
+    costs = np.array([[-row[key] for key in maximize] + [row[key] for key in minimize] for row in rows], dtype=np.float64)
+
+    front = []
+    for i, cost in enumerate(costs):
+        dominated = np.any(np.all(costs <= cost, axis=1) & np.any(costs < cost, axis=1))
+        if not dominated:
+            front.append(rows[i])
+
+    return front
+
+
+class HnswSweep:
+    """
+    Tunes the HNSW settings of the search index against exhaustive KNN on an exported corpus.
+
+    Every (m, ef_construction) graph is built once with hnswlib and queried at every ef_search, since
+    ef_search only affects queries. Each configuration reports recall@k against the exact top-k,
+    single-query latency, build time and memory. The exact search is measured too, as the
+    "exhaustiveKnn" algorithm the index can use instead of HNSW. Without a query set, `synthetic_queries`
+    marks the queries as document vectors held out of the index, so reports say the recall is an estimate.
+    """
+
+    def __init__(self, index: LocalVectorIndex, query_vectors: list[list[float]], k: int = 10, synthetic_queries: bool = False):
+        self.index = index
+        self.query_vectors = index.normalize(query_vectors)
+        self.k = k
+        self.synthetic_queries = synthetic_queries
+
+        self.exact_indices, _ = index.exact_search(self.query_vectors, k)
+        self.results = []
+
+    def recall(self, indices: list[list[int]]) -> float:
+        """Mean fraction of the exact top-k documents each query found"""
+        hits = [len(set(map(int, found)).intersection(map(int, exact))) / len(exact) for found, exact in zip(indices, self.exact_indices)]
+
+        return float(np.mean(hits)) if hits else 0.0
+
+    def time_queries(self, search) -> tuple[list[list[int]], np.ndarray]:
+        """Run every query on its own, returning the found documents and the latencies in milliseconds"""
+        indices, latencies = [], []
+        for vector in self.query_vectors:
+            start = time.perf_counter()
+            found, _ = search(vector[np.newaxis], self.k)
+            latencies.append(time.perf_counter() - start)
+            indices.append(found[0])
+
+        return indices, np.array(latencies) * 1000
+
+    def measure(self, algorithm: str, indices: list[list[int]], latencies: np.ndarray, **settings) -> dict:
+        p50, p95 = np.percentile(latencies, [50, 95])
+        result = {
+            "algorithm": algorithm,
+            **settings,
+            f"recall@{self.k}": self.recall(indices),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "build_seconds": self.index.build_seconds if algorithm == "hnsw" else 0.0,
+            "memory_bytes": self.index.memory_bytes() if algorithm == "hnsw" else int(self.index.matrix.nbytes),
+        }
+        self.results.append(result)
+
+        return result
+
+    def run(
+        self,
+        m_values: list[int] = HNSW_M_VALUES,
+        ef_construction_values: list[int] = HNSW_EF_CONSTRUCTION_VALUES,
+        ef_search_values: list[int] = HNSW_EF_SEARCH_VALUES,
+    ) -> list[dict]:
+        """
+        Measure the exact search and every HNSW configuration of the grid.
+
+        Returns:
+            list[dict]: One measurement per configuration, also kept in `results`.
+        """
+        self.index.hnsw = None
+        self.measure("exhaustiveKnn", *self.time_queries(self.index.exact_search))
+
+        for m in m_values:
+            for ef_construction in ef_construction_values:
+                self.index.build_hnsw(m=m, ef_construction=ef_construction)
+                # Single-threaded like one query against one replica
+                self.index.hnsw.set_num_threads(1)
+                print(f"Built m={m} ef_construction={ef_construction} in {self.index.build_seconds:.1f}s")
+
+                for ef_search in ef_search_values:
+                    self.index.hnsw.set_ef(max(ef_search, self.k))
+                    indices, latencies = self.time_queries(self.index.hnsw_search)
+                    self.measure("hnsw", indices, latencies, m=m, ef_construction=ef_construction, ef_search=ef_search)
+
+        self.index.hnsw = None
+
+        return self.results
+
+    def pareto_front(self) -> list[dict]:
+        return pareto_front(self.results, maximize=[f"recall@{self.k}"], minimize=["p50_ms", "build_seconds", "memory_bytes"])
+
+    def select_profile(self, min_recall: float = HNSW_MIN_RECALL) -> dict:
+        """
+        Pick the lowest-latency Pareto-optimal configuration reaching `min_recall`, or the most accurate one if none does.
+
+        Returns:
+            dict: A profile for AISearch.create_search_index, with the measurements that chose it.
+        """
+        front = self.pareto_front()
+        recall_key = f"recall@{self.k}"
+
+        candidates = [result for result in front if result[recall_key] >= min_recall]
+        if candidates:
+            best = min(candidates, key=lambda result: (result["p50_ms"], result["memory_bytes"], result["build_seconds"]))
+        else:
+            best = max(front, key=lambda result: (result[recall_key], -result["p50_ms"]))
+
+        return {**DEFAULT_HNSW_PROFILE, **best}
+
+    def print_results(self) -> None:
+        front = self.pareto_front()
+        recall_key = f"recall@{self.k}"
+
+        queries = "synthetic queries (held-out document vectors)" if self.synthetic_queries else "queries"
+        print(f"\n{len(self.index)} documents, {len(self.query_vectors)} {queries}, k={self.k} (* Pareto-optimal)")
+        print(f"  {'algorithm':<15}{'m':>4}{'ef_c':>6}{'ef_s':>6}{recall_key:>12}{'p50 ms':>10}{'p95 ms':>10}{'build s':>10}{'MB':>10}")
+        for result in self.results:
+            print(
+                f"{'*' if result in front else ' '} {result['algorithm']:<15}{result.get('m', '-'):>4}{result.get('ef_construction', '-'):>6}"
+                f"{result.get('ef_search', '-'):>6}{result[recall_key]:>12.3f}{result['p50_ms']:>10.3f}{result['p95_ms']:>10.3f}"
+                f"{result['build_seconds']:>10.1f}{result['memory_bytes'] / 2**20:>10.1f}"
+            )
+
+    def write_profile(self, path: str, min_recall: float = HNSW_MIN_RECALL) -> dict:
+        """Write the selected profile with the whole Pareto front, so the choice can be revisited without re-running the sweep"""
+        profile = self.select_profile(min_recall)
+        report = {
+            **profile,
+            "min_recall": min_recall,
+            "documents": len(self.index),
+            "queries": len(self.query_vectors),
+            "synthetic_queries": self.synthetic_queries,
+            "k": self.k,
+            "pareto_front": self.pareto_front(),
+        }
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+
+        return profile
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+from typing import Iterator
+
+from azure.search.documents import SearchClient
+
+from tools.bulk_delete import bulk_delete
+from tools.index_export import strip_search_metadata
+from tools.indexing_batcher import INDEXING_MAX_BATCH_SIZE, IndexingBatcher
+from tools.local_text_index import load_corpus
+from tools.local_vector_index import VECTOR_FIELDS
+
+# Vectors are computed from Title and Content, so comparing those covers them too
+DIFF_FIELDS = ["Title", "Content"]
+
+
+def iter_documents(path: str) -> Iterator[dict]:
+    """Stream the documents of a .jsonl export one line at a time, .json exports and corpus folders are loaded whole"""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        yield from load_corpus([path])
+
+
+def content_hash(document: dict, fields: list[str] = DIFF_FIELDS) -> bytes:
+    """A 16 byte digest of the compared fields, missing fields hash like null"""
+    content = json.dumps([document.get(field) for field in fields], ensure_ascii=False, sort_keys=True)
+
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+
+def hash_documents(path: str, key_field: str = "ArticleId", fields: list[str] = DIFF_FIELDS) -> dict[str, bytes]:
+    return {str(document[key_field]): content_hash(document, fields) for document in iter_documents(path)}
+
+
+def plan_diff(source_path: str, target_path: str, key_field: str = "ArticleId", fields: list[str] = DIFF_FIELDS) -> dict:
+    """
+    Plan the changes that make the target index match the source, e.g. dev's export and prod's.
+
+    Only the target's digests are held in memory while the source is streamed, so planning is one pass
+    over each export.
+
+    Args:
+        source_path (str): The export, or local corpus, with the wanted documents.
+        target_path (str): The export of the index to change.
+        key_field (str, optional): The key field. Defaults to "ArticleId".
+        fields (list[str], optional): The fields compared. Defaults to DIFF_FIELDS.
+
+    Returns:
+        dict: The keys to "add", "update" and "delete" in the target, and the number "unchanged".
+    """
+    target_hashes = hash_documents(target_path, key_field, fields)
+
+    plan = {"source": source_path, "target": target_path, "key_field": key_field, "fields": fields, "add": [], "update": [], "delete": [], "unchanged": 0}
+    seen = set()
+    for document in iter_documents(source_path):
+        key = str(document[key_field])
+        if key in seen:
+            continue
+        seen.add(key)
+
+        target_hash = target_hashes.get(key)
+        if target_hash is None:
+            plan["add"].append(key)
+        elif target_hash != content_hash(document, fields):
+            plan["update"].append(key)
+        else:
+            plan["unchanged"] += 1
+
+    plan["delete"] = [key for key in target_hashes if key not in seen]
+
+    return plan
+
+
+def print_plan(plan: dict) -> None:
+    print(f"{plan['source']} -> {plan['target']}, comparing {', '.join(plan['fields'])}")
+    print(f"Add: {len(plan['add'])}, Update: {len(plan['update'])}, Delete: {len(plan['delete'])}, Unchanged: {plan['unchanged']}")
+
+
+def write_plan(plan: dict, path: str) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plan, f, ensure_ascii=False, indent=4)
+
+
+def load_plan(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def execute_plan(search_client: SearchClient, plan: dict, vectors_path: str = None, batch_size: int = INDEXING_MAX_BATCH_SIZE) -> dict:
+    """
+    Apply a plan to the target index with mergeOrUpload and delete batches of only the planned keys.
+
+    The added and updated documents are read from the plan's source, which must be an export of index
+    documents, not a raw corpus. Exports written without vectors need their `vectors_path` side file,
+    otherwise the uploaded documents would lose their vectors, so a ValueError is raised before anything
+    is applied.
+
+    Args:
+        search_client (SearchClient): The client of the target index.
+        plan (dict): The plan from plan_diff.
+        vectors_path (str, optional): The vectors side file of the source export. Defaults to vectors inside the documents.
+        batch_size (int, optional): The actions per request. Defaults to INDEXING_MAX_BATCH_SIZE.
+
+    Returns:
+        dict: {"uploaded": count, "deleted": count, "failed": {key: error message}}
+    """
+    key_field = plan["key_field"]
+    keys = set(plan["add"]).union(plan["update"])
+
+    vectors = {}
+    if vectors_path and keys:
+        vectors = {str(vector[key_field]): vector for vector in iter_documents(vectors_path) if str(vector[key_field]) in keys}
+    elif keys:
+        document = next((document for document in iter_documents(plan["source"]) if str(document[key_field]) in keys), {})
+        if not any(field in document for field in VECTOR_FIELDS):
+            raise ValueError(f"{plan['source']} has no vectors and no vectors side file, uploading it would drop the vectors")
+
+    with IndexingBatcher(search_client, key_field=key_field, action="mergeOrUpload", max_batch_size=batch_size) as batcher:
+        for document in iter_documents(plan["source"]) if keys else []:
+            key = str(document[key_field])
+            if key not in keys:
+                continue
+            keys.discard(key)
+
+            batcher.add({**strip_search_metadata(document), **vectors.get(key, {})})
+
+    report = {"uploaded": batcher.indexed, "deleted": 0, "failed": dict(batcher.failed)}
+
+    # The exports list chunk documents on their own, so the plan already has every chunk key to delete
+    delete_report = bulk_delete(search_client, plan["delete"], key_field=key_field, include_chunks=False, batch_size=batch_size)
+    report["deleted"] = delete_report["deleted"]
+    report["failed"].update(delete_report["failed"])
+
+    return report
@@ -0,0 +1,137 @@
+import json
+import os
+from typing import Iterator
+
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes.models import SearchIndex
+
+EXPORT_PAGE_SIZE = 1000
+# The service rejects $skip above this, so indexes without a sortable, filterable key can only be paged this far
+EXPORT_MAX_SKIP = 100000
+VECTOR_FIELD_TYPE = "Collection(Edm.Single)"
+
+
+def odata_string(value: str) -> str:
+    """Quote a value as an OData string literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def strip_search_metadata(document: dict) -> dict:
+    """Drop the @search.score, @search.highlights, ... keys the service adds to every result"""
+    return {field: value for field, value in document.items() if not field.startswith("@search.")}
+
+
+def iter_documents_keyset(
+    search_client: SearchClient,
+    key_field: str = "ArticleId",
+    select: list[str] = None,
+    page_size: int = EXPORT_PAGE_SIZE,
+    filter: str = None,
+    after: str = None,
+) -> Iterator[dict]:
+    """
+    Page through every document of an index in key order.
+
+    Each page is a new query filtered to keys greater than the last key seen, so the index is never
+    scanned with $skip and there is no 100,000 document limit. Requires a sortable, filterable key field.
+
+    Args:
+        search_client (SearchClient): The client of the index.
+        key_field (str, optional): The key field. Defaults to "ArticleId".
+        select (list[str], optional): The fields to return. Defaults to every retrievable field.
+        page_size (int, optional): The documents per request. Defaults to EXPORT_PAGE_SIZE.
+        filter (str, optional): Only page through the documents matching this filter, e.g. a key range. Defaults to every document.
+        after (str, optional): Start after this key, e.g. to resume. Defaults to the first key.
+
+    Yields:
+        dict: The documents, without search metadata.
+    """
+    last_key = after
+    while True:
+        filters = [f"({filter})" if filter else None, f"{key_field} gt {odata_string(last_key)}" if last_key is not None else None]
+        results = search_client.search(
+            search_text="*",
+            filter=" and ".join(part for part in filters if part) or None,
+            order_by=[f"{key_field} asc"],
+            select=select,
+            top=page_size,
+        )
+
+        count = 0
+        for result in results:
+            count += 1
+            last_key = result[key_field]
+            yield strip_search_metadata(result)
+
+        if count < page_size:
+            break
+
+
+def iter_documents_skip(search_client: SearchClient, select: list[str] = None, page_size: int = EXPORT_PAGE_SIZE) -> Iterator[dict]:
+    """Page through at most the first EXPORT_MAX_SKIP + page_size documents of an index with $skip"""
+    skip = 0
+    while skip <= EXPORT_MAX_SKIP:
+        results = search_client.search(search_text="*", select=select, top=page_size, skip=skip)
+
+        count = 0
+        for result in results:
+            count += 1
+            yield strip_search_metadata(result)
+
+        if count < page_size:
+            break
+
+        skip += page_size
+
+
+def export_jsonl(
+    search_client: SearchClient,
+    index: SearchIndex,
+    path: str,
+    vectors_path: str = None,
+    page_size: int = EXPORT_PAGE_SIZE,
+) -> int:
+    """
+    Stream every document of an index to a JSON Lines file, one document per line.
+
+    Vector fields are left out of the main file. With `vectors_path` they are requested and written to a
+    side file instead, one {key field: ..., vector field: [...]} line per document in the same order.
+    Only one page of documents is held in memory at a time.
+
+    Args:
+        search_client (SearchClient): The client of the index.
+        index (SearchIndex): The index definition, from SearchIndexClient.get_index.
+        path (str): The JSONL file for the documents.
+        vectors_path (str, optional): The JSONL file for the vectors. Defaults to not exporting vectors.
+        page_size (int, optional): The documents per request. Defaults to EXPORT_PAGE_SIZE.
+
+    Returns:
+        int: The number of documents exported.
+    """
+    key_field = next(field for field in index.fields if field.key)
+    retrievable_fields = [field for field in index.fields if not field.hidden]
+    vector_fields = [field.name for field in retrievable_fields if field.type == VECTOR_FIELD_TYPE]
+    document_fields = [field.name for field in retrievable_fields if field.type != VECTOR_FIELD_TYPE]
+
+    select = document_fields + vector_fields if vectors_path else document_fields
+
+    if key_field.sortable and key_field.filterable:
+        documents = iter_documents_keyset(search_client, key_field.name, select=select, page_size=page_size)
+    else:
+        print(f"WARNING: {key_field.name} is not sortable and filterable, only the first {EXPORT_MAX_SKIP} documents can be exported.")
+        documents = iter_documents_skip(search_client, select=select, page_size=page_size)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    count = 0
+    with open(path, "w", encoding="utf-8") as f, open(vectors_path or os.devnull, "w", encoding="utf-8") as vectors_file:
+        for document in documents:
+            vectors = {field: document.pop(field, None) for field in vector_fields}
+
+            f.write(json.dumps(document, ensure_ascii=False) + "\n")
+            if vectors_path:
+                vectors_file.write(json.dumps({key_field.name: document[key_field.name], **vectors}) + "\n")
+
+            count += 1
+
+    return count
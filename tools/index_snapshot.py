@@ -0,0 +1,250 @@
+import gzip
+import hashlib
+import json
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterator
+
+import numpy as np
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+from azure.search.documents.indexes.models import SearchIndex
+
+from tools.index_diff import content_hash
+from tools.index_export import EXPORT_MAX_SKIP, iter_documents_keyset, iter_documents_skip
+from tools.indexing_batcher import INDEXING_MAX_BATCH_SIZE, IndexingBatcher
+
+SNAPSHOT_MANIFEST_FILE = "manifest.json"
+SNAPSHOT_DOCUMENTS_FILE = "documents.jsonl.gz"
+SNAPSHOT_HASHES_FILE = "hashes.json.gz"
+SNAPSHOT_VECTOR_DTYPES = {"float32": np.float32, "float16": np.float16}
+SNAPSHOT_COMPRESSION_LEVEL = 6
+SNAPSHOT_RESTORE_WORKERS = 4
+
+
+def vector_field_dimensions(index: SearchIndex) -> dict[str, int]:
+    """The vector fields of an index and their dimensions, other Collection(Edm.Single) fields are plain data"""
+    return {field.name: field.vector_search_dimensions for field in index.fields if field.vector_search_dimensions and not field.hidden}
+
+
+def load_manifest(directory: str) -> dict:
+    with open(os.path.join(directory, SNAPSHOT_MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_hashes(directory: str) -> dict[str, str]:
+    with gzip.open(os.path.join(directory, SNAPSHOT_HASHES_FILE), "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def latest_snapshot(directory: str) -> str | None:
+    """The newest complete snapshot in a folder of timestamped snapshots"""
+    if not os.path.isdir(directory):
+        return None
+
+    snapshots = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    complete = [snapshot for snapshot in snapshots if os.path.exists(os.path.join(snapshot, SNAPSHOT_MANIFEST_FILE))]
+
+    return complete[-1] if complete else None
+
+
+def snapshot_chain(directory: str) -> list[str]:
+    """A snapshot followed by the snapshots it is incremental on, newest first"""
+    chain = [os.path.abspath(directory)]
+    while base := load_manifest(chain[-1]).get("base"):
+        chain.append(os.path.abspath(os.path.join(chain[-1], base)))
+
+    return chain
+
+
+def write_snapshot(
+    search_client: SearchClient,
+    index: SearchIndex,
+    directory: str,
+    base: str = None,
+    vector_dtype: str = "float32",
+) -> dict:
+    """
+    Write a point-in-time snapshot of an index to a directory.
+
+    Documents go to a gzipped JSON Lines file and each vector field to a raw array file of `vector_dtype`
+    with one row per document line, NaN rows standing for missing vectors. The manifest holds the index
+    definition from get_index, so a restore can recreate the index. Every snapshot also stores a digest
+    of every document, and with `base` only the documents whose digest changed since that snapshot are
+    written, plus the keys deleted since.
+
+    Args:
+        search_client (SearchClient): The client of the index.
+        index (SearchIndex): The index definition, from SearchIndexClient.get_index.
+        directory (str): The new snapshot's directory.
+        base (str, optional): A previous snapshot of the same index to write an incremental snapshot on. Defaults to a full snapshot.
+        vector_dtype (str, optional): "float32" or "float16", which halves the vectors at ~3 significant digits. Defaults to "float32".
+
+    Returns:
+        dict: The manifest.
+    """
+    key_field = next(field for field in index.fields if field.key)
+    vector_fields = vector_field_dimensions(index)
+    document_fields = [field.name for field in index.fields if not field.hidden and field.name not in vector_fields]
+    dtype = SNAPSHOT_VECTOR_DTYPES[vector_dtype]
+
+    base_hashes = load_hashes(base) if base else {}
+
+    if key_field.sortable and key_field.filterable:
+        documents = iter_documents_keyset(search_client, key_field.name, select=document_fields + list(vector_fields))
+    else:
+        print(f"WARNING: {key_field.name} is not sortable and filterable, only the first {EXPORT_MAX_SKIP} documents can be snapshotted.")
+        documents = iter_documents_skip(search_client, select=document_fields + list(vector_fields))
+
+    os.makedirs(directory, exist_ok=True)
+
+    hashes = {}
+    written = 0
+    vector_files = {field: open(os.path.join(directory, f"{field}.{vector_dtype}"), "wb") for field in vector_fields}
+    try:
+        with gzip.open(os.path.join(directory, SNAPSHOT_DOCUMENTS_FILE), "wt", encoding="utf-8", compresslevel=SNAPSHOT_COMPRESSION_LEVEL) as f:
+            for document in documents:
+                vectors = {field: document.pop(field, None) for field in vector_fields}
+
+                digest = hashlib.blake2b(content_hash(document, document_fields), digest_size=16)
+                for field in vector_fields:
+                    digest.update(np.asarray(vectors[field] or [], dtype=np.float32).tobytes())
+
+                key = document[key_field.name]
+                hashes[key] = digest.hexdigest()
+                if base_hashes.get(key) == hashes[key]:
+                    continue
+
+                f.write(json.dumps(document, ensure_ascii=False) + "\n")
+                for field, dimensions in vector_fields.items():
+                    vector = vectors[field] if vectors[field] else np.full(dimensions, np.nan)
+                    vector_files[field].write(np.asarray(vector, dtype=dtype).tobytes())
+                written += 1
+    finally:
+        for vector_file in vector_files.values():
+            vector_file.close()
+
+    with gzip.open(os.path.join(directory, SNAPSHOT_HASHES_FILE), "wt", encoding="utf-8", compresslevel=SNAPSHOT_COMPRESSION_LEVEL) as f:
+        json.dump(hashes, f)
+
+    manifest = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "index": index.serialize(),
+        "key_field": key_field.name,
+        "vector_fields": vector_fields,
+        "vector_dtype": vector_dtype,
+        "base": os.path.relpath(os.path.abspath(base), os.path.abspath(directory)) if base else None,
+        "documents": written,
+        "total": len(hashes),
+        "deleted": [key for key in base_hashes if key not in hashes],
+    }
+    with open(os.path.join(directory, SNAPSHOT_MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+
+    return manifest
+
+
+def iter_snapshot_documents(directory: str, vectors: bool = True) -> Iterator[dict]:
+    """
+    Stream the documents of the index as it was at a snapshot, resolving incremental snapshots.
+
+    Snapshots are read newest first and each key is yielded once, from the newest snapshot that has it,
+    so a restore uploads every document once. Also usable as input for offline tools, e.g.
+    LocalVectorIndex(list(iter_snapshot_documents(directory))).
+
+    Args:
+        directory (str): The snapshot.
+        vectors (bool, optional): Include the vector fields, as float lists. Defaults to True.
+
+    Yields:
+        dict: The documents.
+    """
+    live = load_hashes(directory)
+    seen = set()
+
+    for snapshot in snapshot_chain(directory):
+        manifest = load_manifest(snapshot)
+        key_field = manifest["key_field"]
+        dtype = SNAPSHOT_VECTOR_DTYPES[manifest["vector_dtype"]]
+
+        vector_arrays = {}
+        if vectors and manifest["documents"]:
+            vector_arrays = {
+                field: np.memmap(os.path.join(snapshot, f"{field}.{manifest['vector_dtype']}"), dtype=dtype, mode="r").reshape(-1, dimensions)
+                for field, dimensions in manifest["vector_fields"].items()
+            }
+
+        with gzip.open(os.path.join(snapshot, SNAPSHOT_DOCUMENTS_FILE), "rt", encoding="utf-8") as f:
+            for row, line in enumerate(f):
+                document = json.loads(line)
+                key = document[key_field]
+                if key in seen or key not in live:
+                    continue
+                seen.add(key)
+
+                for field, array in vector_arrays.items():
+                    if not np.isnan(array[row, 0]):
+                        document[field] = array[row].astype(np.float32).tolist()
+
+                yield document
+
+
+def restore_snapshot(
+    directory: str,
+    search_index_client: SearchIndexClient,
+    search_client: SearchClient,
+    index_name: str,
+    batch_size: int = INDEXING_MAX_BATCH_SIZE,
+    workers: int = SNAPSHOT_RESTORE_WORKERS,
+) -> dict:
+    """
+    Recreate an index from a snapshot: create it from the manifest's definition, then upload every document.
+
+    Args:
+        directory (str): The snapshot.
+        search_index_client (SearchIndexClient): The client of the target service.
+        search_client (SearchClient): The client of the target index.
+        index_name (str): The target index's name, the one `search_client` was created with.
+        batch_size (int, optional): The documents read per upload, the batcher splits them by size. Defaults to INDEXING_MAX_BATCH_SIZE.
+        workers (int, optional): Uploads in flight. Defaults to SNAPSHOT_RESTORE_WORKERS.
+
+    Returns:
+        dict: {"uploaded": count, "failed": {key: error message}}
+    """
+    manifest = load_manifest(directory)
+    key_field = manifest["key_field"]
+
+    index = SearchIndex.deserialize(manifest["index"])
+    index.name = index_name
+    index.e_tag = None
+    search_index_client.create_or_update_index(index)
+
+    report = {"uploaded": 0, "failed": {}}
+    batcher = IndexingBatcher(search_client, key_field=key_field)
+
+    def collect(future):
+        result = future.result()
+        report["uploaded"] += result["indexed"]
+        report["failed"].update(result["failed"])
+
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        batch = []
+        for document in iter_snapshot_documents(directory):
+            batch.append(document)
+            if len(batch) == batch_size:
+                in_flight.append(executor.submit(batcher.send, batch))
+                batch = []
+
+                # Bounds the documents held in memory
+                if len(in_flight) >= workers * 2:
+                    collect(in_flight.popleft())
+
+        if batch:
+            in_flight.append(executor.submit(batcher.send, batch))
+        while in_flight:
+            collect(in_flight.popleft())
+
+    return report
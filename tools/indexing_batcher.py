@@ -0,0 +1,274 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from azure.core.exceptions import AzureError, HttpResponseError
+from azure.search.documents import IndexDocumentsBatch, SearchClient
+
+# The service accepts at most 1,000 actions per indexing request
+INDEXING_MAX_BATCH_SIZE = 1000
+# and rejects requests above 16 MB, a page of documents with two 1536 float vectors each is ~60 KB per document
+INDEXING_MAX_BATCH_BYTES = 12 * 2**20
+INDEXING_INITIAL_BATCH_SIZE = 200
+INDEXING_MIN_BATCH_SIZE = 10
+INDEXING_BATCH_SIZE_STEP = 50
+# Batches slower than this shrink, as the service is likely under load
+INDEXING_TARGET_SECONDS = 5.0
+INDEXING_MAX_RETRIES = 5
+INDEXING_RETRY_SECONDS = 1.0
+# Per-document status codes the service documents as transient: version conflict, index busy, throttled, unavailable
+INDEXING_RETRY_STATUS_CODES = {409, 422, 429, 500, 503}
+INDEXING_THROTTLED_STATUS_CODES = {429, 503}
+# A few throttled documents in a 207 only stop the batch size from growing, this fraction of the batch halves it
+INDEXING_THROTTLED_FRACTION = 0.1
+
+INDEXING_ACTIONS = {
+    "upload": IndexDocumentsBatch.add_upload_actions,
+    "merge": IndexDocumentsBatch.add_merge_actions,
+    "mergeOrUpload": IndexDocumentsBatch.add_merge_or_upload_actions,
+    "delete": IndexDocumentsBatch.add_delete_actions,
+}
+
+
+def document_bytes(document: dict) -> int:
+    """Size of a document in the request body, vectors included"""
+    return len(json.dumps(document, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+class IndexingBatcher:
+    """
+    Shared sender for every indexing request: uploads, merges and deletes.
+
+    Documents are split into batches by both action count and serialized size, so pages of vector
+    documents stay under the request size limit. The batch size adapts like TCP congestion control: it
+    grows by INDEXING_BATCH_SIZE_STEP after every full batch that finished within `target_seconds`, and
+    shrinks when the service throttles (503/429, for the request or for many documents of a 207) or a
+    batch is slow. Documents that failed with a transient status are retried on their own with exponential
+    backoff, and every document that still failed is reported with its error, never dropped silently.
+
+    A document's "@search.action" key, if any, overrides the batcher's action, so uploads and deletes can
+    be mixed. `send` indexes a list and waits, and is safe to call from several threads sharing one
+    batcher. `add` accumulates documents and sends them in the background when `max_workers` > 1.
+
+    Usage:
+        with IndexingBatcher(search_client, action="mergeOrUpload") as batcher:
+            for document in documents:
+                batcher.add(document)
+        print_indexing_report(batcher.report())
+    """
+
+    def __init__(
+        self,
+        search_client: SearchClient,
+        key_field: str = "ArticleId",
+        action: str = "upload",
+        max_batch_size: int = INDEXING_MAX_BATCH_SIZE,
+        max_batch_bytes: int = INDEXING_MAX_BATCH_BYTES,
+        target_seconds: float = INDEXING_TARGET_SECONDS,
+        max_retries: int = INDEXING_MAX_RETRIES,
+        max_workers: int = 1,
+    ):
+        self.search_client = search_client
+        self.key_field = key_field
+        self.action = action
+        self.max_batch_size = min(max_batch_size, INDEXING_MAX_BATCH_SIZE)
+        self.max_batch_bytes = max_batch_bytes
+        self.target_seconds = target_seconds
+        self.max_retries = max_retries
+
+        self.batch_size = min(INDEXING_INITIAL_BATCH_SIZE, self.max_batch_size)
+
+        self.indexed = 0
+        self.failed = {}
+        self.batches = 0
+        self.retried = 0
+        self.throttled = 0
+
+        self._documents = []
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        self._futures = []
+
+    def __enter__(self) -> "IndexingBatcher":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def add(self, document: dict) -> None:
+        self._documents.append(document)
+
+        if len(self._documents) >= self.max_batch_size:
+            self.flush()
+
+    def add_many(self, documents: list[dict]) -> None:
+        for document in documents:
+            self.add(document)
+
+    def flush(self) -> None:
+        """Send the accumulated documents, in the background if the batcher has workers"""
+        if not self._documents:
+            return
+
+        documents, self._documents = self._documents, []
+
+        if self._executor is not None:
+            self._futures.append(self._executor.submit(self.send, documents))
+        else:
+            self.send(documents)
+
+    def close(self) -> dict:
+        """Flush the remaining documents and wait for every batch, returns report()"""
+        self.flush()
+
+        if self._executor is not None:
+            for future in self._futures:
+                future.result()
+            self._executor.shutdown()
+            self._futures = []
+
+        return self.report()
+
+    def report(self) -> dict:
+        """{"indexed": count, "failed": {key: error message}, "batches", "retried", "throttled", "batch_size"}"""
+        with self._lock:
+            return {
+                "indexed": self.indexed,
+                "failed": dict(self.failed),
+                "batches": self.batches,
+                "retried": self.retried,
+                "throttled": self.throttled,
+                "batch_size": self.batch_size,
+            }
+
+    def send(self, documents: list[dict]) -> dict:
+        """
+        Index documents and wait for them, retrying transient failures.
+
+        Args:
+            documents (list[dict]): The documents, or {key field: key} for deletes.
+
+        Returns:
+            dict: {"indexed": count, "failed": {key: error message}} for these documents only.
+        """
+        result = {"indexed": 0, "failed": {}}
+
+        # (action, document without "@search.action", size, attempts)
+        pending = []
+        for document in documents:
+            document = dict(document)
+            action = document.pop("@search.action", self.action)
+            pending.append((action, document, document_bytes(document), 0))
+
+        while pending:
+            retry = []
+
+            start = 0
+            while start < len(pending):
+                end, size = start, 0
+                # Always send at least one document, even one above the byte limit, so the service reports it
+                while end < len(pending) and end - start < self.batch_size and (end == start or size + pending[end][2] <= self.max_batch_bytes):
+                    size += pending[end][2]
+                    end += 1
+
+                retry += self._send_batch(pending[start:end], result)
+                start = end
+
+            if retry:
+                attempts = max(entry[3] for entry in retry)
+                time.sleep(INDEXING_RETRY_SECONDS * 2 ** (attempts - 1))
+                with self._lock:
+                    self.retried += len(retry)
+            pending = retry
+
+        with self._lock:
+            self.indexed += result["indexed"]
+            self.failed.update(result["failed"])
+
+        return result
+
+    def _send_batch(self, batch: list[tuple], result: dict) -> list[tuple]:
+        """Send one batch, record its outcome in `result` and return the entries to retry"""
+        index_batch = IndexDocumentsBatch()
+        for action, document, _, _ in batch:
+            INDEXING_ACTIONS[action](index_batch, [document])
+
+        start = time.perf_counter()
+        try:
+            results = self.search_client.index_documents(index_batch)
+        except HttpResponseError as e:
+            # The whole request failed, retry all of it if the failure is transient
+            retryable = e.status_code in INDEXING_RETRY_STATUS_CODES or e.status_code == 413
+            throttled = e.status_code in INDEXING_THROTTLED_STATUS_CODES or e.status_code == 413
+            self._adapt(len(batch), time.perf_counter() - start, throttled=len(batch) if throttled else 0)
+            return self._retry_or_fail(batch, result, {str(document.get(self.key_field)): e.message for _, document, _, _ in batch}, retryable)
+        except AzureError as e:
+            # Connection errors, after the client's own retries
+            self._adapt(len(batch), time.perf_counter() - start, throttled=len(batch))
+            return self._retry_or_fail(batch, result, {str(document.get(self.key_field)): str(e) for _, document, _, _ in batch}, True)
+
+        entries = {str(document.get(self.key_field)): entry for entry in batch for _, document, _, _ in [entry]}
+        retry, throttled = [], 0
+        for indexing_result in results:
+            if indexing_result.succeeded:
+                result["indexed"] += 1
+                continue
+
+            message = indexing_result.error_message or f"Status code {indexing_result.status_code}"
+            throttled += indexing_result.status_code in INDEXING_THROTTLED_STATUS_CODES
+            entry = entries.get(indexing_result.key)
+            if entry is None:
+                result["failed"][indexing_result.key] = message
+            else:
+                retry += self._retry_or_fail([entry], result, {indexing_result.key: message}, indexing_result.status_code in INDEXING_RETRY_STATUS_CODES)
+
+        self._adapt(len(batch), time.perf_counter() - start, throttled=throttled)
+
+        return retry
+
+    def _retry_or_fail(self, batch: list[tuple], result: dict, messages: dict, retryable: bool) -> list[tuple]:
+        retry = []
+        for action, document, size, attempts in batch:
+            key = str(document.get(self.key_field))
+            if retryable and attempts < self.max_retries:
+                retry.append((action, document, size, attempts + 1))
+            else:
+                result["failed"][key] = messages[key]
+
+        return retry
+
+    def _adapt(self, count: int, seconds: float, throttled: int) -> None:
+        """Additive increase after fast full batches, multiplicative decrease on throttling or slow batches"""
+        with self._lock:
+            self.batches += 1
+            self.throttled += throttled > 0
+
+            if throttled and throttled >= count * INDEXING_THROTTLED_FRACTION:
+                self.batch_size = max(INDEXING_MIN_BATCH_SIZE, self.batch_size // 2)
+            elif seconds > self.target_seconds:
+                self.batch_size = max(INDEXING_MIN_BATCH_SIZE, self.batch_size * 3 // 4)
+            elif count >= self.batch_size and not throttled:
+                self.batch_size = min(self.max_batch_size, self.batch_size + INDEXING_BATCH_SIZE_STEP)
+
+
+def index_documents(search_client: SearchClient, documents: list[dict], key_field: str = "ArticleId", action: str = "upload") -> dict:
+    """
+    Index a list of documents through a one-off IndexingBatcher.
+
+    Returns:
+        dict: The batcher's report, see IndexingBatcher.report.
+    """
+    with IndexingBatcher(search_client, key_field=key_field, action=action) as batcher:
+        batcher.send(documents)
+
+    return batcher.report()
+
+
+def print_indexing_report(report: dict) -> None:
+    print(f"Documents indexed: {report['indexed']} in {report['batches']} batches, {report['retried']} retried")
+
+    if report["failed"]:
+        print(f"Failed to index {len(report['failed'])} documents:")
+        for key, message in report["failed"].items():
+            print(f"{key}: {message}")
@@ -0,0 +1,106 @@
+from azure.search.documents import SearchClient
+
+from tools.index_export import odata_string
+
+# Document keys may only contain these characters, listed in code point order
+KEY_ALPHABET = "-0123456789=ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz"
+KEY_DIGITS = {character: digit for digit, character in enumerate(KEY_ALPHABET, start=1)}
+
+
+def key_midpoint(low: str, high: str) -> str | None:
+    """
+    A key roughly halfway between two keys in code point order.
+
+    Keys are read as fixed-length numbers in base len(KEY_ALPHABET) + 1, where digit 0 means "end of
+    key" so that a key sorts before its extensions, and the midpoint is read back up to its first 0.
+
+    Returns:
+        str | None: A key strictly between `low` and `high`, None if there is none this way.
+    """
+    length = max(len(low), len(high)) + 1
+    base = len(KEY_ALPHABET) + 1
+
+    def value(key: str) -> int:
+        number = 0
+        for character in key.ljust(length, "\0"):
+            number = number * base + KEY_DIGITS.get(character, 0)
+        return number
+
+    middle = (value(low) + value(high)) // 2
+
+    digits = []
+    for _ in range(length):
+        middle, digit = divmod(middle, base)
+        digits.append(digit)
+
+    key = ""
+    for digit in reversed(digits):
+        if digit == 0:
+            break
+        key += KEY_ALPHABET[digit - 1]
+
+    return key if low < key < high else None
+
+
+def key_range_filter(key_field: str, low: str = None, high: str = None) -> str | None:
+    """OData filter for low <= key < high, None bounds are open"""
+    bounds = [f"{key_field} ge {odata_string(low)}" if low is not None else None, f"{key_field} lt {odata_string(high)}" if high is not None else None]
+
+    return " and ".join(bound for bound in bounds if bound) or None
+
+
+def count_documents(search_client: SearchClient, filter: str = None) -> int:
+    return search_client.search(search_text="*", filter=filter, include_total_count=True, top=0).get_count()
+
+
+def edge_key(search_client: SearchClient, key_field: str, descending: bool = False) -> str | None:
+    """The smallest key of the index, or the largest with `descending`"""
+    results = list(search_client.search(search_text="*", select=[key_field], order_by=[f"{key_field} {'desc' if descending else 'asc'}"], top=1))
+
+    return results[0][key_field] if results else None
+
+
+def partition_keys(search_client: SearchClient, key_field: str, max_documents: int) -> list[dict]:
+    """
+    Split the key space into contiguous ranges of at most about `max_documents` documents each.
+
+    Ranges are halved at key_midpoint and sized with filtered $count queries, so uneven key distributions
+    still split evenly and nothing is read but counts. The first and last ranges are open-ended so every
+    key is covered, and ranges are never empty.
+
+    Args:
+        search_client (SearchClient): The client of the index.
+        key_field (str): The key field, which must be sortable and filterable.
+        max_documents (int): The largest range wanted.
+
+    Returns:
+        list[dict]: {"low", "high", "count"} per range in key order, "low" inclusive and "high" exclusive, None for open.
+    """
+    total = count_documents(search_client)
+    if total == 0:
+        return []
+
+    first, last = edge_key(search_client, key_field), edge_key(search_client, key_field, descending=True)
+
+    # Each pending range also carries the tightest known bounds of its keys, to pick midpoints from
+    pending = [({"low": None, "high": None, "count": total}, first, last + KEY_ALPHABET[-1])]
+    partitions = []
+    while pending:
+        partition, low, high = pending.pop()
+        middle = key_midpoint(low, high) if partition["count"] > max_documents else None
+        if middle is None:
+            partitions.append(partition)
+            continue
+
+        left_count = count_documents(search_client, key_range_filter(key_field, partition["low"], middle))
+        right_count = partition["count"] - left_count
+
+        if left_count == 0:
+            pending.append((partition, middle, high))
+        elif right_count == 0:
+            pending.append((partition, low, middle))
+        else:
+            pending.append(({"low": middle, "high": partition["high"], "count": right_count}, middle, high))
+            pending.append(({"low": partition["low"], "high": middle, "count": left_count}, low, middle))
+
+    return sorted(partitions, key=lambda partition: (partition["low"] is not None, partition["low"] or ""))
@@ -0,0 +1,83 @@
+from tools.local_text_index import LocalTextIndex
+from tools.local_vector_index import LocalVectorIndex
+
+# The constant Azure AI Search uses in its own Reciprocal Rank Fusion
+RRF_K = 60
+# Each ranking contributes its top 50 documents to the fusion, like a hybrid query against the service
+HYBRID_WINDOW = 50
+
+
+def reciprocal_rank_fusion(rankings: list[list[dict]], weights: list[float] = None, rrf_k: int = RRF_K, key_field: str = "ArticleId") -> list[dict]:
+    """
+    Fuse several rankings of the same documents with weighted Reciprocal Rank Fusion.
+
+    A document scores sum(weight / (rrf_k + rank)) over the rankings it appears in, rank starting at 1.
+
+    Args:
+        rankings (list[list[dict]]): The rankings, best first.
+        weights (list[float], optional): One weight per ranking. Defaults to 1.0 each.
+        rrf_k (int, optional): Dampens the advantage of the top ranks. Defaults to RRF_K.
+        key_field (str, optional): The field identifying a document across rankings. Defaults to "ArticleId".
+
+    Returns:
+        list[dict]: Every ranked document once, with its fused "@search.score", in descending order.
+    """
+    weights = weights or [1.0] * len(rankings)
+
+    fused = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, result in enumerate(ranking, start=1):
+            key = result[key_field]
+            if key not in fused:
+                fused[key] = {**result, "@search.score": 0.0}
+            fused[key]["@search.score"] += weight / (rrf_k + rank)
+
+    return sorted(fused.values(), key=lambda result: -result["@search.score"])
+
+
+class LocalHybridIndex:
+    """
+    Offline counterpart of AISearch.hybrid_search: BM25 and vector rankings of the same export fused with
+    weighted RRF, with the same result shape as the service so evaluation code can use either.
+    """
+
+    def __init__(
+        self,
+        text_index: LocalTextIndex,
+        vector_index: LocalVectorIndex,
+        text_weight: float = 1.0,
+        vector_weight: float = 1.0,
+        rrf_k: int = RRF_K,
+        window: int = HYBRID_WINDOW,
+    ):
+        self.text_index = text_index
+        self.vector_index = vector_index
+        self.text_weight = text_weight
+        self.vector_weight = vector_weight
+        self.rrf_k = rrf_k
+        self.window = window
+
+    def search(self, text: str, vector: list[float], k: int = 3) -> list[dict]:
+        return self.search_many([text], [vector], k=k)[0]
+
+    def search_many(self, texts: list[str], vectors: list[list[float]], k: int = 3) -> list[list[dict]]:
+        """
+        Run many hybrid queries, with every vector ranking computed in one matrix product.
+
+        Args:
+            texts (list[str]): The keyword queries.
+            vectors (list[list[float]]): The query vectors, in the same order.
+            k (int, optional): The number of documents per query. Defaults to 3.
+
+        Returns:
+            list[list[dict]]: For each query, up to `k` documents with their fused "@search.score".
+        """
+        vector_rankings = self.vector_index.search_many(vectors, k=max(k, self.window))
+
+        results = []
+        for text, vector_ranking in zip(texts, vector_rankings):
+            text_ranking = self.text_index.search(text, k=max(k, self.window))
+            fused = reciprocal_rank_fusion([text_ranking, vector_ranking], [self.text_weight, self.vector_weight], rrf_k=self.rrf_k)
+            results.append(fused[:k])
+
+        return results
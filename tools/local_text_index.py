@@ -0,0 +1,234 @@
+import glob
+import json
+import os
+import re
+
+import numpy as np
+
+from tools.local_vector_index import load_documents
+from tools.misc import trim_tokens
+
+# Searchable fields and their weight in the combined score
+TEXT_FIELD_WEIGHTS = {"Title": 2.0, "Content": 1.0, "Labels": 1.0}
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def analyze(text: str) -> list[str]:
+    """Clean a text with the same rules as trim_tokens, then lowercase it and split it into word terms"""
+    return re.findall(r"\w+", trim_tokens(text or "").lower())
+
+
+def load_corpus(paths: list[str]) -> list[dict]:
+    """
+    Load documents from exports and corpus folders.
+
+    Args:
+        paths (list[str]): .json or .jsonl files, or folders of page_*.json files such as clo3d/articles/en-us.
+
+    Returns:
+        list[dict]: The documents of every file, in order.
+    """
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(glob.glob(os.path.join(path, "page_*.json")), key=lambda file: int(re.findall(r"\d+", os.path.basename(file))[0]))
+        else:
+            files = [path]
+
+        for file in files:
+            documents += load_documents(file)
+
+    return documents
+
+
+class FieldPostings:
+    """
+    Postings of one field in compressed sparse row form.
+
+    The documents and term frequencies of term t are doc_ids[offsets[t]:offsets[t + 1]] and
+    frequencies[offsets[t]:offsets[t + 1]], so the whole field is three flat arrays plus the field lengths.
+    """
+
+    def __init__(self, offsets: np.ndarray, doc_ids: np.ndarray, frequencies: np.ndarray, lengths: np.ndarray):
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.average_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+
+    @classmethod
+    def build(cls, term_lists: list[list[int]], vocabulary_size: int) -> "FieldPostings":
+        lengths = np.array([len(terms) for terms in term_lists], dtype=np.uint32)
+
+        pairs = {}
+        for doc_id, terms in enumerate(term_lists):
+            for term_id in terms:
+                pairs[(term_id, doc_id)] = pairs.get((term_id, doc_id), 0) + 1
+
+        keys = sorted(pairs)
+        term_ids = np.array([term_id for term_id, _ in keys], dtype=np.uint32)
+
+        offsets = np.zeros(vocabulary_size + 1, dtype=np.uint64)
+        np.add.at(offsets, term_ids.astype(np.int64) + 1, 1)
+
+        return cls(
+            np.cumsum(offsets).astype(np.uint64),
+            np.array([doc_id for _, doc_id in keys], dtype=np.uint32),
+            np.array([pairs[key] for key in keys], dtype=np.uint32),
+            lengths,
+        )
+
+    def score(self, term_id: int, scores: np.ndarray, idf: float, weight: float, k1: float, b: float) -> None:
+        """Add the weighted BM25 contribution of one term to `scores`"""
+        start, end = int(self.offsets[term_id]), int(self.offsets[term_id + 1])
+        if start == end:
+            return
+
+        doc_ids = self.doc_ids[start:end]
+        frequencies = self.frequencies[start:end].astype(np.float32)
+        norm = k1 * (1 - b + b * self.lengths[doc_ids] / self.average_length)
+
+        scores[doc_ids] += weight * idf * frequencies * (k1 + 1) / (frequencies + norm)
+
+
+class LocalTextIndex:
+    """
+    In-memory BM25 keyword index over exported search documents or corpus page files.
+
+    Terms come from analyze(), the trim_tokens rules plus lowercasing, and each field in TEXT_FIELD_WEIGHTS
+    has its own array-backed postings, so a query costs one vectorized update per term and field. The
+    index can be saved to a single .npz file and loaded back without re-tokenizing the corpus.
+    """
+
+    def __init__(self, documents: list[dict], vocabulary: dict[str, int], postings: dict[str, FieldPostings], document_frequencies: np.ndarray):
+        self.documents = documents
+        self.vocabulary = vocabulary
+        self.postings = postings
+        self.document_frequencies = document_frequencies
+
+    @classmethod
+    def build(cls, documents: list[dict], field_weights: dict[str, float] = TEXT_FIELD_WEIGHTS) -> "LocalTextIndex":
+        """
+        Tokenize and index documents.
+
+        Args:
+            documents (list[dict]): The documents, vector fields are dropped.
+            field_weights (dict[str, float], optional): The fields to index. Defaults to TEXT_FIELD_WEIGHTS.
+
+        Returns:
+            LocalTextIndex: The index.
+        """
+        documents = [{field: value for field, value in document.items() if not field.endswith("Vector")} for document in documents]
+
+        vocabulary = {}
+        term_lists = {field: [] for field in field_weights}
+        for document in documents:
+            for field in field_weights:
+                value = document.get(field)
+                text = " ".join(value) if isinstance(value, list) else str(value or "")
+                term_lists[field].append([vocabulary.setdefault(term, len(vocabulary)) for term in analyze(text)])
+
+        # A document counts once per term however many of its fields contain it
+        document_terms = np.zeros(len(vocabulary), dtype=np.uint32)
+        for doc_id in range(len(documents)):
+            terms = set()
+            for field in field_weights:
+                terms.update(term_lists[field][doc_id])
+            document_terms[list(terms)] += 1
+
+        postings = {field: FieldPostings.build(term_lists[field], len(vocabulary)) for field in field_weights}
+
+        return cls(documents, vocabulary, postings, document_terms)
+
+    @classmethod
+    def from_paths(cls, paths: list[str], field_weights: dict[str, float] = TEXT_FIELD_WEIGHTS) -> "LocalTextIndex":
+        return cls.build(load_corpus(paths), field_weights=field_weights)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def search(
+        self,
+        text: str,
+        k: int = 3,
+        select: list[str] = None,
+        field_weights: dict[str, float] = TEXT_FIELD_WEIGHTS,
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+    ) -> list[dict]:
+        """
+        Rank documents against a keyword query with BM25.
+
+        Args:
+            text (str): The query.
+            k (int, optional): The number of documents to return. Defaults to 3.
+            select (list[str], optional): The fields to return. Defaults to every field.
+            field_weights (dict[str, float], optional): Weights of the indexed fields. Defaults to TEXT_FIELD_WEIGHTS.
+            k1 (float, optional): BM25 term frequency saturation. Defaults to BM25_K1.
+            b (float, optional): BM25 length normalization. Defaults to BM25_B.
+
+        Returns:
+            list[dict]: Up to `k` matching documents with "@search.score" in descending order.
+        """
+        count = len(self.documents)
+        scores = np.zeros(count, dtype=np.float32)
+
+        term_ids = [self.vocabulary[term] for term in dict.fromkeys(analyze(text)) if term in self.vocabulary]
+        for term_id in term_ids:
+            frequency = float(self.document_frequencies[term_id])
+            idf = np.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+
+            for field, weight in field_weights.items():
+                if field in self.postings:
+                    self.postings[field].score(term_id, scores, idf, weight, k1, b)
+
+        matches = np.flatnonzero(scores > 0)
+        if len(matches) > k:
+            matches = matches[np.argpartition(-scores[matches], k - 1)[:k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+
+        results = []
+        for doc_id in matches:
+            document = self.documents[int(doc_id)]
+            result = {field: document.get(field) for field in select} if select else dict(document)
+            result["@search.score"] = float(scores[doc_id])
+            results.append(result)
+
+        return results
+
+    def save(self, path: str) -> None:
+        """Write the index to a single .npz file"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        arrays = {
+            "documents": np.frombuffer(json.dumps(self.documents, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+            "vocabulary": np.frombuffer(json.dumps(self.vocabulary, ensure_ascii=False).encode("utf-8"), dtype=np.uint8),
+            "document_frequencies": self.document_frequencies,
+            "fields": np.frombuffer(json.dumps(list(self.postings)).encode("utf-8"), dtype=np.uint8),
+        }
+        for field, postings in self.postings.items():
+            arrays[f"{field}.offsets"] = postings.offsets
+            arrays[f"{field}.doc_ids"] = postings.doc_ids
+            arrays[f"{field}.frequencies"] = postings.frequencies
+            arrays[f"{field}.lengths"] = postings.lengths
+
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "LocalTextIndex":
+        """Read an index written by save()"""
+        with np.load(path) as arrays:
+            postings = {
+                field: FieldPostings(
+                    arrays[f"{field}.offsets"], arrays[f"{field}.doc_ids"], arrays[f"{field}.frequencies"], arrays[f"{field}.lengths"]
+                )
+                for field in json.loads(arrays["fields"].tobytes())
+            }
+
+            return cls(
+                json.loads(arrays["documents"].tobytes()),
+                json.loads(arrays["vocabulary"].tobytes()),
+                postings,
+                arrays["document_frequencies"],
+            )
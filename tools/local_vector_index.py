@@ -0,0 +1,205 @@
+import json
+import time
+
+import numpy as np
+
+# hnswlib is optional, without it every search is an exact matrix product
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+VECTOR_FIELDS = ["TitleVector", "ContentVector"]
+# Below this many documents an exact search is as fast as a graph search
+HNSW_MIN_DOCUMENTS = 20000
+
+
+def cosine_to_search_score(similarity):
+    """Map cosine similarity to the 0..1 relevance score Azure AI Search reports for cosine vector queries"""
+    return 1 / (2 - similarity)
+
+
+def load_documents(path: str) -> list[dict]:
+    """Load documents from a JSON array or JSON Lines export"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+
+        return json.load(f)
+
+
+class LocalVectorIndex:
+    """
+    In-memory vector index over exported search documents.
+
+    Every vector field is stored in one contiguous float32 matrix of pre-normalized rows, so an exact
+    cosine top-k for all fields is a single matrix product. A document's score is its best field, like a
+    multi-field vector query against the service. With `use_hnsw` (and hnswlib installed) searches go
+    through an HNSW graph instead, which trades a little recall for sub-linear latency on large corpora.
+    """
+
+    def __init__(
+        self,
+        documents: list[dict],
+        vector_fields: list[str] = VECTOR_FIELDS,
+        use_hnsw: bool = None,
+        m: int = 16,
+        ef_construction: int = 200,
+        ef_search: int = 100,
+    ):
+        self.vector_fields = list(vector_fields)
+        self.documents = [{field: value for field, value in document.items() if field not in self.vector_fields} for document in documents]
+
+        dimensions = next((len(document[field]) for document in documents for field in self.vector_fields if document.get(field)), 0)
+        if dimensions == 0:
+            raise ValueError(f"No document has any of the vector fields {self.vector_fields}")
+
+        # Rows are laid out field-major: row f * n + i is field f of document i, missing vectors stay zero
+        count = len(documents)
+        self.matrix = np.zeros((len(self.vector_fields) * count, dimensions), dtype=np.float32)
+        for f, field in enumerate(self.vector_fields):
+            for i, document in enumerate(documents):
+                if document.get(field):
+                    self.matrix[f * count + i] = document[field]
+
+        norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        self.present = norms[:, 0] > 0
+        self.matrix /= np.where(norms > 0, norms, 1)
+
+        self.build_seconds = 0.0
+        self.hnsw = None
+        if use_hnsw is None:
+            use_hnsw = hnswlib is not None and count >= HNSW_MIN_DOCUMENTS
+        if use_hnsw:
+            self.build_hnsw(m=m, ef_construction=ef_construction, ef_search=ef_search)
+
+    @classmethod
+    def load(cls, path: str, vectors_path: str = None, key_field: str = "ArticleId", **kwargs) -> "LocalVectorIndex":
+        """
+        Build an index from an export file.
+
+        Args:
+            path (str): A .json array or .jsonl file of documents.
+            vectors_path (str, optional): The vectors side file written by export_jsonl. Defaults to vectors inside the documents.
+            key_field (str, optional): The field joining documents to their vectors. Defaults to "ArticleId".
+            **kwargs: Passed to LocalVectorIndex.
+
+        Returns:
+            LocalVectorIndex: The index.
+        """
+        documents = load_documents(path)
+
+        if vectors_path:
+            vectors = {vector[key_field]: vector for vector in load_documents(vectors_path)}
+            documents = [{**document, **vectors.get(document[key_field], {})} for document in documents]
+
+        return cls(documents, **kwargs)
+
+    def build_hnsw(self, m: int = 16, ef_construction: int = 200, ef_search: int = 100) -> None:
+        if hnswlib is None:
+            raise ImportError("hnswlib is required for HNSW search, install it with `pip install hnswlib`")
+
+        start = time.perf_counter()
+
+        labels = np.flatnonzero(self.present)
+        self.hnsw = hnswlib.Index(space="ip", dim=self.matrix.shape[1])
+        self.hnsw.init_index(max_elements=len(labels), M=m, ef_construction=ef_construction)
+        self.hnsw.add_items(self.matrix[labels], labels)
+        self.hnsw.set_ef(ef_search)
+
+        self.build_seconds = time.perf_counter() - start
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def normalize(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+
+        return vectors / np.where(norms > 0, norms, 1)
+
+    def exact_search(self, vectors: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Exact cosine top-k of normalized query vectors.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Document indices and similarities, both shaped (queries, k), best first.
+        """
+        count = len(self.documents)
+        k = min(k, count)
+
+        similarities = vectors @ self.matrix.T
+        similarities[:, ~self.present] = -np.inf
+        similarities = similarities.reshape(len(vectors), len(self.vector_fields), count).max(axis=1)
+
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1)
+
+        return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_similarities, order, axis=1)
+
+    def hnsw_search(self, vectors: np.ndarray, k: int) -> tuple[list[list[int]], list[list[float]]]:
+        count = len(self.documents)
+        # Several fields of one document can be neighbours, fetch enough rows to still have k documents
+        labels, distances = self.hnsw.knn_query(vectors, k=min(k * len(self.vector_fields), self.hnsw.get_current_count()))
+
+        indices, similarities = [], []
+        for row_labels, row_distances in zip(labels, distances):
+            best = {}
+            for label, distance in zip(row_labels, row_distances):
+                document = int(label) % count
+                # hnswlib's inner product distance is 1 - dot
+                best[document] = max(best.get(document, -np.inf), 1 - float(distance))
+
+            ranked = sorted(best.items(), key=lambda item: -item[1])[:k]
+            indices.append([document for document, _ in ranked])
+            similarities.append([similarity for _, similarity in ranked])
+
+        return indices, similarities
+
+    def search_many(self, vectors: list[list[float]], k: int = 3, select: list[str] = None, exact: bool = False) -> list[list[dict]]:
+        """
+        Find the nearest documents of many query vectors at once.
+
+        Args:
+            vectors (list[list[float]]): The query vectors.
+            k (int, optional): The number of documents per query. Defaults to 3.
+            select (list[str], optional): The fields to return. Defaults to every non-vector field.
+            exact (bool, optional): Skip the HNSW graph even if one was built. Defaults to False.
+
+        Returns:
+            list[list[dict]]: For each query, up to `k` documents with "@search.score" in descending order.
+        """
+        vectors = self.normalize(vectors)
+
+        if self.hnsw is not None and not exact:
+            indices, similarities = self.hnsw_search(vectors, k)
+        else:
+            indices, similarities = self.exact_search(vectors, k)
+
+        results = []
+        for row_indices, row_similarities in zip(indices, similarities):
+            row = []
+            for index, similarity in zip(row_indices, row_similarities):
+                if not np.isfinite(similarity):
+                    continue
+
+                document = self.documents[int(index)]
+                result = {field: document.get(field) for field in select} if select else dict(document)
+                result["@search.score"] = float(cosine_to_search_score(similarity))
+                row.append(result)
+            results.append(row)
+
+        return results
+
+    def search(self, vector: list[float], k: int = 3, select: list[str] = None, exact: bool = False) -> list[dict]:
+        return self.search_many([vector], k=k, select=select, exact=exact)[0]
+
+    def memory_bytes(self) -> int:
+        """Approximate memory used by the vectors, plus the graph's links if one was built"""
+        size = self.matrix.nbytes
+        if self.hnsw is not None:
+            # Level 0 holds 2 * M links of 4 bytes per element
+            size += self.hnsw.get_current_count() * 2 * self.hnsw.M * 4
+
+        return size
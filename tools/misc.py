@@ -7,9 +7,10 @@ import time
 from pathlib import Path
 
 import requests
-import tiktoken
 from tqdm import tqdm
 
+from tools.tokenizer import get_encoding
+
 
 def logger(title: str = "", text: str = "") -> None:
     """
@@ -32,8 +33,8 @@ def logger(title: str = "", text: str = "") -> None:
 
 def num_tokens_from_string(string: str, model: str = "gpt-4o-mini") -> int:
     """Returns the number of tokens in a text string. https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb"""
-    encoding = tiktoken.encoding_for_model(model)
-    num_tokens = len(encoding.encode(string))
+    encoding = get_encoding(model)
+    num_tokens = len(encoding.encode_ordinary(string))
     return num_tokens
 
 
@@ -101,33 +102,6 @@ def sanitize_directory_file_name(text):
     return re.sub(r'[\\/*?:"<>|]', "", text)
 
 
-def get_section_and_category(env, section_id):
-    section_response = requests.request(
-        "GET",
-        env.get_zendesk_article_section_api_endpoint(section_id),
-        headers={
-            "Content-Type": "application/json",
-        },
-    )
-    section_objects = json.loads(section_response.text)
-
-    category_response = requests.request(
-        "GET",
-        env.get_zendesk_article_category_api_endpoint(section_objects["section"]["category_id"]),
-        headers={
-            "Content-Type": "application/json",
-        },
-    )
-    category_objects = json.loads(category_response.text)
-
-    return (
-        section_objects["section"]["id"],
-        section_objects["section"]["name"],
-        category_objects["category"]["id"],
-        category_objects["category"]["name"],
-    )
-
-
 if __name__ == "__main__":
     section_response = requests.request(
         "GET",
@@ -0,0 +1,220 @@
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import struct
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIMENSIONS = 1536
+
+DEPLOYMENT_PATH = re.compile(r"^/openai/deployments/(?P<deployment>[^/]+)/(?P<operation>embeddings|chat/completions)$")
+
+
+def estimate_tokens(text: str) -> int:
+    """Roughly 4 characters per token, close enough for quota accounting without loading a tokenizer"""
+    return max(1, len(text) // 4)
+
+
+def deterministic_embedding(text: str, dimensions: int = EMBEDDING_DIMENSIONS) -> list[float]:
+    """Returns a unit vector derived from the hash of the text, identical texts always get identical vectors"""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = sum(value * value for value in vector) ** 0.5
+
+    return [value / norm for value in vector]
+
+
+def deterministic_completion(prompt: str) -> str:
+    """Returns a numbered list of words from the prompt, parseable by every OpenAIHelper prompt"""
+    words = [word for word in re.findall(r"\w+", prompt) if len(word) > 3]
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+    picked = rng.sample(words, min(10, len(words))) if words else ["mock"]
+
+    return "\n".join(f"{i}. {word}" for i, word in enumerate(picked, start=1))
+
+
+class Quota:
+    """Sliding one-minute window of tokens and requests for a deployment"""
+
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.window = deque()
+        self.lock = threading.Lock()
+
+    def admit(self, tokens: int) -> float:
+        """Returns 0 if the request fits in the quota, otherwise the seconds until it would"""
+        with self.lock:
+            now = time.time()
+            while self.window and now - self.window[0][0] >= 60:
+                self.window.popleft()
+
+            used_tokens = sum(window_tokens for _, window_tokens in self.window)
+            over_tokens = self.tokens_per_minute and used_tokens + tokens > self.tokens_per_minute
+            over_requests = self.requests_per_minute and len(self.window) + 1 > self.requests_per_minute
+
+            if (over_tokens or over_requests) and self.window:
+                return max(60 - (now - self.window[0][0]), 0.001)
+
+            self.window.append((now, tokens))
+            return 0
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Azure OpenAI embeddings and chat completions endpoints.
+
+    Vectors and completions are deterministic functions of the input. Latency, random 429s and per-deployment
+    TPM/RPM quotas are configurable so batching, caching and concurrency changes can be measured offline.
+    Point AzureEnv at it with AZURE_OPENAI_ENDPOINT=http://127.0.0.1:<port>.
+    """
+
+    daemon_threads = True
+    # socketserver's default backlog of 5 drops the connections of concurrent clients, which retry a second later
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        latency: float = 0.05,
+        latency_per_1k_tokens: float = 0.01,
+        throttle_rate: float = 0.0,
+        tokens_per_minute: int = 0,
+        requests_per_minute: int = 0,
+    ):
+        super().__init__(address, MockOpenAIRequestHandler)
+        self.latency = latency
+        self.latency_per_1k_tokens = latency_per_1k_tokens
+        self.throttle_rate = throttle_rate
+        self.quotas = defaultdict(lambda: Quota(tokens_per_minute, requests_per_minute))
+
+        self.stats_lock = threading.Lock()
+        self.stats = defaultdict(int)
+
+    def count(self, **counters) -> None:
+        with self.stats_lock:
+            for name, value in counters.items():
+                self.stats[name] += value
+
+
+class MockOpenAIRequestHandler(BaseHTTPRequestHandler):
+    server: MockOpenAIServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict, headers: dict = {}) -> None:
+        payload = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/stats":
+            with self.server.stats_lock:
+                self.send_json(200, dict(self.server.stats))
+        else:
+            self.send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+
+    def do_POST(self):
+        match = DEPLOYMENT_PATH.match(self.path.split("?")[0])
+        if not match:
+            self.send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        deployment = match.group("deployment")
+
+        if match.group("operation") == "embeddings":
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            tokens = sum(estimate_tokens(text) for text in inputs)
+        else:
+            inputs = [message["content"] for message in body["messages"]]
+            # Azure counts max_tokens against the quota when the request is admitted
+            tokens = sum(estimate_tokens(text) for text in inputs) + body.get("max_tokens", 0)
+
+        self.server.count(requests=1)
+
+        retry_after = self.server.quotas[deployment].admit(tokens)
+        if retry_after == 0 and random.random() < self.server.throttle_rate:
+            retry_after = 1
+
+        if retry_after > 0:
+            self.server.count(throttled=1)
+            self.send_json(
+                429,
+                {"error": {"code": "429", "message": "Requests to the deployment have exceeded the rate limit."}},
+                {"Retry-After": str(max(1, round(retry_after))), "retry-after-ms": str(int(retry_after * 1000))},
+            )
+            return
+
+        time.sleep(self.server.latency + self.server.latency_per_1k_tokens * tokens / 1000)
+
+        if match.group("operation") == "embeddings":
+            self.server.count(embedding_requests=1, embedding_inputs=len(inputs), embedding_tokens=tokens)
+
+            data = []
+            for i, text in enumerate(inputs):
+                embedding = deterministic_embedding(text)
+                if body.get("encoding_format") == "base64":
+                    embedding = base64.b64encode(struct.pack(f"<{len(embedding)}f", *embedding)).decode("ascii")
+                data.append({"object": "embedding", "index": i, "embedding": embedding})
+
+            self.send_json(
+                200,
+                {"object": "list", "data": data, "model": deployment, "usage": {"prompt_tokens": tokens, "total_tokens": tokens}},
+            )
+        else:
+            self.server.count(chat_requests=1, chat_tokens=tokens)
+
+            content = deterministic_completion(inputs[-1])
+            completion_tokens = estimate_tokens(content)
+            self.send_json(
+                200,
+                {
+                    "id": "chatcmpl-" + hashlib.sha256(content.encode("utf-8")).hexdigest()[:24],
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": deployment,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": {
+                        "prompt_tokens": tokens - body.get("max_tokens", 0),
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": tokens - body.get("max_tokens", 0) + completion_tokens,
+                    },
+                },
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure OpenAI embeddings and chat completions endpoints")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every request")
+    parser.add_argument("--latency-per-1k-tokens", type=float, default=0.01, help="Seconds added per 1,000 tokens")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of admitted requests answered with a 429")
+    parser.add_argument("--tpm", type=int, default=0, help="Tokens per minute per deployment, 0 for unlimited")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute per deployment, 0 for unlimited")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        (args.host, args.port),
+        latency=args.latency,
+        latency_per_1k_tokens=args.latency_per_1k_tokens,
+        throttle_rate=args.throttle_rate,
+        tokens_per_minute=args.tpm,
+        requests_per_minute=args.rpm,
+    )
+
+    print(f"Mock Azure OpenAI listening on http://{args.host}:{args.port}, set AZURE_OPENAI_ENDPOINT to use it")
+    server.serve_forever()
@@ -0,0 +1,526 @@
+import argparse
+import json
+import math
+import random
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+# The service never returns more than this many results in one page
+SEARCH_PAGE_SIZE = 1000
+SEARCH_DEFAULT_PAGE_SIZE = 50
+SEARCH_MAX_SKIP = 100000
+# Indexing requests above 16 MB are rejected whole with a 413
+INDEXING_MAX_REQUEST_BYTES = 16 * 2**20
+RRF_K = 60
+
+INDEX_PATH = re.compile(r"^/indexes(?:\('(?P<quoted>[^']+)'\)|/(?P<plain>[^/]+))?(?P<rest>/.*)?$")
+FILTER_TOKEN = re.compile(r"\s*(?:(?P<string>'(?:[^']|'')*')|(?P<number>-?\d+(?:\.\d+)?)|(?P<punct>[(),])|(?P<word>[\w./]+))")
+
+
+class FilterParser:
+    """
+    Parser for the subset of OData $filter used against the index: comparisons (eq, ne, gt, ge, lt, le),
+    and/or/not, parentheses and search.in(field, 'a,b', ',').
+    """
+
+    def __init__(self, text: str):
+        self.tokens = []
+        # Every field the filter refers to, so unknown ones can be rejected like the service does
+        self.fields = set()
+        position = 0
+        text = text.strip()
+        while position < len(text):
+            match = FILTER_TOKEN.match(text, position)
+            if not match or match.end() == position:
+                raise ValueError(f"Invalid filter near: {text[position:]}")
+
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == "string":
+                value = value[1:-1].replace("''", "'")
+            elif kind == "number":
+                value = float(value) if "." in value else int(value)
+
+            self.tokens.append((kind, value))
+            position = match.end()
+
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, expected=None):
+        token = self.peek()
+        if expected is not None and token[1] != expected:
+            raise ValueError(f"Expected {expected}, found {token[1]}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        predicate = self.parse_or()
+        if self.position != len(self.tokens):
+            raise ValueError(f"Unexpected token {self.peek()[1]}")
+        return predicate
+
+    def parse_or(self):
+        left = self.parse_and()
+        while self.peek() == ("word", "or"):
+            self.take()
+            right = self.parse_and()
+            left = (lambda left, right: lambda document: left(document) or right(document))(left, right)
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        while self.peek() == ("word", "and"):
+            self.take()
+            right = self.parse_not()
+            left = (lambda left, right: lambda document: left(document) and right(document))(left, right)
+        return left
+
+    def parse_not(self):
+        if self.peek() == ("word", "not"):
+            self.take()
+            inner = self.parse_not()
+            return lambda document: not inner(document)
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.peek()
+
+        if value == "(":
+            self.take("(")
+            inner = self.parse_or()
+            self.take(")")
+            return inner
+
+        if kind == "word" and value.lower() == "search.in":
+            self.take()
+            self.take("(")
+            field = self.take()[1]
+            self.fields.add(field)
+            self.take(",")
+            values = self.take()[1]
+            delimiters = " ,"
+            if self.peek()[1] == ",":
+                self.take(",")
+                delimiters = self.take()[1]
+            self.take(")")
+
+            allowed = set(value for value in re.split("|".join(re.escape(d) for d in delimiters), values) if value != "")
+            return lambda document: str(document.get(field)) in allowed
+
+        field = self.take()[1]
+        self.fields.add(field)
+        operator = self.take()[1]
+        literal = self.take()[1]
+        if literal == "null":
+            literal = None
+        elif literal in ("true", "false"):
+            literal = literal == "true"
+
+        comparisons = {
+            "eq": lambda a, b: a == b,
+            "ne": lambda a, b: a != b,
+            "gt": lambda a, b: a is not None and a > b,
+            "ge": lambda a, b: a is not None and a >= b,
+            "lt": lambda a, b: a is not None and a < b,
+            "le": lambda a, b: a is not None and a <= b,
+        }
+        if operator not in comparisons:
+            raise ValueError(f"Unsupported operator {operator}")
+
+        compare = comparisons[operator]
+        return lambda document: compare(document.get(field), literal)
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+
+    return dot / norm if norm else 0.0
+
+
+class MockSearchServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Azure AI Search REST endpoints used by AISearch and BackupAISearch.
+
+    Covers index create/get/list/delete, docs/index with upload/merge/mergeOrUpload/delete, docs/$count and
+    search with filter, orderby, top, skip, select, paging and brute-force vector queries (fused with the
+    text ranking by RRF for hybrid queries). Latency, per-document 207 failures and whole-request 503s are
+    configurable so indexing throughput and retry behaviour can be measured offline. Uploads, selects and
+    filters that name a field the index does not have are rejected with a 400, as the service does.
+
+    The SDK refuses key credentials over plain http, so serve it with a self-signed certificate, e.g.
+    `openssl req -x509 -newkey rsa:2048 -nodes -days 365 -subj /CN=localhost -addext subjectAltName=IP:127.0.0.1
+    -keyout key.pem -out cert.pem`, then set AZURE_SEARCH_ENDPOINT=https://127.0.0.1:<port> and
+    REQUESTS_CA_BUNDLE=cert.pem.
+    """
+
+    daemon_threads = True
+    # socketserver's default backlog of 5 drops the connections of concurrent clients, which retry a second later
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        latency: float = 0.02,
+        document_failure_rate: float = 0.0,
+        unavailable_rate: float = 0.0,
+        certfile: str = None,
+        keyfile: str = None,
+    ):
+        super().__init__(address, MockSearchRequestHandler)
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            # Handshake in the request thread so a slow client cannot block accept()
+            self.socket = context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+        self.latency = latency
+        self.document_failure_rate = document_failure_rate
+        self.unavailable_rate = unavailable_rate
+
+        self.lock = threading.Lock()
+        self.indexes = {}
+        self.documents = {}
+
+
+class MockSearchRequestHandler(BaseHTTPRequestHandler):
+    server: MockSearchServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict = None, headers: dict = {}) -> None:
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; odata.metadata=none")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_error_json(self, status: int, message: str) -> None:
+        self.send_json(status, {"error": {"code": str(status), "message": message}})
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def route(self):
+        """Returns (index name, remaining path, query string), or None if the path is not an index route"""
+        url = urlparse(self.path)
+        match = INDEX_PATH.match(unquote(url.path))
+        if not match:
+            return None
+
+        return match.group("quoted") or match.group("plain"), match.group("rest") or "", parse_qs(url.query)
+
+    def simulate_service(self) -> bool:
+        """Sleep for the configured latency and maybe answer 503, returns False if the request was rejected"""
+        time.sleep(self.server.latency)
+
+        if random.random() < self.server.unavailable_rate:
+            self.send_json(503, {"error": {"code": "ServiceUnavailable", "message": "Service is too busy."}}, {"Retry-After": "1"})
+            return False
+
+        return True
+
+    def do_GET(self):
+        route = self.route()
+        if route is None:
+            self.send_error_json(404, self.path)
+            return
+        if not self.simulate_service():
+            return
+
+        name, rest, query = route
+        # Copy under the lock and respond outside it, so a slow search or client does not stall every other request
+        with self.server.lock:
+            indexes = list(self.server.indexes.values())
+            index = self.server.indexes.get(name)
+            documents = list(self.server.documents[name].values()) if index is not None else []
+            fields = self.field_names(name) if index is not None else None
+
+        if name is None:
+            self.send_json(200, {"value": indexes})
+        elif index is None:
+            self.send_error_json(404, f"The index '{name}' was not found.")
+        elif rest == "":
+            self.send_json(200, index)
+        elif rest == "/docs/$count":
+            payload = str(len(documents)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        elif rest == "/docs":
+            body = {key: values[0] for key, values in query.items()}
+            self.send_search(documents, {"search": body.get("search"), "filter": body.get("$filter"), "top": body.get("$top"), "select": body.get("$select")}, fields)
+        else:
+            self.send_error_json(404, self.path)
+
+    def do_PUT(self):
+        route = self.route()
+        if route is None or route[0] is None or route[1] != "":
+            self.send_error_json(404, self.path)
+            return
+        if not self.simulate_service():
+            return
+
+        self.create_index(route[0], self.read_json())
+
+    def do_DELETE(self):
+        route = self.route()
+        if route is None or route[0] is None:
+            self.send_error_json(404, self.path)
+            return
+        if not self.simulate_service():
+            return
+
+        with self.server.lock:
+            if route[0] not in self.server.indexes:
+                self.send_error_json(404, f"The index '{route[0]}' was not found.")
+                return
+
+            del self.server.indexes[route[0]]
+            del self.server.documents[route[0]]
+
+        self.send_json(204)
+
+    def do_POST(self):
+        route = self.route()
+        if route is None:
+            self.send_error_json(404, self.path)
+            return
+        if not self.simulate_service():
+            return
+
+        name, rest, query = route
+        body = self.read_json()
+
+        if name is None:
+            self.create_index(body["name"], body)
+        elif name not in self.server.indexes:
+            self.send_error_json(404, f"The index '{name}' was not found.")
+        elif rest in ("/docs/search.index", "/docs/index"):
+            if int(self.headers.get("Content-Length", 0)) > INDEXING_MAX_REQUEST_BYTES:
+                self.send_error_json(413, "The request is too large.")
+            else:
+                self.index_documents(name, body)
+        elif rest in ("/docs/search.post.search", "/docs/search"):
+            # Writes replace documents instead of changing them, so the copied list can be ranked outside the lock
+            with self.server.lock:
+                documents = list(self.server.documents.get(name, {}).values())
+                fields = self.field_names(name) if name in self.server.indexes else None
+            self.send_search(documents, body, fields)
+        else:
+            self.send_error_json(404, self.path)
+
+    def create_index(self, name: str, definition: dict) -> None:
+        definition = dict(definition, name=name)
+        definition["@odata.etag"] = f'"{time.time_ns()}"'
+
+        with self.server.lock:
+            created = name not in self.server.indexes
+            self.server.indexes[name] = definition
+            self.server.documents.setdefault(name, {})
+
+        self.send_json(201 if created else 200, definition)
+
+    def field_names(self, name: str) -> set[str] | None:
+        """The index's top-level field names, None for an index created without a field list"""
+        fields = self.server.indexes[name].get("fields")
+        return {field["name"] for field in fields} if fields else None
+
+    def unknown_field(self, fields: set[str] | None, names) -> str | None:
+        """The first of `names` that is not a field of the index, the service rejects the whole request for it"""
+        if fields is None:
+            return None
+        return next((name for name in names if name not in fields and not name.startswith("@")), None)
+
+    def key_field(self, name: str) -> str:
+        for field in self.server.indexes[name].get("fields", []):
+            if field.get("key"):
+                return field["name"]
+
+        return "id"
+
+    def index_documents(self, name: str, body: dict) -> None:
+        key_field = self.key_field(name)
+
+        unknown = self.unknown_field(self.field_names(name), (field for action in body.get("value", []) for field in action))
+        if unknown is not None:
+            self.send_error_json(400, f"The property '{unknown}' does not exist on type 'search.documentFields'.")
+            return
+
+        results = []
+        with self.server.lock:
+            documents = self.server.documents[name]
+            for action in body.get("value", []):
+                action = dict(action)
+                kind = action.pop("@search.action", "upload")
+                key = str(action.get(key_field))
+
+                if random.random() < self.server.document_failure_rate:
+                    results.append({"key": key, "status": False, "errorMessage": "Service is too busy.", "statusCode": 503})
+                    continue
+
+                if kind == "upload":
+                    documents[key] = action
+                elif kind == "mergeOrUpload":
+                    documents[key] = {**documents.get(key, {}), **action}
+                elif kind == "merge":
+                    if key not in documents:
+                        results.append({"key": key, "status": False, "errorMessage": "Document not found.", "statusCode": 404})
+                        continue
+                    documents[key] = {**documents[key], **action}
+                elif kind == "delete":
+                    documents.pop(key, None)
+
+                results.append({"key": key, "status": True, "errorMessage": None, "statusCode": 201 if kind == "upload" else 200})
+
+        status = 200 if all(result["status"] for result in results) else 207
+        self.send_json(status, {"value": results})
+
+    def send_search(self, documents: list[dict], body: dict, fields: set[str] = None) -> None:
+        select = body.get("select")
+        select = [field.strip() for field in select.split(",")] if isinstance(select, str) else select
+        unknown = self.unknown_field(fields, select or [])
+        if unknown is not None:
+            self.send_error_json(400, f"Could not find a property named '{unknown}' on type 'search.document'.")
+            return
+
+        if body.get("filter"):
+            try:
+                parser = FilterParser(body["filter"])
+                predicate = parser.parse()
+            except (ValueError, IndexError) as e:
+                self.send_error_json(400, f"Invalid expression: {e}")
+                return
+
+            unknown = self.unknown_field(fields, sorted(parser.fields))
+            if unknown is not None:
+                self.send_error_json(400, f"Invalid expression: Could not find a property named '{unknown}' on type 'search.document'.")
+                return
+            documents = [document for document in documents if predicate(document)]
+
+        rankings = []
+
+        search_text = body.get("search")
+        if search_text and search_text.strip() != "*":
+            rankings.append(self.text_ranking(documents, search_text, body.get("searchFields"), body.get("searchMode", "any")))
+
+        for vector_query in body.get("vectorQueries", []) + body.get("vectors", []):
+            value = vector_query.get("vector") or vector_query.get("value")
+            fields = [field.strip() for field in vector_query.get("fields", "").split(",") if field.strip()]
+            rankings.append(self.vector_ranking(documents, value, fields, vector_query.get("k", 50)))
+
+        if len(rankings) == 0:
+            scored = [(1.0, document) for document in documents]
+        elif len(rankings) == 1:
+            scored = rankings[0]
+        else:
+            # Hybrid queries are fused with Reciprocal Rank Fusion like the service does
+            fused = {}
+            for ranking in rankings:
+                for rank, (_, document) in enumerate(ranking):
+                    key = id(document)
+                    score, _ = fused.get(key, (0.0, document))
+                    fused[key] = (score + 1 / (RRF_K + rank + 1), document)
+            scored = sorted(fused.values(), key=lambda item: -item[0])
+
+        if body.get("orderby"):
+            for clause in reversed([clause.strip() for clause in body["orderby"].split(",")]):
+                field, _, direction = clause.partition(" ")
+                scored.sort(
+                    key=lambda item: (item[1].get(field) is None, item[1].get(field) if item[1].get(field) is not None else ""),
+                    reverse=direction.strip().lower() == "desc",
+                )
+
+        skip = int(body.get("skip") or 0)
+        if skip > SEARCH_MAX_SKIP:
+            self.send_error_json(400, f"Value must be between 0 and {SEARCH_MAX_SKIP}. Parameter name: $skip")
+            return
+
+        top = body.get("top")
+        total = len(scored)
+        end = total if top is None else min(total, skip + int(top))
+        # Without $top the service returns 50 results per page and a continuation for the rest
+        page_end = min(end, skip + (SEARCH_PAGE_SIZE if top is not None else SEARCH_DEFAULT_PAGE_SIZE))
+        value = []
+        for score, document in scored[skip:page_end]:
+            result = {field: document.get(field) for field in select} if select else dict(document)
+            result["@search.score"] = score
+            value.append(result)
+
+        response = {"value": value}
+        if body.get("count"):
+            response["@odata.count"] = total
+
+        if page_end < end:
+            response["@search.nextPageParameters"] = dict(body, skip=page_end, top=end - page_end if top is not None else None)
+            response["@odata.nextLink"] = self.path
+
+        self.send_json(200, response)
+
+    def text_ranking(self, documents: list[dict], search_text: str, search_fields, search_mode: str) -> list[tuple[float, dict]]:
+        terms = [term for term in re.findall(r"\w+", search_text.lower())]
+        if isinstance(search_fields, str):
+            search_fields = [field.strip() for field in search_fields.split(",") if field.strip()]
+
+        ranking = []
+        for document in documents:
+            fields = search_fields or [field for field, value in document.items() if isinstance(value, str)]
+            words = re.findall(r"\w+", " ".join(str(document.get(field) or "") for field in fields).lower())
+
+            counts = {term: words.count(term) for term in terms}
+            matched = [term for term, count in counts.items() if count > 0]
+            if not matched or (search_mode == "all" and len(matched) != len(terms)):
+                continue
+
+            ranking.append((sum(1 + math.log(count) for count in counts.values() if count > 0), document))
+
+        return sorted(ranking, key=lambda item: -item[0])
+
+    def vector_ranking(self, documents: list[dict], vector: list[float], fields: list[str], k: int) -> list[tuple[float, dict]]:
+        ranking = []
+        for document in documents:
+            similarities = [cosine_similarity(vector, document[field]) for field in fields if document.get(field)]
+            if similarities:
+                # Cosine similarity mapped to the service's 0..1 relevance score
+                ranking.append((1 / (2 - max(similarities)), document))
+
+        return sorted(ranking, key=lambda item: -item[0])[:k]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure AI Search REST API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every request")
+    parser.add_argument("--document-failure-rate", type=float, default=0.0, help="Fraction of indexing actions failed with a 503 in a 207")
+    parser.add_argument("--unavailable-rate", type=float, default=0.0, help="Fraction of requests answered with a 503")
+    parser.add_argument("--certfile", help="PEM certificate, serves https when set")
+    parser.add_argument("--keyfile", help="PEM private key of the certificate")
+    args = parser.parse_args()
+
+    server = MockSearchServer(
+        (args.host, args.port),
+        latency=args.latency,
+        document_failure_rate=args.document_failure_rate,
+        unavailable_rate=args.unavailable_rate,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+    )
+
+    scheme = "https" if args.certfile else "http"
+    print(f"Mock Azure AI Search listening on {scheme}://{args.host}:{args.port}, set AZURE_SEARCH_ENDPOINT to use it")
+    server.serve_forever()
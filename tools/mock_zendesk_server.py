@@ -0,0 +1,257 @@
+import argparse
+import json
+import random
+import re
+import ssl
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# The incremental export returns up to 1,000 articles per page
+ZENDESK_INCREMENTAL_PAGE_SIZE = 1000
+ZENDESK_DEFAULT_PER_PAGE = 30
+
+LIST_PATH = re.compile(r"^/api/v2/help_center/(?P<locale>[\w-]+)/articles\.json$")
+INCREMENTAL_PATH = re.compile(r"^/api/v2/help_center/incremental/articles\.json$")
+TRANSLATION_PATH = re.compile(r"^/api/v2/help_center/articles/(?P<id>\d+)/translations/(?P<locale>[\w-]+)\.json$")
+SECTION_PATH = re.compile(r"^/api/v2/help_center/(?P<locale>[\w-]+)/(?P<kind>sections|categories)/(?P<id>\d+)\.json$")
+
+
+def zendesk_time(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class MockZendeskServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Zendesk help center endpoints used by Article.
+
+    Covers the paginated articles.json listing, the incremental article export, article translations and
+    the section and category lookups. Articles live in memory, keyed by id with one translation per locale,
+    and are changed through add_article, update_article and archive_article, which stamp updated_at with
+    the current time like Zendesk does. Random 429s with a Retry-After are configurable, to exercise the
+    incremental export's rate limit. The incremental export answers 401 without an Authorization header.
+
+    Set ZENDESK_ENDPOINT=http://127.0.0.1:<port> to send every Zendesk request of AzureEnv to it, and
+    ZENDESK_EMAIL and ZENDESK_API_TOKEN to anything.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address: tuple[str, int],
+        help_center_url: str = "https://support.clo3d.com",
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        certfile: str = None,
+        keyfile: str = None,
+    ):
+        super().__init__(address, MockZendeskRequestHandler)
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.socket = context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+        self.help_center_url = help_center_url
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.scheme = "https" if certfile else "http"
+
+        self.lock = threading.Lock()
+        # {article id: {locale: article}}, the first locale is the source locale
+        self.articles = {}
+        self.sections = {}
+        self.categories = {}
+        self.requests = 0
+
+    def add_section(self, section_id: int, name: str, category_id: int, category_name: str) -> None:
+        with self.lock:
+            self.categories[category_id] = {"id": category_id, "name": category_name}
+            self.sections[section_id] = {"id": section_id, "name": name, "category_id": category_id}
+
+    def add_article(self, article_id: int, title: str, body: str, section_id: int, locales: list[str] = None, updated_at: int = None) -> None:
+        locales = locales or ["en-us"]
+        updated_at = updated_at or int(time.time())
+        with self.lock:
+            self.articles[article_id] = {
+                locale: {
+                    "id": article_id,
+                    "title": title,
+                    "body": body,
+                    "locale": locale,
+                    "source_locale": locales[0],
+                    "draft": False,
+                    "user_segment_id": None,
+                    "section_id": section_id,
+                    "html_url": f"{self.help_center_url}/hc/{locale}/articles/{article_id}",
+                    "created_at": zendesk_time(updated_at),
+                    "updated_at": zendesk_time(updated_at),
+                    "updated_at_unix": updated_at,
+                }
+                for locale in locales
+            }
+
+    def update_article(self, article_id: int, locale: str = None, **fields) -> None:
+        """Change an article, e.g. update_article(id, draft=True) unpublishes it, in every locale if `locale` is None"""
+        now = int(time.time())
+        with self.lock:
+            translations = self.articles[article_id]
+            for article in [translations[locale]] if locale else translations.values():
+                article.update(fields)
+            # Any change bumps the article's updated_at, which is what the incremental export follows
+            for article in translations.values():
+                article["updated_at"], article["updated_at_unix"] = zendesk_time(now), now
+
+    def archive_article(self, article_id: int) -> None:
+        """Archived articles disappear from the listing and the incremental export alike"""
+        with self.lock:
+            self.articles.pop(article_id, None)
+
+
+class MockZendeskRequestHandler(BaseHTTPRequestHandler):
+    server: MockZendeskServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict = None, headers: dict = {}) -> None:
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def url(self, path: str, **query) -> str:
+        return f"{self.server.scheme}://{self.headers.get('Host')}{path}?" + "&".join(f"{name}={value}" for name, value in query.items())
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+
+        if random.random() < self.server.throttle_rate:
+            self.send_json(429, {"error": "APIRateLimitExceeded"}, {"Retry-After": "1"})
+            return
+
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        with self.server.lock:
+            # Before LIST_PATH, which would read "incremental" as a locale
+            if INCREMENTAL_PATH.match(url.path):
+                # The export is admin only, any credentials will do here
+                if "Authorization" not in self.headers:
+                    self.send_json(401, {"error": "Couldn't authenticate you"})
+                else:
+                    self.send_incremental(query)
+            elif match := LIST_PATH.match(url.path):
+                self.send_list(match.group("locale"), query)
+            elif match := TRANSLATION_PATH.match(url.path):
+                article = self.server.articles.get(int(match.group("id")), {}).get(match.group("locale"))
+                if article is None:
+                    self.send_json(404, {"error": "RecordNotFound"})
+                else:
+                    translation = {key: article[key] for key in ("id", "title", "body", "locale", "draft", "html_url", "updated_at")}
+                    self.send_json(200, {"translation": translation})
+            elif match := SECTION_PATH.match(url.path):
+                records = self.server.sections if match.group("kind") == "sections" else self.server.categories
+                record = records.get(int(match.group("id")))
+                if record is None:
+                    self.send_json(404, {"error": "RecordNotFound"})
+                else:
+                    self.send_json(200, {"section" if match.group("kind") == "sections" else "category": record})
+            else:
+                self.send_json(404, {"error": "InvalidEndpoint"})
+
+    def send_list(self, locale: str, query: dict) -> None:
+        """Anonymous listing: only published articles visible to everyone, newest first"""
+        page, per_page = int(query.get("page", 1)), int(query.get("per_page", ZENDESK_DEFAULT_PER_PAGE))
+        articles = [
+            translations[locale]
+            for translations in self.server.articles.values()
+            if locale in translations and not translations[locale]["draft"] and translations[locale]["user_segment_id"] is None
+        ]
+        articles.sort(key=lambda article: (-article["updated_at_unix"], article["id"]))
+
+        page_count = max(1, -(-len(articles) // per_page))
+        self.send_json(
+            200,
+            {
+                "articles": [self.public(article) for article in articles[(page - 1) * per_page : page * per_page]],
+                "page": page,
+                "per_page": per_page,
+                "page_count": page_count,
+                "count": len(articles),
+                "next_page": self.url(f"/api/v2/help_center/{locale}/articles.json", page=page + 1, per_page=per_page) if page < page_count else None,
+            },
+        )
+
+    def send_incremental(self, query: dict) -> None:
+        """Every article in its source locale, drafts included, updated at or after start_time, oldest first"""
+        start_time = int(query.get("start_time", 0))
+        sources = [translations[next(iter(translations))] for translations in self.server.articles.values()]
+        articles = [article for article in sources if article["updated_at_unix"] >= start_time]
+        articles.sort(key=lambda article: (article["updated_at_unix"], article["id"]))
+        page = articles[:ZENDESK_INCREMENTAL_PAGE_SIZE]
+
+        end_time = page[-1]["updated_at_unix"] if page else start_time
+        self.send_json(
+            200,
+            {
+                "articles": [self.public(article) for article in page],
+                "count": len(page),
+                "end_time": end_time,
+                "next_page": self.url("/api/v2/help_center/incremental/articles.json", start_time=end_time) if len(articles) > len(page) else None,
+            },
+        )
+
+    @staticmethod
+    def public(article: dict) -> dict:
+        return {key: value for key, value in article.items() if key != "updated_at_unix"}
+
+
+def seed_articles(server: MockZendeskServer, count: int, locales: list[str]) -> None:
+    """Fill the server with `count` articles in a few sections, updated one second apart in the past"""
+    server.add_section(1001, "Getting Started", 2001, "Basics")
+    server.add_section(1002, "Features", 2002, "Reference")
+
+    now = int(time.time())
+    for i in range(count):
+        body = f"<p>Article {i} explains feature {i % 17} of the software.</p>"
+        if i % 10 == 0:
+            body += f'<iframe src="https://www.youtube.com/embed/video{i}"></iframe>'
+        server.add_article(100000 + i, f"Article {i}", body, 1001 + i % 2, locales, updated_at=now - count + i)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Zendesk help center API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8300)
+    parser.add_argument("--articles", type=int, default=100, help="Articles to seed")
+    parser.add_argument("--locales", default="en-us,ko", help="Comma separated locales of every seeded article, the first is the source")
+    parser.add_argument("--help-center-url", default="https://support.clo3d.com", help="Base of the articles' html_url, matching the brand")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with a 429")
+    parser.add_argument("--certfile", help="PEM certificate, serves https when set")
+    parser.add_argument("--keyfile", help="PEM private key of the certificate")
+    args = parser.parse_args()
+
+    server = MockZendeskServer(
+        (args.host, args.port),
+        help_center_url=args.help_center_url,
+        latency=args.latency,
+        throttle_rate=args.throttle_rate,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+    )
+    seed_articles(server, args.articles, args.locales.split(","))
+
+    scheme = "https" if args.certfile else "http"
+    print(f"Mock Zendesk listening on {scheme}://{args.host}:{args.port}, set ZENDESK_ENDPOINT to use it")
+    server.serve_forever()
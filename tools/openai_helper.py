@@ -5,10 +5,14 @@ import sys
 from pathlib import Path
 
 from dotenv import load_dotenv
-from openai import AzureOpenAI
+from openai import AzureOpenAI, RateLimitError
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
+from .completion_cache import CompletionCache
+from .embedding_cache import EmbeddingCache
 from .misc import trim_tokens
+from .rate_governor import RateGovernor, retry_after_seconds, wait_retry_after
+from .tokenizer import count_tokens, truncate_to_tokens
 
 backend_dir = Path(__file__).parent.parent.parent
 
@@ -19,6 +23,52 @@ from tools.misc import num_tokens_from_string
 GPT_4_MINI_MAX_INPUT_TOKENS = 128000
 GPT_4_MINI_MAX_OUTPUT_TOKENS = 16000
 EMBEDDING_ADA_002_MAX_INPUT_TOKENS = 8191
+# https://learn.microsoft.com/en-us/azure/ai-services/openai/reference#embeddings
+EMBEDDING_MAX_BATCH_INPUTS = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 300000
+
+QUESTIONS_PROMPT = "Generate 10 brief and concise questions a customer would ask about this in {language}: {text}"
+LABELS_PROMPT = "Generate {keywords_num} keywords from the this in {language}: {text}"
+TRANSCRIPT_SUMMARY_PROMPT = (
+    "Provide a comprehensive guide of the given transcript. Include all step-by-step instructions, definitions, and tips and tricks. {transcript}"
+)
+PDF_SUMMARY_PROMPT = "Provide a comprehensive guide of the given text. Include all step-by-step instructions, definitions, and warranties. {pdf}"
+
+# Bump a prompt's version whenever its template or generation settings change, so cached completions are not reused
+PROMPT_VERSIONS = {
+    "questions": 1,
+    "labels": 1,
+    "transcript_summary": 1,
+    "pdf_summary": 1,
+}
+
+
+def parse_questions(questions: str) -> str:
+    """Remove the numbering and newlines from generated questions"""
+    # Remove any numbers at the start of each line
+    questions = re.sub("^[0-9]+\.\s", "", questions, flags=re.MULTILINE)
+
+    # Replace any newlines with spaces
+    questions = re.sub("\n+", " ", questions, flags=re.MULTILINE)
+
+    return questions
+
+
+def parse_labels(labels: str) -> list[str]:
+    """Split generated keywords into a list, stripping whitespace and numbering"""
+    labels = labels.splitlines()
+    for i, l in enumerate(labels):
+        labels[i] = re.sub("[0-9]+\.*\)*\s*", "", l, flags=re.MULTILINE).strip()
+
+    return labels
+
+
+def parse_summary(summary: str) -> str:
+    """Collapse a generated summary onto a single line"""
+    summary = re.sub(r"\n+", " ", summary)
+    summary = re.sub(r"\s+", " ", summary)
+
+    return summary
 
 
 class OpenAIHelper:
@@ -28,16 +78,21 @@ class OpenAIHelper:
         AZURE_OPENAI_CHATGPT_DEPLOYMENT,
         AZURE_OPENAI_EMB_DEPLOYMENT,
         language="English",
+        embedding_cache: EmbeddingCache | None = None,
+        rate_governor: RateGovernor | None = None,
+        completion_cache: CompletionCache | None = None,
     ):
         self.openai_client = openai_client
         self.AZURE_OPENAI_CHATGPT_DEPLOYMENT = AZURE_OPENAI_CHATGPT_DEPLOYMENT
         self.AZURE_OPENAI_EMB_DEPLOYMENT = AZURE_OPENAI_EMB_DEPLOYMENT
         self.language = language
+        self.embedding_cache = embedding_cache
+        self.rate_governor = rate_governor
+        self.completion_cache = completion_cache
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
     def generate_embeddings(self, text: str) -> list[float]:
         """
-        Generate embeddings for a given text.
+        Generate embeddings for a given text. Embeddings already in the embedding cache are returned without a request.
 
         Args:
             text (str): The text to generate embeddings for.
@@ -48,21 +103,161 @@ class OpenAIHelper:
         Raises:
             openai.error.OpenAIError: If the request to the OpenAI API fails.
         """
-        tokens = num_tokens_from_string(text, "text-embedding-ada-002")
+        return self.generate_embeddings_batch([text])[0]
+
+    def generate_embeddings_batch(
+        self,
+        texts: list[str],
+        max_batch_inputs: int = EMBEDDING_MAX_BATCH_INPUTS,
+        max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS,
+    ) -> list[list[float]]:
+        """
+        Generate embeddings for many texts, packing them into as few requests as possible.
+
+        Texts found in the embedding cache are not sent, and a text repeated in `texts`, such as the Title that every chunk
+        copies from its parent, is sent once. The rest are truncated on a token boundary to the per-input limit, then grouped
+        greedily so that no request exceeds `max_batch_inputs` inputs or `max_batch_tokens` tokens.
+
+        Args:
+            texts (list[str]): The texts to generate embeddings for.
+            max_batch_inputs (int, optional): Maximum number of inputs per request. Defaults to EMBEDDING_MAX_BATCH_INPUTS.
+            max_batch_tokens (int, optional): Maximum number of tokens per request. Defaults to EMBEDDING_MAX_BATCH_TOKENS.
+
+        Returns:
+            list[list[float]]: The generated embeddings, in the same order as `texts`.
+
+        Raises:
+            openai.error.OpenAIError: If the request to the OpenAI API fails.
+        """
+        if self.embedding_cache is not None:
+            embeddings = self.embedding_cache.get_many(texts)
+        else:
+            embeddings = [None] * len(texts)
+
+        # The indexes of every missing text, only the first one of each is sent
+        duplicates = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                duplicates.setdefault(texts[i], []).append(i)
+
+        missing = [indexes[0] for indexes in duplicates.values()]
+        missing_tokens = count_tokens([texts[i] for i in missing], "text-embedding-ada-002")
+
+        batches = [[]]
+        batch_tokens = 0
+        for i, tokens in zip(missing, missing_tokens):
+            text = texts[i]
+
+            if tokens > EMBEDDING_ADA_002_MAX_INPUT_TOKENS:
+                text = truncate_to_tokens(text, EMBEDDING_ADA_002_MAX_INPUT_TOKENS, "text-embedding-ada-002")
+                tokens = EMBEDDING_ADA_002_MAX_INPUT_TOKENS
+
+            # Start a new batch if adding this text would exceed either limit
+            if batches[-1] and (len(batches[-1]) >= max_batch_inputs or batch_tokens + tokens > max_batch_tokens):
+                batches.append([])
+                batch_tokens = 0
 
-        if tokens >= EMBEDDING_ADA_002_MAX_INPUT_TOKENS:
-            text = text[:EMBEDDING_ADA_002_MAX_INPUT_TOKENS]
+            batches[-1].append((i, text, tokens))
+            batch_tokens += tokens
 
-        return (
-            self.openai_client.embeddings.create(
-                input=[text],
+        for batch in batches:
+            if not batch:
+                continue
+
+            indexes, inputs, tokens = zip(*batch)
+            batch_embeddings = self._create_embeddings(list(inputs), sum(tokens))
+
+            for index, embedding in zip(indexes, batch_embeddings):
+                for duplicate in duplicates[texts[index]]:
+                    embeddings[duplicate] = embedding
+
+            if self.embedding_cache is not None:
+                # Cache under the original text, truncation is deterministic
+                self.embedding_cache.put_many([texts[index] for index in indexes], batch_embeddings)
+
+        return embeddings
+
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
+    def _create_embeddings(self, inputs: list[str], tokens: int) -> list[list[float]]:
+        """Send a single embeddings request and return the vectors ordered like `inputs`."""
+        if self.rate_governor is not None:
+            self.rate_governor.acquire(self.AZURE_OPENAI_EMB_DEPLOYMENT, tokens)
+
+        try:
+            response = self.openai_client.embeddings.create(
+                input=inputs,
                 model=self.AZURE_OPENAI_EMB_DEPLOYMENT,
             )
-            .data[0]
-            .embedding
+        except RateLimitError as e:
+            if self.rate_governor is not None:
+                self.rate_governor.penalize(self.AZURE_OPENAI_EMB_DEPLOYMENT, retry_after_seconds(e))
+            raise
+
+        return [data.embedding for data in sorted(response.data, key=lambda data: data.index)]
+
+    def _create_chat_completion(self, messages: list[dict], tokens: int, max_tokens: int, **kwargs):
+        """
+        Send a chat completion request, waiting for the rate governor to admit it first.
+
+        Args:
+            messages (list[dict]): The messages to send.
+            tokens (int): The number of prompt tokens, used with `max_tokens` to estimate the request's quota usage.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            The chat completion.
+        """
+        if self.rate_governor is not None:
+            self.rate_governor.acquire(self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, tokens + max_tokens)
+
+        try:
+            return self.openai_client.chat.completions.create(
+                model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, messages=messages, max_tokens=max_tokens, **kwargs
+            )
+        except RateLimitError as e:
+            if self.rate_governor is not None:
+                self.rate_governor.penalize(self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, retry_after_seconds(e))
+            raise
+
+    def _cached_chat_completion(self, template: str, content: str, tokens: int, temperature: float, max_tokens: int) -> str:
+        """
+        Send a single user message and return the reply, reusing the completion cache when the same prompt was sent before.
+
+        Args:
+            template (str): The name of the prompt in PROMPT_VERSIONS.
+            content (str): The formatted prompt.
+            tokens (int): The number of prompt tokens.
+            temperature (float): The sampling temperature.
+            max_tokens (int): The maximum number of tokens to generate.
+
+        Returns:
+            str: The content of the reply.
+        """
+        key = None
+        if self.completion_cache is not None:
+            key = CompletionCache.key(
+                self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, f"{template}:v{PROMPT_VERSIONS[template]}", temperature, max_tokens, content
+            )
+            completion = self.completion_cache.get(key)
+
+            if completion is not None:
+                return completion
+
+        chat_completion = self._create_chat_completion(
+            [{"role": "user", "content": content}],
+            tokens,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            n=1,
         )
+        completion = chat_completion.choices[0].message.content
+
+        if key is not None:
+            self.completion_cache.put(key, completion)
+
+        return completion
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
     def generate_questions(self, text: str) -> str:
         """
         Generate questions from a given text.
@@ -81,35 +276,21 @@ class OpenAIHelper:
 
         if tokens >= GPT_4_MINI_MAX_INPUT_TOKENS:
             # Trim the text to the maximum allowed length
-            text = text[:GPT_4_MINI_MAX_INPUT_TOKENS]
-
-        # Create a list of messages to send to the OpenAI API
-        messages = [
-            # The first message is the text to generate questions from
-            {"role": "user", "content": f"Generate 10 brief and concise questions a customer would ask about this in {self.language}: {text}"},
-        ]
+            text = truncate_to_tokens(text, GPT_4_MINI_MAX_INPUT_TOKENS)
 
         # Use the OpenAI API to generate the questions
-        chat_completion = self.openai_client.chat.completions.create(
-            model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-            messages=messages,
+        questions = self._cached_chat_completion(
+            "questions",
+            QUESTIONS_PROMPT.format(language=self.language, text=text),
+            tokens,
             temperature=0.7,
             max_tokens=200,
-            n=1,
         )
 
-        # Extract the generated questions from the response
-        questions = chat_completion.choices[0].message.content
+        # Remove the numbering and newlines from the generated questions
+        return parse_questions(questions)
 
-        # Remove any numbers at the start of each line
-        questions = re.sub("^[0-9]+\.\s", "", questions, flags=re.MULTILINE)
-
-        # Replace any newlines with spaces
-        questions = re.sub("\n+", " ", questions, flags=re.MULTILINE)
-
-        return questions
-
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
     def generate_labels(self, text: str) -> list[str]:
         """
         Generate keywords from a given text.
@@ -130,31 +311,20 @@ class OpenAIHelper:
 
         if tokens >= GPT_4_MINI_MAX_INPUT_TOKENS:
             # truncate the text if it exceeds the maximum token limit
-            text = text[:GPT_4_MINI_MAX_INPUT_TOKENS]
-
-        messages = [
-            {
-                "role": "user",
-                "content": f"Generate {keywords_num} keywords from the this in {self.language}: {text}",
-            }
-        ]
-
-        chat_completion = self.openai_client.chat.completions.create(
-            model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT,
-            messages=messages,
+            text = truncate_to_tokens(text, GPT_4_MINI_MAX_INPUT_TOKENS)
+
+        labels = self._cached_chat_completion(
+            "labels",
+            LABELS_PROMPT.format(keywords_num=keywords_num, language=self.language, text=text),
+            tokens,
             temperature=0,
             max_tokens=200,
-            n=1,
         )
 
         # split the response into individual lines, strip whitespace, and remove numbers
-        labels = chat_completion.choices[0].message.content.splitlines()
-        for i, l in enumerate(labels):
-            labels[i] = re.sub("[0-9]+\.*\)*\s*", "", l, flags=re.MULTILINE).strip()
+        return parse_labels(labels)
 
-        return labels
-
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
     def generate_transcript_summary(self, transcript: str) -> str:
         """
         Summarize a transcript
@@ -170,29 +340,17 @@ class OpenAIHelper:
         tokens = num_tokens_from_string(transcript, "gpt-4o-mini")
 
         if tokens >= GPT_4_MINI_MAX_INPUT_TOKENS:
-            transcript = transcript[:GPT_4_MINI_MAX_INPUT_TOKENS]
-
-        # Create the prompt for the AI
-        messages = [
-            {
-                "role": "user",
-                "content": f"Provide a comprehensive guide of the given transcript. Include all step-by-step instructions, definitions, and tips and tricks. {transcript}",
-            }
-        ]
+            transcript = truncate_to_tokens(transcript, GPT_4_MINI_MAX_INPUT_TOKENS)
 
         # Ask the AI to generate a summary
-        chat_completion = self.openai_client.chat.completions.create(
-            model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, messages=messages, temperature=0.7, max_tokens=2000, n=1
+        summary = self._cached_chat_completion(
+            "transcript_summary", TRANSCRIPT_SUMMARY_PROMPT.format(transcript=transcript), tokens, temperature=0.7, max_tokens=2000
         )
 
-        # Extract the summary from the response
-        summary = chat_completion.choices[0].message.content
-        summary = re.sub(r"\n+", " ", summary)
-        summary = re.sub(r"\s+", " ", summary)
-
-        return summary
+        # Collapse the summary onto a single line
+        return parse_summary(summary)
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
     def generate_pdf_summary(self, pdf):
         """
         Summarize a PDF
@@ -207,29 +365,15 @@ class OpenAIHelper:
         tokens = num_tokens_from_string(pdf, "gpt-4o-mini")
 
         if tokens >= GPT_4_MINI_MAX_INPUT_TOKENS:
-            pdf = pdf[:GPT_4_MINI_MAX_INPUT_TOKENS]
-
-        # Create the prompt for the AI
-        messages = [
-            {
-                "role": "user",
-                "content": f"Provide a comprehensive guide of the given text. Include all step-by-step instructions, definitions, and warranties. {pdf}",
-            }
-        ]
+            pdf = truncate_to_tokens(pdf, GPT_4_MINI_MAX_INPUT_TOKENS)
 
         # Ask the AI to generate a summary
-        chat_completion = self.openai_client.chat.completions.create(
-            model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, messages=messages, temperature=0.7, max_tokens=1000, n=1
-        )
+        summary = self._cached_chat_completion("pdf_summary", PDF_SUMMARY_PROMPT.format(pdf=pdf), tokens, temperature=0.7, max_tokens=1000)
 
-        # Extract the summary from the response
-        summary = chat_completion.choices[0].message.content
-        summary = re.sub(r"\n+", " ", summary)
-        summary = re.sub(r"\s+", " ", summary)
+        # Collapse the summary onto a single line
+        return parse_summary(summary)
 
-        return summary
-
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
     def outline_webpage(self, content, website_url):
         """
         Outlines a webpage based on the content of the webpage.
@@ -265,9 +409,7 @@ class OpenAIHelper:
             ]
 
             # Ask the AI to generate an outline
-            chat_completion = self.openai_client.chat.completions.create(
-                model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, messages=messages, temperature=0, max_tokens=1500, n=1
-            )
+            chat_completion = self._create_chat_completion(messages, tokens, temperature=0, max_tokens=1500, n=1)
 
             # Extract the outline from the response
             outline = chat_completion.choices[0].message.content
@@ -279,7 +421,7 @@ class OpenAIHelper:
             print("OpenAI Outline Webpage Error: ", e)
             return ""
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
     def scrape_webpage(self, content, website_url):
         """Scrape a Webpage"""
 
@@ -301,9 +443,7 @@ class OpenAIHelper:
                 }
             ]
 
-            chat_completion = self.openai_client.chat.completions.create(
-                model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, messages=messages, temperature=0, max_tokens=1500, n=1
-            )
+            chat_completion = self._create_chat_completion(messages, tokens, temperature=0, max_tokens=1500, n=1)
 
             scraped_content = chat_completion.choices[0].message.content
             scraped_content = re.sub(r"\[https.*\]", "", scraped_content)
@@ -314,7 +454,7 @@ class OpenAIHelper:
             print("OpenAI Scrape Webpage Error: ", e)
             return ""
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
+    @retry(wait=wait_retry_after(wait_random_exponential(min=1, max=20)), stop=stop_after_attempt(6))
     def create_webpage_title(self, content):
         """Scrape a Webpage"""
 
@@ -325,9 +465,7 @@ class OpenAIHelper:
 
         messages = [{"role": "user", "content": f"Generate a title for a website based on the following content: {content}"}]
 
-        chat_completion = self.openai_client.chat.completions.create(
-            model=self.AZURE_OPENAI_CHATGPT_DEPLOYMENT, messages=messages, temperature=0.7, max_tokens=50, n=1
-        )
+        chat_completion = self._create_chat_completion(messages, tokens, temperature=0.7, max_tokens=50, n=1)
 
         outline = chat_completion.choices[0].message.content
         # outline = re.sub(r"\n+", " ", outline)
@@ -0,0 +1,116 @@
+import threading
+from collections import OrderedDict
+
+from tools.embedding_cache import normalize_embedding_text
+from tools.openai_helper import OpenAIHelper
+
+QUERY_EMBEDDING_CACHE_MAX_ENTRIES = 4096
+
+
+def normalize_query(query: str) -> str:
+    """Case and whitespace insensitive form of a search query"""
+    return normalize_embedding_text(query).lower()
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU of search query embeddings.
+
+    Queries are keyed by their normalized text, so "How to install" and "how to  install" share one vector.
+    The original text of the first query of a key is what gets embedded, since the model is case sensitive.
+    Misses are embedded through the OpenAIHelper, which consults the persistent EmbeddingCache first when
+    AzureEnv has one configured.
+    """
+
+    def __init__(self, openai_helper: OpenAIHelper, max_entries: int = QUERY_EMBEDDING_CACHE_MAX_ENTRIES):
+        self.openai_helper = openai_helper
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, queries: list[str]) -> list[list[float]]:
+        """
+        Get the embeddings of many queries, embedding all misses in one batch.
+
+        Args:
+            queries (list[str]): The search queries.
+
+        Returns:
+            list[list[float]]: The embeddings in the same order as `queries`.
+        """
+        keys = [normalize_query(query) for query in queries]
+
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+
+        # The first query of each missing key, embedded as written
+        missing = {}
+        for key, query in zip(keys, queries):
+            if key not in found:
+                missing.setdefault(key, query)
+
+        if missing:
+            vectors = self.openai_helper.generate_embeddings_batch(list(missing.values()))
+
+            with self._lock:
+                for key, vector in zip(missing, vectors):
+                    found[key] = vector
+                    self._entries[key] = vector
+                    self._entries.move_to_end(key)
+
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+        return [found[key] for key in keys]
+
+    def get(self, query: str) -> list[float]:
+        return self.get_many([query])[0]
+
+    def peek(self, query: str) -> list[float] | None:
+        """Look up a query without embedding it on a miss, for callers that embed it themselves"""
+        key = normalize_query(query)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, query: str, vector: list[float]) -> None:
+        with self._lock:
+            self._entries[normalize_query(query)] = vector
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+        }
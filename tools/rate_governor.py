@@ -0,0 +1,202 @@
+import asyncio
+import math
+import os
+import sqlite3
+import threading
+import time
+
+# Upper bound on a Retry-After, so a malformed or hostile header cannot stall every caller of a deployment
+RETRY_AFTER_MAX_SECONDS = 60
+
+
+def retry_after_seconds(exception: Exception) -> float | None:
+    """
+    Returns how long the service asked us to wait, from the Retry-After headers of a throttled response.
+
+    Args:
+        exception (Exception): The exception raised by the OpenAI client.
+
+    Returns:
+        float | None: The number of seconds to wait, between 0 and RETRY_AFTER_MAX_SECONDS, or None if the response did not say.
+    """
+    response = getattr(exception, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            seconds = float(headers["retry-after-ms"]) / 1000
+        elif "retry-after" in headers:
+            seconds = float(headers["retry-after"])
+        else:
+            return None
+    except ValueError:
+        return None
+
+    if math.isnan(seconds):
+        return None
+
+    return min(max(seconds, 0.0), RETRY_AFTER_MAX_SECONDS)
+
+
+class wait_retry_after:
+    """tenacity wait strategy that honours Retry-After, falling back to another strategy when it is absent"""
+
+    def __init__(self, fallback):
+        self.fallback = fallback
+
+    def __call__(self, retry_state) -> float:
+        retry_after = retry_after_seconds(retry_state.outcome.exception())
+
+        if retry_after is not None:
+            return retry_after
+
+        return self.fallback(retry_state)
+
+
+class RateGovernor:
+    """
+    Token and request-per-minute admission control for Azure OpenAI deployments.
+
+    Each deployment gets two token buckets, one for requests and one for tokens, that refill continuously
+    at its RPM/TPM quota. The bucket state lives in a SQLite file and is updated inside an immediate
+    transaction, so every thread and pool worker pointing at the same file shares one budget. Requests are
+    admitted before they are sent using their estimated token count, and a 429's Retry-After pauses the
+    deployment for every caller.
+
+    Deployments without a quota are never throttled.
+    """
+
+    def __init__(self, path: str, quotas: dict[str, tuple[int, int]]):
+        """
+        Args:
+            path (str): Path of the shared state file.
+            quotas (dict[str, tuple[int, int]]): Maps a deployment name to its (tokens per minute, requests per minute).
+        """
+        self.path = path
+        self.quotas = {deployment: quota for deployment, quota in quotas.items() if deployment and all(quota)}
+
+        self._connection = None
+        self._pid = None
+        # The connection is shared by the threads of a process, so transactions must not interleave
+        self._lock = threading.Lock()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not be shared with forked pool workers, so open one per process
+        if self._connection is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+            self._connection = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (deployment TEXT PRIMARY KEY, tokens REAL NOT NULL, requests REAL NOT NULL, updated_at REAL NOT NULL, blocked_until REAL NOT NULL)"
+            )
+            self._pid = os.getpid()
+
+        return self._connection
+
+    def try_acquire(self, deployment: str, tokens: int) -> float:
+        """
+        Try to admit a request.
+
+        Args:
+            deployment (str): The deployment the request is for.
+            tokens (int): The number of tokens the request is expected to consume.
+
+        Returns:
+            float: 0 if the request was admitted, otherwise the number of seconds to wait before trying again.
+        """
+        if deployment not in self.quotas:
+            return 0
+
+        tokens_per_minute, requests_per_minute = self.quotas[deployment]
+        # A single request larger than the whole quota is admitted once the bucket is full
+        tokens = min(tokens, tokens_per_minute)
+
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = connection.execute(
+                    "SELECT tokens, requests, updated_at, blocked_until FROM buckets WHERE deployment = ?", (deployment,)
+                ).fetchone()
+
+                if row is None:
+                    available_tokens, available_requests, blocked_until = tokens_per_minute, requests_per_minute, 0
+                else:
+                    available_tokens, available_requests, updated_at, blocked_until = row
+                    elapsed = max(now - updated_at, 0)
+                    available_tokens = min(tokens_per_minute, available_tokens + elapsed * tokens_per_minute / 60)
+                    available_requests = min(requests_per_minute, available_requests + elapsed * requests_per_minute / 60)
+
+                if blocked_until > now:
+                    # Paused by a 429, leave the bucket untouched so it only refills once the pause is over
+                    wait = blocked_until - now
+                elif available_tokens >= tokens and available_requests >= 1:
+                    wait = 0
+                    connection.execute(
+                        "INSERT OR REPLACE INTO buckets (deployment, tokens, requests, updated_at, blocked_until) VALUES (?, ?, ?, ?, ?)",
+                        (deployment, available_tokens - tokens, available_requests - 1, now, blocked_until),
+                    )
+                else:
+                    wait = max(
+                        (tokens - available_tokens) * 60 / tokens_per_minute,
+                        (1 - available_requests) * 60 / requests_per_minute,
+                    )
+
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+        return wait
+
+    def acquire(self, deployment: str, tokens: int) -> None:
+        """Block until the request is admitted"""
+        while True:
+            wait = self.try_acquire(deployment, tokens)
+            if wait <= 0:
+                return
+
+            time.sleep(wait)
+
+    async def async_acquire(self, deployment: str, tokens: int) -> None:
+        """Wait without blocking the event loop until the request is admitted"""
+        while True:
+            # try_acquire can wait up to the SQLite busy timeout for the lock, so it runs off the event loop
+            wait = await asyncio.to_thread(self.try_acquire, deployment, tokens)
+            if wait <= 0:
+                return
+
+            await asyncio.sleep(wait)
+
+    def penalize(self, deployment: str, retry_after: float | None) -> None:
+        """
+        Record a 429 from the service, pausing the deployment for every caller.
+
+        Args:
+            deployment (str): The deployment that was throttled.
+            retry_after (float | None): The Retry-After in seconds, defaults to one second when the service did not say.
+        """
+        if deployment not in self.quotas:
+            return
+
+        blocked_until = time.time() + (retry_after if retry_after is not None else 1)
+
+        with self._lock:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # Our estimate of the bucket was too generous, so start refilling from empty once the pause is over
+                connection.execute(
+                    "INSERT INTO buckets (deployment, tokens, requests, updated_at, blocked_until) VALUES (?, 0, 0, ?, ?) "
+                    "ON CONFLICT(deployment) DO UPDATE SET tokens = 0, requests = 0, "
+                    "updated_at = MAX(blocked_until, excluded.blocked_until), blocked_until = MAX(blocked_until, excluded.blocked_until)",
+                    (deployment, blocked_until, blocked_until),
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
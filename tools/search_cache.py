@@ -0,0 +1,230 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urlparse
+
+from azure.search.documents import SearchClient
+from azure.search.documents.indexes import SearchIndexClient
+
+backend_dir = Path(__file__).parent.parent
+SEARCH_CACHE_TTL = 300
+SEARCH_CACHE_MAX_ENTRIES = 10000
+
+
+def normalize_search_query(query: str) -> str:
+    """Case, whitespace and punctuation insensitive form of a search query"""
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", (query or "").casefold())).strip()
+
+
+def index_id(endpoint: str, index_name: str) -> str:
+    """Identifies an index across services, dev and prod can use the same index name"""
+    return f"{urlparse(endpoint).netloc or endpoint}_{index_name}".replace(":", "_").replace("/", "_")
+
+
+def index_generations_directory() -> str:
+    """INDEX_GENERATIONS_PATH, or .cache/index_generations by default, so every writer bumps the same files"""
+    return os.environ.get("INDEX_GENERATIONS_PATH", os.path.join(backend_dir, ".cache", "index_generations"))
+
+
+class IndexGenerations:
+    """
+    Per-index generation numbers shared by every process through file modification times.
+
+    Writers bump an index's generation after every upload or delete, and cached results remember the
+    generation they were computed at, so a write from any process invalidates them with one stat() call.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, index: str) -> str:
+        return os.path.join(self.directory, index)
+
+    def get(self, index: str) -> int:
+        try:
+            return os.stat(self.path(index)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def bump(self, index: str) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = self.path(index)
+        # Always move forward, even if two writes land within the file system's timestamp resolution
+        generation = max(time.time_ns(), self.get(index) + 1)
+        with open(path, "a"):
+            pass
+        os.utime(path, ns=(generation, generation))
+
+
+class InvalidatingSearchClient(SearchClient):
+    """SearchClient that bumps the index generation after every indexing call, invalidating cached search results"""
+
+    def __init__(self, endpoint: str, index_name: str, credential, generations: IndexGenerations, **kwargs):
+        super().__init__(endpoint=endpoint, index_name=index_name, credential=credential, **kwargs)
+        self.generations = generations
+        self.index_id = index_id(endpoint, index_name)
+
+    def _invalidate(self, method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        finally:
+            self.generations.bump(self.index_id)
+
+    def upload_documents(self, documents, **kwargs):
+        return self._invalidate(super().upload_documents, documents, **kwargs)
+
+    def delete_documents(self, documents, **kwargs):
+        return self._invalidate(super().delete_documents, documents, **kwargs)
+
+    def merge_documents(self, documents, **kwargs):
+        return self._invalidate(super().merge_documents, documents, **kwargs)
+
+    def merge_or_upload_documents(self, documents, **kwargs):
+        return self._invalidate(super().merge_or_upload_documents, documents, **kwargs)
+
+    def index_documents(self, batch, **kwargs):
+        return self._invalidate(super().index_documents, batch, **kwargs)
+
+
+class InvalidatingSearchIndexClient(SearchIndexClient):
+    """SearchIndexClient that bumps the generation of every index it creates, updates or deletes"""
+
+    def __init__(self, endpoint: str, credential, generations: IndexGenerations, **kwargs):
+        super().__init__(endpoint=endpoint, credential=credential, **kwargs)
+        self.generations = generations
+        self.search_endpoint = endpoint
+
+    def _invalidate(self, index, method, *args, **kwargs):
+        try:
+            return method(index, *args, **kwargs)
+        finally:
+            self.generations.bump(index_id(self.search_endpoint, index if isinstance(index, str) else index.name))
+
+    def create_index(self, index, **kwargs):
+        return self._invalidate(index, super().create_index, **kwargs)
+
+    def create_or_update_index(self, index, *args, **kwargs):
+        return self._invalidate(index, super().create_or_update_index, *args, **kwargs)
+
+    def delete_index(self, index, **kwargs):
+        return self._invalidate(index, super().delete_index, **kwargs)
+
+
+class SearchResultCache:
+    """
+    In-process LRU of search results keyed by (index, mode, normalized query, k, select).
+
+    Entries expire after `ttl` seconds and are dropped as soon as the index's generation changes, i.e.
+    after any upload or delete through an InvalidatingSearchClient in any process. Hits return shallow
+    copies of the cached results so callers can annotate them freely.
+    """
+
+    def __init__(self, generations: IndexGenerations, ttl: int = SEARCH_CACHE_TTL, max_entries: int = SEARCH_CACHE_MAX_ENTRIES):
+        self.generations = generations
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(index: str, mode: str, query: str, k: int, select: list[str] = None) -> tuple:
+        return (index, mode, normalize_search_query(query), k, tuple(select or ()))
+
+    def get(self, index: str, mode: str, query: str, k: int, select: list[str] = None) -> list[dict] | None:
+        """
+        Look up the results of a search.
+
+        Returns:
+            list[dict] | None: Copies of the cached results, None if missing, expired or invalidated.
+        """
+        key = self.key(index, mode, query, k, select)
+        generation = self.generations.get(index)
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, entry_generation, results = entry
+            if expires_at < time.time() or entry_generation != generation:
+                del self._entries[key]
+                self.misses += 1
+                self.invalidations += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        return [dict(result) for result in results]
+
+    def put(self, index: str, mode: str, query: str, k: int, results: list[dict], select: list[str] = None, generation: int = None) -> None:
+        """Store the results of a search, `generation` being the index's generation from before the search ran"""
+        if self.max_entries <= 0:
+            return
+
+        key = self.key(index, mode, query, k, select)
+        generation = generation if generation is not None else self.generations.get(index)
+        entry = (time.time() + self.ttl, generation, [dict(result) for result in results])
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_search(self, index: str, mode: str, query: str, k: int, select: list[str], search: Callable[[], list[dict]]) -> list[dict]:
+        """
+        Return the cached results of a search, running and caching it on a miss.
+
+        Args:
+            index (str): The index_id of the searched index.
+            mode (str): The search mode, e.g. "vector".
+            query (str): The search text.
+            k (int): The number of results requested.
+            select (list[str]): The fields requested.
+            search (Callable[[], list[dict]]): Runs the search.
+
+        Returns:
+            list[dict]: The results.
+        """
+        results = self.get(index, mode, query, k, select)
+        if results is not None:
+            return results
+
+        # Read before searching so a write that lands during the search still invalidates the entry
+        generation = self.generations.get(index)
+        results = search()
+        self.put(index, mode, query, k, results, select, generation=generation)
+
+        return results
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+        }
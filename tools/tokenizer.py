@@ -0,0 +1,68 @@
+import os
+import sys
+from functools import lru_cache
+from pathlib import Path
+
+backend_dir = Path(__file__).parent.parent
+
+# tiktoken downloads BPE files into TIKTOKEN_CACHE_DIR on first use, point it at a directory inside the
+# repository so it can be seeded once (python tools/tokenizer.py) and reused offline by every worker
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(backend_dir, ".cache", "tiktoken"))
+
+import tiktoken
+
+TOKENIZER_NUM_THREADS = 8
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = "gpt-4o-mini") -> tiktoken.Encoding:
+    """Returns the encoding for a model, loading it only once per process"""
+    return tiktoken.encoding_for_model(model)
+
+
+def count_tokens(texts: list[str], model: str = "gpt-4o-mini") -> list[int]:
+    """
+    Count the tokens of many texts at once using tiktoken's multithreaded batch encoder.
+
+    Args:
+        texts (list[str]): The texts to count.
+        model (str, optional): The model whose encoding is used. Defaults to "gpt-4o-mini".
+
+    Returns:
+        list[int]: The number of tokens of each text.
+    """
+    return [len(tokens) for tokens in get_encoding(model).encode_ordinary_batch(texts, num_threads=TOKENIZER_NUM_THREADS)]
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> str:
+    """
+    Truncate a text to at most `max_tokens` tokens, cutting on a token boundary.
+
+    Args:
+        text (str): The text to truncate.
+        max_tokens (int): The maximum number of tokens to keep.
+        model (str, optional): The model whose encoding is used. Defaults to "gpt-4o-mini".
+
+    Returns:
+        str: The text unchanged if it fits, otherwise its first `max_tokens` tokens.
+    """
+    encoding = get_encoding(model)
+    tokens = encoding.encode_ordinary(text)
+
+    if len(tokens) <= max_tokens:
+        return text
+
+    return encoding.decode(tokens[:max_tokens])
+
+
+def seed_encoding_cache(models: list[str]) -> None:
+    """Download the BPE files of `models` into TIKTOKEN_CACHE_DIR so workers can start offline"""
+    os.makedirs(os.environ["TIKTOKEN_CACHE_DIR"], exist_ok=True)
+
+    for model in models:
+        encoding = get_encoding(model)
+        print(f"{model}: {encoding.name} cached in {os.environ['TIKTOKEN_CACHE_DIR']}")
+
+
+if __name__ == "__main__":
+    seed_encoding_cache(sys.argv[1:] or ["gpt-4o-mini", "gpt-3.5-turbo", "text-embedding-ada-002"])
@@ -0,0 +1,159 @@
+import json
+import os
+import time
+from functools import lru_cache
+from typing import Iterator
+
+import requests
+
+from tools.azure_env import AzureEnv
+
+# Days between full listings of the help center, which find the archived articles the incremental export never returns
+ZENDESK_RECONCILE_DAYS = 7
+ZENDESK_MAX_RETRIES = 5
+# Used when a 429 has no Retry-After, the incremental exports allow 10 requests a minute
+ZENDESK_RETRY_AFTER_SECONDS = 60
+
+
+def request_zendesk(url: str, auth: tuple[str, str] = None, missing_ok: bool = False) -> requests.Response | None:
+    """
+    GET a Zendesk endpoint, waiting out 429s for as long as Retry-After asks.
+
+    Args:
+        url (str): The endpoint.
+        auth (tuple[str, str], optional): Basic auth from AzureEnv.get_zendesk_auth. Defaults to an anonymous request.
+        missing_ok (bool, optional): Return None for a 404 instead of raising. Defaults to False.
+
+    Returns:
+        requests.Response | None: The response, None for a 404 if `missing_ok`.
+
+    Raises:
+        requests.HTTPError: For any other error status.
+    """
+    for attempt in range(ZENDESK_MAX_RETRIES + 1):
+        response = requests.request("GET", url, headers={"Content-Type": "application/json"}, auth=auth)
+
+        if response.status_code == 429 and attempt < ZENDESK_MAX_RETRIES:
+            time.sleep(float(response.headers.get("Retry-After", ZENDESK_RETRY_AFTER_SECONDS)))
+            continue
+        if response.status_code == 404 and missing_ok:
+            return None
+
+        response.raise_for_status()
+        return response
+
+
+@lru_cache(maxsize=1024)
+def get_zendesk_record(url: str) -> dict:
+    """
+    GET a section or category, each is requested once per process as every article of a section shares them.
+
+    Failures raise instead of returning, so only successful responses are cached.
+    """
+    return request_zendesk(url).json()
+
+
+def get_section_and_category(env, section_id):
+    section_objects = get_zendesk_record(env.get_zendesk_article_section_api_endpoint(section_id))
+    category_objects = get_zendesk_record(env.get_zendesk_article_category_api_endpoint(section_objects["section"]["category_id"]))
+
+    return (
+        section_objects["section"]["id"],
+        section_objects["section"]["name"],
+        category_objects["category"]["id"],
+        category_objects["category"]["name"],
+    )
+
+
+def iter_incremental_articles(azure_env: AzureEnv, start_time: int) -> Iterator[dict]:
+    """
+    Page through the articles changed since `start_time` with the help center incremental export.
+
+    The export returns articles in their source locale, drafts included and archived articles excluded,
+    ordered by updated_at. Its start_time is inclusive, so the last articles of a page may come again at
+    the start of the next. The export needs an admin's credentials, see AzureEnv.get_zendesk_auth.
+
+    Args:
+        azure_env (AzureEnv): The environment of the brand.
+        start_time (int): Unix time of the oldest change wanted, 0 for every article.
+
+    Yields:
+        dict: The pages, with "articles" and "end_time", the start_time of the next page.
+    """
+    url = azure_env.get_zendesk_incremental_article_api_endpoint(start_time)
+    while url:
+        page = request_zendesk(url, auth=azure_env.get_zendesk_auth()).json()
+        if not page["articles"]:
+            return
+
+        yield page
+
+        # An unchanged start_time would return the same page forever
+        url = page.get("next_page") if page["end_time"] != start_time else None
+        start_time = page["end_time"]
+
+
+def get_translation(azure_env: AzureEnv, article_id: str) -> dict | None:
+    """The article's translation in the environment's locale, None if it has none"""
+    response = request_zendesk(azure_env.get_zendesk_article_translation_api_endpoint(article_id), missing_ok=True)
+
+    return response.json()["translation"] if response is not None else None
+
+
+def iter_listed_articles(azure_env: AzureEnv) -> Iterator[dict]:
+    """Every article the help center lists in the environment's locale, page by page"""
+    page, page_count = 1, 1
+    while page <= page_count:
+        response = request_zendesk(azure_env.get_zendesk_article_api_endpoint(page)).json()
+        page_count = response["page_count"]
+
+        yield from response["articles"]
+        page += 1
+
+
+class ZendeskSyncState:
+    """
+    The incremental sync watermark of one brand and locale in a local JSON state file.
+
+    "start_time" is the end_time of the last incremental export page that was indexed, "article_ids" the
+    articles indexed since the last listing, and "reconciled" the Unix time of that listing. The file is
+    rewritten atomically, so a crash leaves the previous watermark.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state = {"start_time": None, "article_ids": [], "reconciled": None}
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.state = json.load(f)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
+
+    @property
+    def start_time(self) -> int | None:
+        return self.state["start_time"]
+
+    @property
+    def article_ids(self) -> set[str]:
+        return set(self.state["article_ids"])
+
+    def advance(self, start_time: int, indexed: list[str], deleted: list[str]) -> None:
+        """Move the watermark past a page whose changes were all applied"""
+        self.state["start_time"] = start_time
+        self.state["article_ids"] = sorted(self.article_ids.union(indexed).difference(deleted))
+        self.save()
+
+    def needs_reconcile(self) -> bool:
+        return self.state["reconciled"] is None or time.time() - self.state["reconciled"] > ZENDESK_RECONCILE_DAYS * 24 * 60 * 60
+
+    def reconciled(self, article_ids: list[str]) -> None:
+        self.state["article_ids"] = sorted(article_ids)
+        self.state["reconciled"] = int(time.time())
+        self.save()
@@ -0,0 +1,64 @@
+import os
+from pathlib import Path
+
+import numpy as np
+import questionary
+
+from benchmark import load_query_set
+from tools.azure_env import AzureEnv
+from tools.chunking import CHUNK_OVERSAMPLE
+from tools.hnsw_sweep import HNSW_MIN_RECALL, HNSW_SWEEP_QUERIES, HnswSweep
+from tools.local_vector_index import LocalVectorIndex
+
+backend_dir = Path(__file__).parent
+
+
+def sample_query_vectors(index: LocalVectorIndex, count: int = HNSW_SWEEP_QUERIES, seed: int = 0) -> np.ndarray:
+    """
+    Stand-in queries when there is no query set: one vector of each of randomly chosen documents.
+
+    The chosen documents are held out of the index, otherwise every query finds itself at distance zero and
+    the sweep overstates recall. At most half of the documents are held out.
+    """
+    present = index.present.reshape(len(index.vector_fields), len(index))
+    documents = np.flatnonzero(present.any(axis=0))
+    rng = np.random.default_rng(seed)
+
+    sampled = rng.choice(documents, size=min(count, len(documents) // 2), replace=False)
+    rows = [rng.choice(np.flatnonzero(present[:, document])) * len(index) + document for document in sampled]
+    query_vectors = index.matrix[rows].copy()
+
+    # The Title and Content vectors of a document are close, so hold out every field of it
+    present[:, sampled] = False
+
+    return query_vectors
+
+
+if __name__ == "__main__":
+    env = questionary.select("Which environment?", choices=["prod", "dev"]).ask()
+    brand = questionary.select("Which brand?", choices=["clo3d", "closet", "md", "allinone"]).ask()
+    azure_env = AzureEnv(env, brand)
+
+    export_path = questionary.path("Export?", default=os.path.join(backend_dir, "indexes", env, f"{azure_env.INDEX_NAME}.jsonl")).ask()
+    query_set_path = questionary.path("Query set (JSONL)? Leave empty to sample document vectors", default="").ask()
+    # Searches ask the index for k * CHUNK_OVERSAMPLE neighbours, so that is the recall that matters
+    k = int(questionary.text("k?", default=str(3 * CHUNK_OVERSAMPLE)).ask())
+    min_recall = float(questionary.text("Minimum recall?", default=str(HNSW_MIN_RECALL)).ask())
+
+    vectors_path = export_path.removesuffix(".jsonl") + ".vectors.jsonl"
+    index = LocalVectorIndex.load(export_path, vectors_path=vectors_path if os.path.exists(vectors_path) else None, use_hnsw=False)
+
+    if query_set_path:
+        query_vectors = azure_env.query_embedding_cache.get_many([query["question"] for query in load_query_set(query_set_path)])
+    else:
+        query_vectors = sample_query_vectors(index)
+        print(f"No query set, using {len(query_vectors)} held-out document vectors as synthetic queries")
+
+    sweep = HnswSweep(index, query_vectors, k=k, synthetic_queries=not query_set_path)
+    sweep.run()
+    sweep.print_results()
+
+    profile_path = os.path.join(backend_dir, "indexes", env, f"{azure_env.INDEX_NAME}.hnsw.json")
+    profile = sweep.write_profile(profile_path, min_recall=min_recall)
+    print(f"\nSelected {profile['algorithm']} m={profile['m']} ef_construction={profile['ef_construction']} ef_search={profile['ef_search']}")
+    print(f"Profile written to {profile_path}, Create Search Index in ai_search.py offers to use it")
@@ -1,3 +1,4 @@
+import asyncio
 import json
 import multiprocessing
 import os
@@ -12,7 +13,9 @@ from pytube import Channel, Playlist, extract
 from tqdm import tqdm
 from youtube_transcript_api import YouTubeTranscriptApi
 
+from tools.async_openai_helper import AsyncOpenAIHelper
 from tools.azure_env import AzureEnv
+from tools.indexing_batcher import index_documents, print_indexing_report
 from tools.misc import check_create_directory, logger, sanitize_directory_file_name
 
 ssl._create_default_https_context = ssl._create_stdlib_context
@@ -204,20 +207,45 @@ class YouTube:
         Returns:
             None
         """
-        print("Summarizing ", os.path.split(youtube_channel_dir_path)[1].strip() + "\n")
-
         environment = AzureEnv(env, brand)
 
+        async def summarize():
+            openai_helper = environment.create_async_openai_helper()
+            try:
+                await YouTube.async_summarize_transcripts(openai_helper, youtube_channel_dir_path)
+            finally:
+                await openai_helper.close()
+
+        asyncio.run(summarize())
+
+    @staticmethod
+    async def async_summarize_transcripts(openai_helper: AsyncOpenAIHelper, youtube_channel_dir_path: str):
+        """
+        Summarize all the transcripts in a file concurrently
+
+        Args:
+            openai_helper (AsyncOpenAIHelper): The helper used to request the summaries
+            youtube_channel_dir_path (str): The path to the file containing the transcripts
+
+        Returns:
+            None
+        """
+        print("Summarizing ", os.path.split(youtube_channel_dir_path)[1].strip() + "\n")
+
         # Read the transcripts from the file
         with open(youtube_channel_dir_path, "r", encoding="utf-8") as file:
             transcripts = json.load(file)
 
-        # Summarize each transcript
-        for index, trans in enumerate(transcripts):
-            if len(trans["Transcript"]) > 450:
-                summary = environment.openai_helper.generate_transcript_summary(trans["Transcript"])
-            else:
-                summary = ""
+        async def summarize(transcript):
+            if len(transcript["Transcript"]) > 450:
+                return await openai_helper.generate_transcript_summary(transcript["Transcript"])
+
+            return ""
+
+        # Summarize each transcript, the helper's semaphore bounds how many run at once
+        summaries = await asyncio.gather(*[summarize(transcript) for transcript in transcripts])
+
+        for index, summary in enumerate(summaries):
             transcripts[index]["Summary"] = summary
 
         with open(youtube_channel_dir_path, "w", encoding="utf-8") as file:
@@ -225,28 +253,32 @@ class YouTube:
 
     def mp_summarize_transcripts(self):
         """
-        Summarize transcripts of a youtube channel in parallel
+        Summarize transcripts of a youtube channel concurrently
 
-        This function will call `summarize_transcripts` on all files in `youtube_channel_dir_path`
-        in parallel using 5 processes.
+        This function will call `async_summarize_transcripts` on all files in `youtube_channel_dir_path`
+        from a single process, sharing one AsyncOpenAIHelper so that up to AZURE_OPENAI_MAX_CONCURRENCY
+        summaries are in flight at once.
 
-        See `summarize_transcripts` for more details on what is done.
+        See `async_summarize_transcripts` for more details on what is done.
         """
         # Get the list of files to process
         files = os.listdir(self.youtube_channel_dir_path)
 
-        # Create a list to store the parameters to pass to `summarize_transcripts`
-        summarize_transcripts_params = []
+        async def summarize_all():
+            openai_helper = self.azure_env.create_async_openai_helper()
+            try:
+                results = await asyncio.gather(
+                    *[YouTube.async_summarize_transcripts(openai_helper, os.path.join(self.youtube_channel_dir_path, file)) for file in files],
+                    return_exceptions=True,
+                )
+            finally:
+                await openai_helper.close()
 
-        # Iterate over the files and create the parameters
-        for file in files:
-            summarize_transcripts_params.append((self.azure_env.stage, self.azure_env.brand, os.path.join(self.youtube_channel_dir_path, file)))
+            for result in results:
+                if isinstance(result, Exception):
+                    print(result)
 
-        # Create a multiprocessing pool and process the files in parallel
-        with multiprocessing.Pool(3) as p:
-            p.starmap_async(YouTube.summarize_transcripts, summarize_transcripts_params, error_callback=lambda e: print(e))
-            p.close()
-            p.join()
+        asyncio.run(summarize_all())
 
     def upload_transcripts(self):
         files = os.listdir(self.youtube_channel_dir_path)
@@ -268,12 +300,21 @@ class YouTube:
                         "Title": transcript["Title"],
                         "Content": transcript["Summary"],
                         "YoutubeLinks": [transcript["Source"]],
-                        "titleVector": self.azure_env.openai_helper.generate_embeddings(text=transcript["Title"]),
-                        "contentVector": self.azure_env.openai_helper.generate_embeddings(text=transcript["Summary"]),
                     }
                 )
 
-            self.azure_env.search_client.upload_documents(upload_transcripts)
+            if len(upload_transcripts) == 0:
+                continue
+
+            vectors = self.azure_env.openai_helper.generate_embeddings_batch(
+                [transcript["Title"] for transcript in upload_transcripts] + [transcript["Content"] for transcript in upload_transcripts]
+            )
+
+            for i, transcript in enumerate(upload_transcripts):
+                transcript["TitleVector"] = vectors[i]
+                transcript["ContentVector"] = vectors[len(upload_transcripts) + i]
+
+            print_indexing_report(index_documents(self.azure_env.search_client, upload_transcripts))
 
 
 if __name__ == "__main__":